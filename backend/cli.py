@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+"""
+Operational CLI for the Telehealth AI Triage backend
+
+Bulk export/import of triage sessions, chat messages and consultations,
+traffic replay and triage classifier training.
+Run from the repository root, e.g.:
+
+    python backend/cli.py export ./dump --since 2024-01-01
+    python backend/cli.py import ./dump --upsert
+    python backend/cli.py replay capture.ndjson --speed 2 --out run.ndjson
+    python backend/cli.py train-classifier --activate
+"""
+
+import asyncio
+import json
+import math
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import typer
+from bson import ObjectId, json_util
+from bson.json_util import JSONOptions, JSONMode
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+BULK_COLLECTIONS = ["triage_sessions", "chat_messages", "consultations"]
+# Fields identifying a document when importing with --upsert
+NATURAL_KEYS = {
+    "triage_sessions": ("id",),
+    "consultations": ("id",),
+    "chat_messages": ("session_id", "sender", "timestamp"),
+}
+CHECKPOINT_FILE = ".checkpoint.json"
+# Relaxed extended JSON keeps dates round-trippable without bloating the file
+JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED)
+
+app = typer.Typer(help="Telehealth AI Triage operational commands")
+
+
+def get_db():
+    client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        tls=os.environ.get("MONGO_TLS", "true").lower() == "true",
+        compressors=os.environ.get("MONGO_COMPRESSORS") or None,
+    )
+    return client, client[os.environ['DB_NAME']]
+
+
+class Checkpoint:
+    """Per-collection progress persisted next to the data files"""
+    def __init__(self, directory: Path):
+        self.path = directory / CHECKPOINT_FILE
+        self.state: Dict[str, Any] = json_util.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def get(self, key: str) -> Any:
+        return self.state.get(key)
+
+    def clear(self, prefix: str):
+        self.state = {key: value for key, value in self.state.items() if not key.startswith(prefix)}
+        self.set_many({})
+
+    def set(self, key: str, value: Any):
+        self.set_many({key: value})
+
+    def set_many(self, values: Dict[str, Any]):
+        self.state.update(values)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json_util.dumps(self.state, json_options=JSON_OPTIONS))
+        tmp_path.replace(self.path)
+
+
+def timestamp_field(collection: str) -> str:
+    return "timestamp" if collection == "chat_messages" else "created_at"
+
+
+async def export_collection(db, collection: str, out_dir: Path, checkpoint: Checkpoint, fmt: str,
+                            batch_size: int, since: Optional[datetime], until: Optional[datetime]) -> int:
+    query: Dict[str, Any] = {}
+    time_range: Dict[str, Any] = {}
+    if since:
+        time_range["$gte"] = since
+    if until:
+        time_range["$lt"] = until
+    if time_range:
+        query[timestamp_field(collection)] = time_range
+    # Walking in _id order lets an interrupted export resume after the last
+    # batch that reached disk
+    last_id = checkpoint.get(f"export:{collection}")
+    if last_id is not None:
+        query["_id"] = {"$gt": last_id}
+
+    cursor = db[collection].find(query).sort("_id", 1).batch_size(batch_size)
+    exported = 0
+    part = checkpoint.get(f"export:{collection}:parts") or 0
+    batch: List[Dict[str, Any]] = []
+
+    # _id is kept so a batch written again after a crash, and a re-run
+    # import, collide on the primary key instead of duplicating documents
+    def flush_batch():
+        nonlocal part
+        if fmt == "ndjson":
+            with open(out_dir / f"{collection}.ndjson", "a") as f:
+                for doc in batch:
+                    f.write(json_util.dumps(doc, json_options=JSON_OPTIONS))
+                    f.write("\n")
+        else:
+            import pandas as pd
+            part += 1
+            frame = pd.DataFrame([{**doc, "_id": str(doc["_id"])} for doc in batch])
+            frame.to_parquet(out_dir / f"{collection}.part-{part:05d}.parquet", index=False)
+
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            last_id = batch[-1]["_id"]
+            exported += len(batch)
+            await asyncio.to_thread(flush_batch)
+            batch = []
+            checkpoint.set_many({f"export:{collection}": last_id, f"export:{collection}:parts": part})
+    if batch:
+        last_id = batch[-1]["_id"]
+        exported += len(batch)
+        await asyncio.to_thread(flush_batch)
+        checkpoint.set_many({f"export:{collection}": last_id, f"export:{collection}:parts": part})
+    return exported
+
+
+def require_pyarrow():
+    """Parquet support is optional; fail with an install hint instead of a traceback"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        typer.echo("Parquet files need pyarrow, which is not installed: pip install pyarrow", err=True)
+        raise typer.Exit(code=1)
+
+
+def iter_ndjson(path: Path, skip: int) -> Iterator[Dict[str, Any]]:
+    with open(path) as f:
+        for line_number, line in enumerate(f):
+            if line_number < skip or not line.strip():
+                continue
+            yield json_util.loads(line)
+
+
+def iter_parquet(paths: List[Path], skip: int) -> Iterator[Dict[str, Any]]:
+    import pyarrow.parquet as pq
+    seen = 0
+    for path in paths:
+        parquet_file = pq.ParquetFile(path)
+        for record_batch in parquet_file.iter_batches():
+            for row in record_batch.to_pylist():
+                seen += 1
+                if seen > skip:
+                    if ObjectId.is_valid(row.get("_id")):
+                        row["_id"] = ObjectId(row["_id"])
+                    yield row
+
+
+async def write_batch(db, collection: str, batch: List[Dict[str, Any]], upsert: bool) -> int:
+    try:
+        if upsert:
+            keys = NATURAL_KEYS.get(collection, ("id",))
+            # Matched documents keep their own _id, which is immutable
+            result = await db[collection].bulk_write(
+                [ReplaceOne({key: doc.get(key) for key in keys}, {k: v for k, v in doc.items() if k != "_id"},
+                            upsert=True) for doc in batch],
+                ordered=False
+            )
+            return result.upserted_count + result.modified_count
+        result = await db[collection].insert_many(batch, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Duplicates from a re-run are expected; anything else is fatal
+        errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+        if errors:
+            raise
+        return e.details.get("nInserted", 0) + e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+
+
+async def import_collection(db, collection: str, in_dir: Path, checkpoint: Checkpoint,
+                            batch_size: int, upsert: bool) -> int:
+    ndjson_path = in_dir / f"{collection}.ndjson"
+    parquet_paths = sorted(in_dir.glob(f"{collection}.part-*.parquet"))
+    done = checkpoint.get(f"import:{collection}") or 0
+    if ndjson_path.exists():
+        records = iter_ndjson(ndjson_path, done)
+    elif parquet_paths:
+        records = iter_parquet(parquet_paths, done)
+    else:
+        return 0
+
+    written = 0
+    batch: List[Dict[str, Any]] = []
+    for doc in records:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            written += await write_batch(db, collection, batch, upsert)
+            done += len(batch)
+            checkpoint.set(f"import:{collection}", done)
+            batch = []
+    if batch:
+        written += await write_batch(db, collection, batch, upsert)
+        done += len(batch)
+        checkpoint.set(f"import:{collection}", done)
+    return written
+
+
+async def run_parallel(jobs, workers: int):
+    semaphore = asyncio.Semaphore(workers)
+
+    async def bounded(job):
+        async with semaphore:
+            return await job
+
+    return await asyncio.gather(*(bounded(job) for job in jobs))
+
+
+@app.command("export")
+def export_command(
+    out_dir: Path = typer.Argument(..., help="Directory to write the export into"),
+    collection: List[str] = typer.Option(BULK_COLLECTIONS, "--collection", "-c", help="Collections to export"),
+    fmt: str = typer.Option("ndjson", "--format", help="ndjson or parquet"),
+    batch_size: int = typer.Option(1000, help="Documents per cursor batch and per write"),
+    since: Optional[datetime] = typer.Option(None, help="Only records created at or after this time"),
+    until: Optional[datetime] = typer.Option(None, help="Only records created before this time"),
+    workers: int = typer.Option(3, help="Collections exported concurrently"),
+    restart: bool = typer.Option(False, help="Discard previous output and checkpoints"),
+):
+    """Stream collections to NDJSON or Parquet files, resuming from the last checkpoint"""
+    if fmt not in ("ndjson", "parquet"):
+        raise typer.BadParameter("format must be ndjson or parquet")
+    if fmt == "parquet":
+        require_pyarrow()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint = Checkpoint(out_dir)
+    if restart:
+        for name in collection:
+            for path in [out_dir / f"{name}.ndjson", *out_dir.glob(f"{name}.part-*.parquet")]:
+                path.unlink(missing_ok=True)
+            checkpoint.clear(f"export:{name}")
+
+    async def run():
+        client, db = get_db()
+        try:
+            return await run_parallel(
+                [export_collection(db, name, out_dir, checkpoint, fmt, batch_size, since, until) for name in collection],
+                workers
+            )
+        finally:
+            client.close()
+
+    for name, count in zip(collection, asyncio.run(run())):
+        typer.echo(f"{name}: exported {count} documents")
+
+
+@app.command("import")
+def import_command(
+    in_dir: Path = typer.Argument(..., help="Directory produced by the export command"),
+    collection: List[str] = typer.Option(BULK_COLLECTIONS, "--collection", "-c", help="Collections to import"),
+    batch_size: int = typer.Option(1000, help="Documents per bulk write"),
+    upsert: bool = typer.Option(False, help="Replace existing documents by id instead of inserting"),
+    workers: int = typer.Option(3, help="Collections imported concurrently"),
+    restart: bool = typer.Option(False, help="Ignore previous import progress"),
+):
+    """Load exported files with unordered bulk writes, resuming from the last checkpoint"""
+    if any(not (in_dir / f"{name}.ndjson").exists() and any(in_dir.glob(f"{name}.part-*.parquet"))
+           for name in collection):
+        require_pyarrow()
+    checkpoint = Checkpoint(in_dir)
+    if restart:
+        for name in collection:
+            checkpoint.clear(f"import:{name}")
+
+    async def run():
+        client, db = get_db()
+        try:
+            return await run_parallel(
+                [import_collection(db, name, in_dir, checkpoint, batch_size, upsert) for name in collection],
+                workers
+            )
+        finally:
+            client.close()
+
+    for name, count in zip(collection, asyncio.run(run())):
+        typer.echo(f"{name}: imported {count} documents")
+
+
+# Traffic replay
+# Captures come from the server's TRAFFIC_CAPTURE_PATH log. Run the target
+# with LLM_MODE=fake so model latency is the recorded one, not a live call.
+def load_capture(path: Path) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record["t"])
+
+
+class Materializer:
+    """Turns captured payload shapes back into requests with live ids"""
+    def __init__(self):
+        self.ids: Dict[str, str] = {}
+        self.ice_port = 40000
+
+    def learn(self, tokens: Optional[Dict[str, str]], doc: Any):
+        if not tokens or not isinstance(doc, dict):
+            return
+        for field, token in tokens.items():
+            if isinstance(doc.get(field), str):
+                self.ids[token] = doc[field]
+
+    def __call__(self, shape: Any) -> Any:
+        if isinstance(shape, list):
+            return [self(item) for item in shape]
+        if not isinstance(shape, dict):
+            return shape
+        if "$id" in shape:
+            return self.ids.setdefault(shape["$id"], str(uuid.uuid4()))
+        if "$dt" in shape:
+            return datetime.utcnow().isoformat()
+        if "$str" in shape:
+            return "x" * shape["$str"]
+        if "$num" in shape:
+            return 10 ** (shape["$num"] - 1)
+        if "$bytes" in shape:
+            return b"\0" * shape["$bytes"]
+        if "$sdp" in shape:
+            return ("v=0\r\n" + "a=x\r\n" * (shape["$sdp"] // 5))[:shape["$sdp"]]
+        if "$ice" in shape:
+            self.ice_port += 1
+            return f"candidate:1 1 udp 2122260223 192.0.2.1 {self.ice_port} typ host"
+        return {key: self(value) for key, value in shape.items()}
+
+
+async def replay_http(client, record: Dict[str, Any], materialize: Materializer) -> Dict[str, Any]:
+    method, template = record["r"].split(" ", 1)
+    path = template.format(**{key: materialize(value) for key, value in (record.get("p") or {}).items()})
+    headers = {"X-Replay-LLM-Ms": str(record["llm"])} if record.get("llm") else {}
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, path, params=materialize(record.get("q")),
+                                        json=materialize(record.get("b")), headers=headers)
+        await response.aread()
+        status = response.status_code
+    except Exception as e:
+        return {"route": record["r"], "status": 0, "error": type(e).__name__,
+                "ms": (time.perf_counter() - started) * 1000, "original_ms": record.get("ms")}
+    if response.headers.get("content-type", "").startswith("application/json"):
+        try:
+            materialize.learn(record.get("ids"), response.json())
+        except ValueError:
+            pass
+    return {"route": record["r"], "status": status, "ms": (time.perf_counter() - started) * 1000,
+            "original_ms": record.get("ms")}
+
+
+async def replay_socket(clients: Dict[str, Any], target: str, record: Dict[str, Any],
+                        materialize: Materializer) -> Optional[Dict[str, Any]]:
+    import socketio
+    event, token = record["e"], record["c"]
+    started = time.perf_counter()
+    try:
+        if event == "connect":
+            if token in clients:
+                # Captures from before connect was de-duplicated record it twice
+                return None
+            clients[token] = socketio.AsyncClient()
+            await clients[token].connect(target, transports=["websocket"])
+        elif event == "disconnect":
+            client = clients.pop(token, None)
+            if client is None:
+                return None
+            await client.disconnect()
+        else:
+            client = clients.get(token)
+            if client is None:
+                return None
+            # Handlers acknowledge when asked, which gives a round-trip time.
+            # start_call's acknowledgement carries the new call id, which later
+            # signaling events refer to by the recorded pseudonym
+            ack = await client.call(event, materialize(record.get("b")) or {}, timeout=10)
+            materialize.learn(record.get("ids"), ack)
+    except Exception as e:
+        return {"route": f"SIO {event}", "status": 0, "error": type(e).__name__,
+                "ms": (time.perf_counter() - started) * 1000, "original_ms": record.get("ms")}
+    return {"route": f"SIO {event}", "status": 200, "ms": (time.perf_counter() - started) * 1000,
+            "original_ms": record.get("ms")}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    by_route: Dict[str, List[Dict[str, Any]]] = {}
+    for result in results:
+        by_route.setdefault(result["route"], []).append(result)
+    summary = {}
+    for route, items in by_route.items():
+        latencies = [item["ms"] for item in items if item["status"] and item["status"] < 500]
+        summary[route] = {
+            "count": len(items),
+            "errors": len(items) - len(latencies),
+            "p50": percentile(latencies, 0.5) if latencies else float("nan"),
+            "p95": percentile(latencies, 0.95) if latencies else float("nan"),
+        }
+    return summary
+
+
+@app.command("replay")
+def replay_command(
+    capture: Path = typer.Argument(..., help="NDJSON file written via TRAFFIC_CAPTURE_PATH"),
+    target: str = typer.Option("http://localhost:8001", help="Base URL of the instance to drive"),
+    speed: float = typer.Option(1.0, help="Time scale: 2 replays twice as fast, 0 sends as fast as possible"),
+    concurrency: int = typer.Option(64, help="Maximum requests in flight"),
+    sockets: bool = typer.Option(True, help="Replay Socket.IO events as well as HTTP requests"),
+    out: Optional[Path] = typer.Option(None, help="Write per-request results here for use as a baseline"),
+    baseline: Optional[Path] = typer.Option(None, help="Results of an earlier replay to compare against"),
+    threshold: float = typer.Option(0.10, help="p95 slowdown (fraction) reported as a regression"),
+):
+    """Re-drive captured traffic against an instance and report latency per route"""
+    records = load_capture(capture)
+    if sockets:
+        try:
+            import aiohttp  # noqa: F401  (python-socketio's asyncio client transport)
+        except ImportError:
+            typer.echo("aiohttp is not installed; skipping Socket.IO events", err=True)
+            sockets = False
+    if not sockets:
+        records = [record for record in records if record["k"] == "h"]
+
+    async def run():
+        import httpx
+        materialize = Materializer()
+        clients: Dict[str, Any] = {}
+        semaphore = asyncio.Semaphore(concurrency)
+        # Socket events for one connection keep their order; they are awaited inline
+        socket_lock: Dict[str, asyncio.Lock] = {}
+
+        async def drive(client, record):
+            async with semaphore:
+                if record["k"] == "h":
+                    return await replay_http(client, record, materialize)
+                async with socket_lock.setdefault(record["c"], asyncio.Lock()):
+                    return await replay_socket(clients, target, record, materialize)
+
+        async with httpx.AsyncClient(base_url=target, timeout=60) as client:
+            started = time.monotonic()
+            tasks = []
+            for record in records:
+                if speed > 0:
+                    delay = record["t"] / speed - (time.monotonic() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(drive(client, record)))
+            results = await asyncio.gather(*tasks)
+        for socket_client in clients.values():
+            await socket_client.disconnect()
+        return [result for result in results if result is not None]
+
+    results = asyncio.run(run())
+    if out:
+        out.write_text("".join(json.dumps(result) + "\n" for result in results))
+
+    summary = summarize(results)
+    reference = summarize([json.loads(line) for line in baseline.read_text().splitlines() if line.strip()]) \
+        if baseline else {}
+    regressions = []
+    typer.echo(f"{'route':<55} {'n':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'Δp95':>8}")
+    for route in sorted(summary):
+        stats = summary[route]
+        delta = ""
+        base = reference.get(route)
+        if base and not math.isnan(base["p95"]) and base["p95"] > 0:
+            change = stats["p95"] / base["p95"] - 1
+            delta = f"{change:+.0%}"
+            if change > threshold:
+                regressions.append(route)
+        typer.echo(f"{route:<55} {stats['count']:>6} {stats['errors']:>4} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {delta:>8}")
+    if regressions:
+        typer.echo(f"p95 regressed by more than {threshold:.0%} on: {', '.join(regressions)}", err=True)
+        raise typer.Exit(code=1)
+
+
+def classification_report(labels: List[str], truth: List[str], predicted: List[str]) -> Dict[str, Any]:
+    """Accuracy, macro-F1, per-class precision/recall and the confusion matrix"""
+    confusion = [[0] * len(labels) for _ in labels]
+    for actual, guess in zip(truth, predicted):
+        confusion[labels.index(actual)][labels.index(guess)] += 1
+    per_class = {}
+    for i, label in enumerate(labels):
+        true_positive = confusion[i][i]
+        predicted_count = sum(row[i] for row in confusion)
+        actual_count = sum(confusion[i])
+        precision = true_positive / predicted_count if predicted_count else 0.0
+        recall = true_positive / actual_count if actual_count else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        per_class[label] = {"precision": round(precision, 3), "recall": round(recall, 3),
+                            "f1": round(f1, 3), "support": actual_count}
+    # Under-triage: predicted less urgent than the label (labels run most to least urgent)
+    under = sum(confusion[i][j] for i in range(len(labels)) for j in range(i + 1, len(labels)))
+    present = [stats["f1"] for stats in per_class.values() if stats["support"]]
+    return {
+        "accuracy": round(sum(confusion[i][i] for i in range(len(labels))) / max(len(truth), 1), 3),
+        "macro_f1": round(sum(present) / max(len(present), 1), 3),
+        "under_triage_rate": round(under / max(len(truth), 1), 3),
+        "per_class": per_class,
+        "confusion": confusion,
+    }
+
+
+@app.command("train-classifier")
+def train_classifier_command(
+    out_dir: Path = typer.Option(ROOT_DIR / "models", help="Directory for versioned model files"),
+    test_fraction: float = typer.Option(0.2, help="Most recent share of sessions held out for evaluation"),
+    min_samples: int = typer.Option(200, help="Refuse to train on fewer labelled sessions"),
+    epochs: int = typer.Option(300),
+    activate: bool = typer.Option(False, help="Point CURRENT at the new model so the server loads it"),
+):
+    """Train the local triage classifier from stored LLM assessments"""
+    import numpy as np
+    import server
+
+    query = {
+        "urgency_level": {"$in": list(server.URGENCY_LEVELS)},
+        "symptoms": {"$ne": None},
+        # Learn only from model output: sessions without a source predate
+        # source tracking, where 0.6 marks the severity-threshold fallback
+        "$or": [{"assessment_source": "llm"},
+                {"assessment_source": {"$exists": False}, "confidence_score": {"$ne": 0.6}}],
+    }
+    projection = {"_id": 0, "symptoms": 1, "urgency_level": 1, "created_at": 1}
+
+    async def load():
+        client, db = get_db()
+        try:
+            docs = []
+            for collection in ("triage_sessions", "triage_sessions_archive"):
+                docs += await db[collection].find(query, projection).to_list(None)
+            return docs
+        finally:
+            client.close()
+
+    docs = sorted(asyncio.run(load()), key=lambda doc: doc.get("created_at") or datetime.min)
+    if len(docs) < min_samples:
+        typer.echo(f"Only {len(docs)} labelled sessions; need at least {min_samples}", err=True)
+        raise typer.Exit(code=1)
+
+    labels = list(server.URGENCY_LEVELS)
+    # Hold out the newest sessions so evaluation reflects drift as well as fit
+    split = int(len(docs) * (1 - test_fraction))
+    train, test = docs[:split], docs[split:]
+    train_features = server.classifier_features([doc["symptoms"] for doc in train])
+    test_features = server.classifier_features([doc["symptoms"] for doc in test])
+    targets = np.array([labels.index(doc["urgency_level"]) for doc in train])
+
+    started = time.perf_counter()
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    classifier = server.TriageClassifier.fit(train_features, targets, labels, epochs=epochs,
+                                             metadata={"version": version, "trained_at": version})
+    train_seconds = time.perf_counter() - started
+
+    truth = [doc["urgency_level"] for doc in test]
+    predicted = [labels[i] for i in classifier.predict_proba(test_features).argmax(axis=1)]
+    baseline = []
+    for doc in test:
+        try:
+            baseline.append(server.fallback_assessment(server.SymptomInput(**doc["symptoms"]))["urgency_level"])
+        except Exception:
+            baseline.append("Routine")
+    started = time.perf_counter()
+    for doc in test[:500]:
+        classifier.predict(doc["symptoms"])
+    predict_us = (time.perf_counter() - started) * 1e6 / max(min(len(test), 500), 1)
+
+    evaluation = {
+        "train_samples": len(train),
+        "test_samples": len(test),
+        "train_seconds": round(train_seconds, 2),
+        "predict_us": round(predict_us, 1),
+        "classifier": classification_report(labels, truth, predicted),
+        "threshold_fallback": classification_report(labels, truth, baseline),
+    }
+    classifier.metadata["evaluation"] = {key: value for key, value in evaluation.items()
+                                         if key not in ("classifier", "threshold_fallback")}
+    classifier.metadata["evaluation"].update(
+        {key: evaluation["classifier"][key] for key in ("accuracy", "macro_f1", "under_triage_rate")})
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model_file = out_dir / f"triage-classifier-{version}.npz"
+    classifier.save(model_file)
+    model_file.with_suffix(".report.json").write_text(json.dumps(evaluation, indent=2))
+
+    typer.echo(f"{'':<20} {'accuracy':>9} {'macro F1':>9} {'Emergency recall':>17} {'under-triage':>13}")
+    for name in ("classifier", "threshold_fallback"):
+        report = evaluation[name]
+        typer.echo(f"{name:<20} {report['accuracy']:>9.3f} {report['macro_f1']:>9.3f} "
+                   f"{report['per_class']['Emergency']['recall']:>17.3f} {report['under_triage_rate']:>13.3f}")
+    typer.echo(f"Trained on {len(train)} sessions in {train_seconds:.1f}s; {predict_us:.0f}µs per prediction")
+    typer.echo(f"Wrote {model_file}")
+    if activate:
+        (out_dir / "CURRENT").write_text(model_file.name + "\n")
+        typer.echo("Activated; POST /api/admin/triage-classifier/reload to serve it without a restart")
+
+
+if __name__ == "__main__":
+    app()
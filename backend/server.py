@@ -1,52 +1,478 @@
-from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Request, Response, Header, Depends
 from dotenv import load_dotenv
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReturnDocument
+from pymongo import monitoring
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
 import os
+import sys
 import logging
+import logging.handlers
+import queue
+import heapq
+import ipaddress
+import inspect
+import math
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextvars import ContextVar
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Awaitable, Callable
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import SimpleNamespace
 import json
+import re
+import zlib
+import hashlib
+import hmac
+import numpy as np
 import socketio
 from socketio import AsyncServer
 import asyncio
-import openai
+import functools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Structured logging
+# Records are handed to a queue on the event loop thread; formatting and the
+# stdout write happen on the QueueListener thread so bursts of socket events
+# never block the loop on I/O.
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+session_id_var: ContextVar[Optional[str]] = ContextVar("session_id", default=None)
+call_id_var: ContextVar[Optional[str]] = ContextVar("call_id", default=None)
+
+# High-volume events are logged once every N occurrences (1 = log everything)
+LOG_SAMPLE_EVERY = {
+    "webrtc_ice_candidate": int(os.environ.get("LOG_ICE_SAMPLE_EVERY", "100")),
+    "connect": int(os.environ.get("LOG_CONNECT_SAMPLE_EVERY", "1")),
+    "disconnect": int(os.environ.get("LOG_CONNECT_SAMPLE_EVERY", "1")),
+}
+_log_event_counts: Dict[str, int] = {}
+
+class JsonLogFormatter(logging.Formatter):
+    """Render log records as single-line JSON objects"""
+    def format(self, record):
+        payload = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("event", "request_id", "session_id", "call_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                payload[key] = value
+        fields = getattr(record, "fields", None)
+        if fields:
+            payload.update(fields)
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+class CorrelationQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that only attaches correlation IDs on the calling thread"""
+    def prepare(self, record):
+        # Context variables are only visible on the thread that logged, so
+        # capture them here; everything else is deferred to the listener.
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        if getattr(record, "session_id", None) is None:
+            record.session_id = session_id_var.get()
+        if getattr(record, "call_id", None) is None:
+            record.call_id = call_id_var.get()
+        return record
+
+def configure_logging() -> logging.handlers.QueueListener:
+    """Route all logging through a queue drained by a background listener
+
+    The listener is started and stopped by the app lifespan; records logged
+    before startup wait in the queue.
+    """
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if os.environ.get("LOG_FORMAT", "json") == "json":
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.handlers = [CorrelationQueueHandler(log_queue)]
+    root_logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    return logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+log_listener = configure_logging()
+logger = logging.getLogger(__name__)
+
+def log_event(event: str, message: str, level: int = logging.INFO, **fields):
+    """Log a named event, applying the per-event sampling rate"""
+    every = LOG_SAMPLE_EVERY.get(event, 1)
+    if every > 1:
+        count = _log_event_counts.get(event, 0) + 1
+        _log_event_counts[event] = count
+        if count % every != 1:
+            return
+        fields["sampled_every"] = every
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"event": event, "fields": fields})
+
 # MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url,tls=True)
-db = client[os.environ['DB_NAME']]
-
-# Create the main app without a prefix
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=False,  # Must be False when using wildcard origins
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters per server, fed by driver events"""
+    def __init__(self, max_pool_size: int):
+        self.max_pool_size = max_pool_size
+        self.pools: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        # Check-out start and finish are reported on the same driver thread
+        self._checkout_started = threading.local()
+
+    def _pool(self, address) -> Dict[str, float]:
+        key = f"{address[0]}:{address[1]}"
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = self.pools[key] = {
+                "open": 0, "checked_out": 0, "peak_checked_out": 0,
+                "checkouts": 0, "checkout_failures": 0, "checkout_wait_ms_total": 0.0, "cleared": 0,
+            }
+        return pool
+
+    def _bump(self, address, field: str, delta: float = 1):
+        with self._lock:
+            self._pool(address)[field] += delta
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump(event.address, "cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump(event.address, "open")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump(event.address, "open", -1)
+
+    def connection_check_out_started(self, event):
+        self._checkout_started.value = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._bump(event.address, "checkout_failures")
+
+    def connection_checked_out(self, event):
+        started = getattr(self._checkout_started, "value", None)
+        waited_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["checkouts"] += 1
+            pool["checkout_wait_ms_total"] += waited_ms
+            pool["checked_out"] += 1
+            pool["peak_checked_out"] = max(pool["peak_checked_out"], pool["checked_out"])
+
+    def connection_checked_in(self, event):
+        self._bump(event.address, "checked_out", -1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            pools = {}
+            for address, pool in self.pools.items():
+                pools[address] = {
+                    **pool,
+                    "checkout_wait_ms_avg": round(pool["checkout_wait_ms_total"] / pool["checkouts"], 3)
+                    if pool["checkouts"] else 0.0,
+                    "saturation": round(pool["checked_out"] / self.max_pool_size, 3) if self.max_pool_size else 0.0,
+                }
+        return {"max_pool_size": self.max_pool_size, "pools": pools}
+
+def mongo_client_options() -> Dict[str, Any]:
+    """Driver options from MONGO_* environment variables"""
+    options: Dict[str, Any] = {
+        "tls": os.environ.get("MONGO_TLS", "true").lower() == "true",
+        "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_MS", "300000")),
+        "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+        "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    }
+    # e.g. "zstd,snappy,zlib"; zstd and snappy need the zstandard and
+    # python-snappy packages, the driver skips any it cannot load
+    if os.environ.get("MONGO_COMPRESSORS"):
+        options["compressors"] = os.environ["MONGO_COMPRESSORS"]
+    return options
+
+class MongoResources:
+    """Mongo client created on first use rather than at import
+
+    Importing this module must not need MONGO_URL or start driver threads;
+    the lifespan handler warms the client during startup instead.
+    """
+    def __init__(self):
+        self.pool_metrics = PoolMetrics(0)
+        self._client: Optional[AsyncIOMotorClient] = None
+        self._db = None
+        self._read_db = None
+
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        if self._client is None:
+            options = mongo_client_options()
+            self.pool_metrics.max_pool_size = options["maxPoolSize"]
+            self._client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[self.pool_metrics], **options)
+        return self._client
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = self.client[os.environ['DB_NAME']]
+        return self._db
+
+    @property
+    def read_db(self):
+        # Dashboard and analytics reads tolerate bounded staleness and are
+        # routed to secondaries so they do not compete with triage writes on
+        # the primary. Without secondaries they fall back to the primary.
+        if self._read_db is None:
+            self._read_db = self.client.get_database(
+                os.environ['DB_NAME'],
+                read_preference=SecondaryPreferred(max_staleness=int(os.environ.get("MONGO_MAX_STALENESS_S", "90")))
+            )
+        return self._read_db
+
+    async def warm(self):
+        await self.db.command("ping")
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = self._db = self._read_db = None
+
+class LazyProxy:
+    """Forward attribute and item access to an object resolved on first use"""
+    __slots__ = ("_resolve",)
+
+    def __init__(self, resolve: Callable[[], Any]):
+        object.__setattr__(self, "_resolve", resolve)
+
+    def __getattr__(self, name: str):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, name: str):
+        return self._resolve()[name]
+
+mongo = MongoResources()
+pool_metrics = mongo.pool_metrics
+db = LazyProxy(lambda: mongo.db)
+read_db = LazyProxy(lambda: mongo.read_db)
 
+# Projection applied to every read that is returned to clients, so Mongo's
+# ObjectId never reaches the response encoder
+NO_MONGO_ID = {"_id": 0}
 
+# Collection version counters backing the ETags of polled endpoints. Every
+# write path bumps the collections it touches, so a matching If-None-Match
+# can be answered before any query runs. Counters are per process; BOOT_ID
+# keeps ETags from one process from validating against another. Writes made
+# by other workers, the archiver or the CLI only reach this process through
+# the change feed, which bumps the counters for every change it sees. Without
+# change streams (no replica set, or CHANGE_FEED_ENABLED=false) the ETags are
+# only correct when a single worker writes to the database.
+BOOT_ID = uuid.uuid4().hex[:8]
+collection_versions: Dict[str, int] = {
+    "consultations": 0,
+    "patients": 0,
+    "providers": 0,
+    "triage_sessions": 0,
+}
+
+def bump_version(*collections: str):
+    for name in collections:
+        collection_versions[name] += 1
+
+def collection_etag(*collections: str, extra: str = "") -> str:
+    versions = ".".join(str(collection_versions[name]) for name in collections)
+    return f'W/"{BOOT_ID}-{versions}{"-" + extra if extra else ""}"'
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return a 304 when the client already holds this ETag, else tag the response"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# Streamed NDJSON routes. Starlette's compressors buffer a streamed body
+# until it ends, which would deliver every line at once
+UNCOMPRESSED_PATHS = frozenset({"/api/triage/batch"})
+
+class SelectiveCompression:
+    """Wrap a compression middleware, bypassing it for UNCOMPRESSED_PATHS"""
+    def __init__(self, app, compressor, **options):
+        self.app = app
+        self.compressed = compressor(app, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+        else:
+            await self.compressed(scope, receive, send)
+
+def add_compression(application: FastAPI):
+    """Compress large payloads; Brotli is used when brotli-asgi is installed
+    and the client accepts it, with gzip as the fallback"""
+    try:
+        from brotli_asgi import BrotliMiddleware
+        application.add_middleware(SelectiveCompression, compressor=BrotliMiddleware,
+                                   minimum_size=1024, gzip_fallback=True)
+    except ImportError:
+        application.add_middleware(SelectiveCompression, compressor=GZipMiddleware, minimum_size=1024)
+
+async def correlation_id_middleware(request: Request, call_next):
+    """Tag every request with an ID that follows it through the logs"""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
 
 # Create Socket.IO server for WebRTC signaling
 sio = AsyncServer(cors_allowed_origins="http://localhost:3000", async_mode="asgi")
-socket_app = socketio.ASGIApp(socketio_server=sio, other_asgi_app=app)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
-app.include_router(api_router)
 
 # WebRTC connection management
-active_calls = {}  # call_id -> {patient_socket, provider_socket, status}
-waiting_room = {}  # patient_id -> {socket_id, triage_data, wait_time}
+# Records use __slots__ so tens of thousands of live calls stay small, and
+# the registry keeps a (call_id, sid) -> peer sid map so relaying a signal
+# is one dict lookup that also rejects sockets outside the call.
+class CallRecord:
+    """A call between a patient socket and a provider socket"""
+    __slots__ = ("call_id", "consultation_id", "patient_socket", "provider_socket", "provider_id", "status")
+
+    def __init__(self, call_id: str, consultation_id: Optional[str], patient_socket: str, provider_socket: str,
+                 provider_id: Optional[str] = None, status: str = "connecting"):
+        self.call_id = call_id
+        self.consultation_id = consultation_id
+        self.patient_socket = patient_socket
+        self.provider_socket = provider_socket
+        self.provider_id = provider_id
+        self.status = status
+
+class WaitingEntry:
+    """A patient socket waiting for a consultation to start"""
+    __slots__ = ("consultation_id", "socket_id", "triage_data", "joined_at")
+
+    def __init__(self, consultation_id: str, socket_id: str, triage_data: Optional[Dict[str, Any]] = None,
+                 joined_at: Optional[datetime] = None):
+        self.consultation_id = consultation_id
+        self.socket_id = socket_id
+        self.triage_data = triage_data
+        self.joined_at = joined_at or datetime.utcnow()
+
+class CallRegistry:
+    """Active calls indexed by id, by participant socket and by peer"""
+    def __init__(self):
+        self.calls: Dict[str, CallRecord] = {}
+        self.peers: Dict[tuple, str] = {}  # (call_id, sid) -> other participant's sid
+        # A socket is almost always in one call, and a one-item list is a
+        # third the size of a one-item set
+        self.by_socket: Dict[str, List[str]] = {}  # sid -> call ids
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+    def __contains__(self, call_id: str) -> bool:
+        return call_id in self.calls
+
+    def get(self, call_id: str) -> Optional[CallRecord]:
+        return self.calls.get(call_id)
+
+    def values(self) -> List[CallRecord]:
+        return list(self.calls.values())
+
+    def add(self, call: CallRecord):
+        self.calls[call.call_id] = call
+        self.peers[(call.call_id, call.patient_socket)] = call.provider_socket
+        self.peers[(call.call_id, call.provider_socket)] = call.patient_socket
+        for sid in (call.patient_socket, call.provider_socket):
+            self.by_socket.setdefault(sid, []).append(call.call_id)
+
+    def remove(self, call_id: str) -> Optional[CallRecord]:
+        call = self.calls.pop(call_id, None)
+        if call is None:
+            return None
+        for sid in (call.patient_socket, call.provider_socket):
+            self.peers.pop((call_id, sid), None)
+            call_ids = self.by_socket.get(sid)
+            if call_ids is not None and call_id in call_ids:
+                call_ids.remove(call_id)
+                if not call_ids:
+                    del self.by_socket[sid]
+        return call
+
+    def peer(self, call_id: str, sid: str) -> Optional[str]:
+        return self.peers.get((call_id, sid))
+
+    def for_socket(self, sid: str) -> List[CallRecord]:
+        return [self.calls[call_id] for call_id in self.by_socket.get(sid, ())]
+
+class WaitingRoom:
+    """Waiting patients indexed by consultation and by socket"""
+    def __init__(self):
+        self.entries: Dict[str, WaitingEntry] = {}
+        self.by_socket: Dict[str, List[str]] = {}  # sid -> consultation ids
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, consultation_id: str) -> bool:
+        return consultation_id in self.entries
+
+    def get(self, consultation_id: str) -> Optional[WaitingEntry]:
+        return self.entries.get(consultation_id)
+
+    def add(self, entry: WaitingEntry):
+        self.remove(entry.consultation_id)
+        self.entries[entry.consultation_id] = entry
+        self.by_socket.setdefault(entry.socket_id, []).append(entry.consultation_id)
+
+    def remove(self, consultation_id: str) -> Optional[WaitingEntry]:
+        entry = self.entries.pop(consultation_id, None)
+        if entry is not None:
+            consultation_ids = self.by_socket.get(entry.socket_id)
+            if consultation_ids is not None and consultation_id in consultation_ids:
+                consultation_ids.remove(consultation_id)
+                if not consultation_ids:
+                    del self.by_socket[entry.socket_id]
+        return entry
+
+    def for_socket(self, sid: str) -> List[str]:
+        return list(self.by_socket.get(sid, ()))
+
+active_calls = CallRegistry()
+waiting_room = WaitingRoom()
 
 # Models
 class StatusCheck(BaseModel):
@@ -76,6 +502,7 @@ class TriageSession(BaseModel):
     ai_analysis: Optional[str] = None
     recommended_actions: Optional[List[str]] = None
     confidence_score: Optional[float] = None
+    assessment_source: Optional[str] = None  # llm, cache, rules, classifier, fallback
     status: str = "pending"  # pending, in_consultation, completed
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -86,6 +513,15 @@ class ChatMessage(BaseModel):
     sender: str  # 'user' or 'ai'
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+class TriageSessionView(BaseModel):
+    session: TriageSession
+    chat_history: List[ChatMessage]
+    has_older_chat: bool = False
+
+class ChatHistoryPage(BaseModel):
+    messages: List[ChatMessage]
+    next_before: Optional[datetime] = None
+
 class ChatResponse(BaseModel):
     response: str
     follow_up_questions: Optional[List[str]] = None
@@ -95,7 +531,8 @@ class VideoConsultation(BaseModel):
     triage_session_id: str
     patient_id: str
     provider_id: Optional[str] = None
-    status: str = "waiting"  # waiting, in_progress, completed, cancelled
+    urgency_level: Optional[str] = None  # copied from the triage session at creation
+    status: str = "waiting"  # waiting, in_progress, completed, cancelled, abandoned
     scheduled_time: Optional[datetime] = None
     started_at: Optional[datetime] = None
     ended_at: Optional[datetime] = None
@@ -117,7 +554,7 @@ class Provider(BaseModel):
 class Patient(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
-    email: str
+    email: Optional[str] = None
     phone: Optional[str] = None
     date_of_birth: Optional[datetime] = None
     emergency_contact: Optional[str] = None
@@ -125,26 +562,1547 @@ class Patient(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 # Helper function to call OpenAI Chat API
-async def call_openai_chat(session_id: str, user_message: str, system_message: str = None):
-    openai.api_key = os.environ["OPENAI_API_KEY"]
+_openai_client = None
+
+def get_openai_client():
+    """Shared AsyncOpenAI client; the SDK is imported on first use"""
+    global _openai_client
+    if _openai_client is None:
+        import openai
+        _openai_client = openai.AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    return _openai_client
+
+async def warm_openai():
+    """Import the SDK and open a connection to the API ahead of the first triage"""
+    if os.environ.get("LLM_WARMUP", "true").lower() != "true" or not os.environ.get("OPENAI_API_KEY") \
+            or os.environ.get("LLM_MODE") == "fake":
+        return
+    try:
+        await asyncio.wait_for(get_openai_client().models.list(), timeout=5)
+    except Exception:
+        logger.warning("LLM warm-up failed; the first request will connect", exc_info=True)
+
+class LLMHealth:
+    """Passive record of recent LLM call outcomes for readiness reporting"""
+    def __init__(self, degraded_after_failures: int = 3):
+        self.degraded_after_failures = degraded_after_failures
+        self.consecutive_failures = 0
+        self.last_success_at: Optional[datetime] = None
+        self.last_failure_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_latency_ms: Optional[float] = None
+
+    def success(self, latency_s: float):
+        self.consecutive_failures = 0
+        self.last_success_at = datetime.utcnow()
+        self.last_latency_ms = round(latency_s * 1000, 1)
+
+    def failure(self, error: Exception):
+        self.consecutive_failures += 1
+        self.last_failure_at = datetime.utcnow()
+        self.last_error = type(error).__name__
+
+    @property
+    def degraded(self) -> bool:
+        return self.consecutive_failures >= self.degraded_after_failures
+
+llm_health = LLMHealth()
+
+# LLM token and cost accounting
+# USD per million tokens (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+DEFAULT_MODEL = "gpt-4o"
+
+class LLMBudgetExceeded(Exception):
+    """Raised instead of calling the LLM when a session or the instance is over budget"""
+
+class LLMUsageTracker:
+    """Token and cost totals per session, endpoint and day
+
+    Usage is aggregated in memory and flushed with one bulk_write per
+    collection each interval. Session totals also drive budget enforcement:
+    past the soft limit calls are downgraded to the cheaper model, past the
+    hard limit the caller gets LLMBudgetExceeded and uses the local fallback.
+    """
+    def __init__(self, session_token_budget: int = 0, daily_cost_budget: float = 0.0,
+                 downgrade_model: str = "gpt-4o-mini", flush_interval: float = 10.0,
+                 max_sessions: int = 50_000):
+        self.session_token_budget = session_token_budget
+        self.daily_cost_budget = daily_cost_budget
+        self.downgrade_model = downgrade_model
+        self.flush_interval = flush_interval
+        self.max_sessions = max_sessions
+        self.session_tokens: "OrderedDict[str, int]" = OrderedDict()
+        self.day = datetime.utcnow().strftime("%Y-%m-%d")
+        self.day_cost = 0.0
+        self.day_totals: Dict[tuple, Dict[str, float]] = {}
+        self._pending_daily: Dict[tuple, Counter] = {}
+        self._pending_sessions: Dict[str, Counter] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = MODEL_PRICES.get(model, MODEL_PRICES[DEFAULT_MODEL])
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def _roll_day(self):
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        if today != self.day:
+            self.day, self.day_cost, self.day_totals = today, 0.0, {}
+
+    def choose_model(self, session_id: str, requested: str) -> str:
+        """Model to use for this call; raises LLMBudgetExceeded when over the hard limit"""
+        self._roll_day()
+        used = self.session_tokens.get(session_id, 0)
+        if self.session_token_budget and used >= 2 * self.session_token_budget:
+            raise LLMBudgetExceeded(f"Session token budget exceeded ({used} tokens)")
+        if self.daily_cost_budget and self.day_cost >= self.daily_cost_budget:
+            raise LLMBudgetExceeded(f"Daily LLM budget exceeded (${self.day_cost:.2f})")
+        return self.downgrade_model if self.over_soft_limit(session_id) else requested
+
+    def over_soft_limit(self, session_id: str) -> bool:
+        """Whether calls for this session are currently downgraded"""
+        self._roll_day()
+        used = self.session_tokens.get(session_id, 0)
+        return bool((self.session_token_budget and used >= self.session_token_budget) or
+                    (self.daily_cost_budget and self.day_cost >= 0.8 * self.daily_cost_budget))
+
+    def record(self, session_id: str, endpoint: str, model: str, usage):
+        if usage is None:
+            return
+        self._roll_day()
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cost = self.cost(model, prompt_tokens, completion_tokens)
+        self.day_cost += cost
+
+        total = prompt_tokens + completion_tokens
+        self.session_tokens[session_id] = self.session_tokens.pop(session_id, 0) + total
+        if len(self.session_tokens) > self.max_sessions:
+            self.session_tokens.popitem(last=False)
+
+        key = (self.day, endpoint, model)
+        for bucket in (self.day_totals.setdefault(key, Counter()), self._pending_daily.setdefault(key, Counter())):
+            bucket.update({"calls": 1, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens})
+            bucket["cost_usd"] += cost
+        session_bucket = self._pending_sessions.setdefault(session_id, Counter())
+        session_bucket.update({"calls": 1, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens})
+        session_bucket["cost_usd"] += cost
+
+    @staticmethod
+    async def _write(collection, batch: Dict[Any, Counter], key_filter: Callable[[Any], Dict[str, Any]],
+                     now: datetime) -> Dict[Any, Counter]:
+        """Apply one pending batch; returns the totals that were not written"""
+        if not batch:
+            return {}
+        keys = list(batch)
+        try:
+            await collection.bulk_write([
+                UpdateOne(key_filter(key), {"$inc": dict(batch[key]), "$set": {"updated_at": now}}, upsert=True)
+                for key in keys
+            ], ordered=False)
+            return {}
+        except BulkWriteError as e:
+            # Unordered: everything but the failed operations was applied
+            logger.exception("LLM usage flush to %s partially failed", collection.name)
+            return {keys[error["index"]]: batch[keys[error["index"]]] for error in e.details.get("writeErrors", [])}
+        except Exception:
+            logger.exception("LLM usage flush to %s failed", collection.name)
+            return batch
+
+    async def flush(self):
+        daily, self._pending_daily = self._pending_daily, {}
+        sessions, self._pending_sessions = self._pending_sessions, {}
+        now = datetime.utcnow()
+        failed_daily, failed_sessions = daily, sessions
+        try:
+            failed_daily = await self._write(
+                db.llm_usage_daily, daily, lambda key: {"day": key[0], "endpoint": key[1], "model": key[2]}, now
+            )
+            failed_sessions = await self._write(
+                db.llm_usage_sessions, sessions, lambda session_id: {"session_id": session_id}, now
+            )
+        finally:
+            # Keep unwritten usage for the next flush rather than losing it,
+            # including a batch whose write was cancelled at shutdown
+            for pending, failed in ((self._pending_daily, failed_daily), (self._pending_sessions, failed_sessions)):
+                for key, totals in failed.items():
+                    pending.setdefault(key, Counter()).update(totals)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._roll_day()
+        top_sessions = sorted(self.session_tokens.items(), key=lambda item: item[1], reverse=True)[:10]
+        return {
+            "day": self.day,
+            "cost_usd": round(self.day_cost, 4),
+            "daily_cost_budget_usd": self.daily_cost_budget or None,
+            "session_token_budget": self.session_token_budget or None,
+            "by_endpoint": [
+                {"endpoint": endpoint, "model": model, **{k: round(v, 4) for k, v in totals.items()}}
+                for (_, endpoint, model), totals in self.day_totals.items()
+            ],
+            "top_sessions": [{"session_id": session_id, "tokens": tokens} for session_id, tokens in top_sessions],
+        }
+
+llm_usage = LLMUsageTracker(
+    session_token_budget=int(os.environ.get("LLM_SESSION_TOKEN_BUDGET", "0")),
+    daily_cost_budget=float(os.environ.get("LLM_DAILY_COST_BUDGET_USD", "0")),
+    downgrade_model=os.environ.get("LLM_DOWNGRADE_MODEL", "gpt-4o-mini"),
+    flush_interval=float(os.environ.get("LLM_USAGE_FLUSH_INTERVAL_S", "10")),
+)
+
+# A deterministic stand-in for the OpenAI API, for load tests and traffic
+# replays. Latency comes from the replayed request when one is given.
+LLM_MODE = os.environ.get("LLM_MODE", "openai")
+FAKE_LLM_LATENCY_MS = float(os.environ.get("FAKE_LLM_LATENCY_MS", "0"))
+llm_elapsed_var: ContextVar[Optional[list]] = ContextVar("llm_elapsed", default=None)
+replay_llm_ms_var: ContextVar[Optional[float]] = ContextVar("replay_llm_ms", default=None)
+
+async def fake_chat_completion(messages: List[Dict[str, str]]):
+    replay_ms = replay_llm_ms_var.get()
+    if replay_ms is not None:
+        # Only the first call of a replayed request carries its recorded latency
+        replay_llm_ms_var.set(None)
+    await asyncio.sleep((FAKE_LLM_LATENCY_MS if replay_ms is None else replay_ms) / 1000)
+    prompt = messages[-1]["content"]
+    severity_match = re.search(r"Severity: (\d+)/10", prompt)
+    severity = int(severity_match.group(1)) if severity_match else 3
+    if any(emergency in prompt.lower() for emergency in EMERGENCY_SYMPTOMS):
+        urgency = "Emergency"
+    else:
+        urgency = "Urgent" if severity >= 7 else "Routine" if severity >= 4 else "Self-Care"
+    content = json.dumps({
+        "analysis": f"Simulated assessment for severity {severity}.",
+        "urgency_level": urgency,
+        "confidence_score": 0.9,
+        "recommended_actions": ["Consult with a healthcare provider"],
+        "follow_up_questions": []
+    })
+    usage = SimpleNamespace(prompt_tokens=sum(len(m["content"]) for m in messages) // 4,
+                            completion_tokens=len(content) // 4)
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+async def call_openai_chat(session_id: str, user_message: str, system_message: str = None,
+                           endpoint: str = "chat", model: str = DEFAULT_MODEL):
+    model = llm_usage.choose_model(session_id, model)
     messages = []
     if system_message:
         messages.append({"role": "system", "content": system_message})
     messages.append({"role": "user", "content": user_message})
-    response = await openai.AsyncOpenAI().chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=512,
-        temperature=0.2,
-        user=session_id
-    )
+    started = time.perf_counter()
+    try:
+        if LLM_MODE == "fake":
+            response = await fake_chat_completion(messages)
+        else:
+            response = await get_openai_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=512,
+                temperature=0.2,
+                user=session_id
+            )
+    except Exception as e:
+        llm_health.failure(e)
+        raise
+    elapsed = time.perf_counter() - started
+    llm_health.success(elapsed)
+    llm_elapsed = llm_elapsed_var.get()
+    if llm_elapsed is not None:
+        llm_elapsed[0] += elapsed * 1000
+    llm_usage.record(session_id, endpoint, model, response.usage)
     return response.choices[0].message.content
 
+# Model routing
+# First passes and chat clarifications go to the fast tier; the answer is
+# escalated to the strong tier when it is low-confidence, high-urgency or
+# malformed. Presentations that are obviously serious skip the fast tier.
+URGENCY_LEVELS = ("Emergency", "Urgent", "Routine", "Self-Care")
+EMERGENCY_SYMPTOMS = ("chest pain", "difficulty breathing", "severe bleeding")
+
+def parse_assessment(text: str) -> Optional[Dict[str, Any]]:
+    """Parse and validate a JSON triage assessment; None when it is unusable"""
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.strip("`")
+        if cleaned.startswith("json"):
+            cleaned = cleaned[4:]
+    try:
+        data = json.loads(cleaned)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    urgency = {level.lower(): level for level in URGENCY_LEVELS}.get(str(data.get("urgency_level", "")).strip().lower())
+    if urgency is None:
+        return None
+    data["urgency_level"] = urgency
+    try:
+        confidence = float(data.get("confidence_score"))
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= confidence <= 1:
+        return None
+    data["confidence_score"] = confidence
+    if not isinstance(data.get("analysis"), str) or not isinstance(data.get("recommended_actions", []), list):
+        return None
+    return data
+
+class ModelRouter:
+    """Fast-tier-first LLM routing with confidence based escalation"""
+    def __init__(self, fast_model: str, strong_model: str, min_confidence: float):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.min_confidence = min_confidence
+        self.decisions: Counter = Counter()
+        self.latency: Dict[str, RunningStat] = {}
+
+    def _observe(self, tier: str, seconds: float):
+        self.latency.setdefault(tier, RunningStat()).add(seconds * 1000)
+
+    def escalation_reason(self, text: str, structured: bool) -> Optional[str]:
+        assessment = parse_assessment(text)
+        if assessment is None:
+            return "invalid" if structured else None
+        if assessment["urgency_level"] in ("Emergency", "Urgent"):
+            return "high_urgency"
+        if assessment["confidence_score"] < self.min_confidence:
+            return "low_confidence"
+        return None
+
+    async def complete(self, session_id: str, user_message: str, system_message: str, endpoint: str,
+                       structured: bool = True, force_strong: bool = False) -> str:
+        """Return the routed completion text
+
+        structured=False is for free-text chat, where a non-JSON reply is
+        acceptable and only a parsed high-urgency/low-confidence answer escalates.
+        """
+        if force_strong or self.fast_model == self.strong_model:
+            self.decisions["strong_direct"] += 1
+            return await self._call("strong", session_id, user_message, system_message, endpoint)
+        text = await self._call("fast", session_id, user_message, system_message, endpoint)
+        reason = self.escalation_reason(text, structured)
+        if reason is None:
+            self.decisions["fast_accepted"] += 1
+            return text
+        if self.resolved_model("strong", session_id) == self.resolved_model("fast", session_id):
+            # Over the soft budget both tiers are the downgrade model; a second
+            # call would pay for the same answer again
+            self.decisions[f"escalation_skipped_{reason}"] += 1
+            return text
+        self.decisions[f"escalated_{reason}"] += 1
+        log_event("model_escalated", "Escalating to strong model", endpoint=endpoint, reason=reason)
+        return await self._call("strong", session_id, user_message, system_message, endpoint)
+
+    def resolved_model(self, tier: str, session_id: str) -> str:
+        """The model a call on this tier will actually use after budget downgrades"""
+        if llm_usage.over_soft_limit(session_id):
+            return llm_usage.downgrade_model
+        return self.fast_model if tier == "fast" else self.strong_model
+
+    async def _call(self, tier: str, session_id: str, user_message: str, system_message: str, endpoint: str) -> str:
+        model = self.fast_model if tier == "fast" else self.strong_model
+        started = time.perf_counter()
+        text = await call_openai_chat(session_id, user_message, system_message, endpoint=endpoint, model=model)
+        self._observe(tier, time.perf_counter() - started)
+        return text
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "fast_model": self.fast_model,
+            "strong_model": self.strong_model,
+            "min_confidence": self.min_confidence,
+            "decisions": dict(self.decisions),
+            "latency_ms": {
+                tier: {"calls": stat.count, "mean": round(stat.mean, 1), "std": round(math.sqrt(stat.var), 1)}
+                for tier, stat in self.latency.items()
+            },
+        }
+
+model_router = ModelRouter(
+    fast_model=os.environ.get("LLM_FAST_MODEL", "gpt-4o-mini"),
+    strong_model=os.environ.get("LLM_STRONG_MODEL", DEFAULT_MODEL),
+    min_confidence=float(os.environ.get("LLM_ESCALATE_BELOW_CONFIDENCE", "0.75")),
+)
+
+def needs_strong_model(symptoms: "SymptomInput") -> bool:
+    reported = [s.lower() for s in symptoms.symptoms + symptoms.associated_symptoms]
+    return symptoms.severity >= 8 or any(emergency in reported for emergency in EMERGENCY_SYMPTOMS)
+
+# Triage assessment cache
+class HashingVectorizer:
+    """Character n-gram hashing vectorizer with stable (crc32) bucket ids"""
+    def __init__(self, n_features: int = 1024, ngram_range: tuple = (3, 5)):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+
+    def indices(self, text: str) -> np.ndarray:
+        padded = f" {' '.join(text.lower().split())} "
+        low, high = self.ngram_range
+        return np.fromiter(
+            (zlib.crc32(padded[i:i + n].encode()) % self.n_features
+             for n in range(low, high + 1) for i in range(len(padded) - n + 1)),
+            dtype=np.int64
+        )
+
+    def counts(self, text: str) -> np.ndarray:
+        return np.bincount(self.indices(text), minlength=self.n_features).astype(np.float32)
+
+def symptom_text(symptoms: Dict[str, Any]) -> str:
+    return " | ".join([
+        symptoms.get("location") or "",
+        ", ".join(symptoms.get("symptoms") or []),
+        ", ".join(symptoms.get("associated_symptoms") or []),
+        symptoms.get("duration") or "",
+    ])
+
+def age_group(age: Optional[int]) -> str:
+    if age is None:
+        return "unknown"
+    return "child" if age < 18 else "adult" if age < 65 else "senior"
+
+# Lay paraphrases mapped to one term, so the similarity tier compares
+# presentations rather than wording. Character n-grams alone score
+# "head pain" closer to "head injury" than to "headache".
+SYMPTOM_SYNONYMS = {
+    "head pain": "headache", "head ache": "headache", "migraine": "headache",
+    "stomach pain": "stomach ache", "stomachache": "stomach ache", "tummy ache": "stomach ache",
+    "abdominal pain": "stomach ache", "belly pain": "stomach ache",
+    "diarrhoea": "diarrhea", "loose stools": "diarrhea",
+    "throat pain": "sore throat", "painful throat": "sore throat",
+    "running nose": "runny nose", "stuffy nose": "congestion", "blocked nose": "congestion",
+    "chest congestion": "congestion", "nasal congestion": "congestion",
+    "coughing": "cough", "sneezes": "sneezing",
+    "earache": "ear pain", "ear ache": "ear pain",
+    "backache": "back pain", "back ache": "back pain",
+    "itching": "itch", "itchy": "itch", "itchy skin": "itch", "itchy rash": "rash, itch",
+    "dizzy": "dizziness", "lightheaded": "dizziness", "light headed": "dizziness",
+    "feverish": "fever", "high temperature": "fever", "temperature": "fever",
+    "throwing up": "vomiting", "vomit": "vomiting", "being sick": "vomiting",
+    "nauseous": "nausea", "feeling sick": "nausea",
+    "tired": "fatigue", "tiredness": "fatigue", "exhaustion": "fatigue",
+    "short of breath": "shortness of breath", "breathlessness": "shortness of breath",
+}
+SYMPTOM_SPLIT_PATTERN = re.compile(r",|;|/|&|\band\b")
+PAIN_IN_PATTERN = re.compile(r"^(?:pain|ache|soreness) in (?:the |my )?(.+)$")
+NUMBER_WORDS = {"a": "1", "an": "1", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+                "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10"}
+
+def canonical_symptoms(items: List[str]) -> List[str]:
+    """Split, normalize and de-duplicate reported symptoms"""
+    terms = set()
+    for item in items:
+        for part in SYMPTOM_SPLIT_PATTERN.split(item.lower()):
+            part = PAIN_IN_PATTERN.sub(r"\1 pain", " ".join(part.split()))
+            for term in SYMPTOM_SYNONYMS.get(part, part).split(", "):
+                if term:
+                    terms.add(term)
+    return sorted(terms)
+
+def canonical_duration(duration: str) -> str:
+    return " ".join(NUMBER_WORDS.get(word, word) for word in duration.lower().split())
+
+def canonical_symptom_text(symptoms: Dict[str, Any]) -> str:
+    """symptom_text over canonical terms, with associated symptoms merged in"""
+    return " | ".join([
+        (symptoms.get("location") or "").lower(),
+        ", ".join(canonical_symptoms((symptoms.get("symptoms") or []) + (symptoms.get("associated_symptoms") or []))),
+        canonical_duration(symptoms.get("duration") or ""),
+    ])
+
+def history_key(symptoms: Dict[str, Any]) -> str:
+    return "|".join(canonical_symptoms(symptoms.get("medical_history") or []))
+
+def gender_key(symptoms: Dict[str, Any]) -> str:
+    return (symptoms.get("gender") or "").strip().lower()
+
+class TriageCache:
+    """Two-tier cache of LLM triage assessments
+
+    The exact tier is keyed by a hash of the normalized symptom input. The
+    similarity tier holds sublinear TF-IDF weighted character n-gram vectors
+    in one L2-normalized matrix, so a lookup is a single matrix-vector
+    product. Both tiers work on canonical symptom terms. Candidates must
+    share location, age group, gender and medical history and be within one
+    point of severity. Emergency and low-confidence outcomes are never
+    cached, and hits are only served above min_similarity. Rebuilds index a
+    fresh copy in a worker thread and swap it in.
+    """
+    INDEX_ATTRIBUTES = ("idf", "exact", "matrix", "size", "next_slot", "locations", "age_groups", "genders",
+                        "histories", "severities", "assessments")
+
+    def __init__(self, max_entries: int = 10_000, min_similarity: float = 0.9, n_features: int = 1024,
+                 rebuild_interval: float = 3600.0, min_confidence: float = 0.7):
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+        self.rebuild_interval = rebuild_interval
+        self.vectorizer = HashingVectorizer(n_features)
+        self.exact: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.idf = np.ones(n_features, dtype=np.float32)
+        self._reset_index(0)
+        self._rebuild_adds: Optional[List[tuple]] = None
+        self.stats: Counter = Counter()
+        self.lookup_ms: Optional[RunningStat] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _reset_index(self, capacity: int):
+        self.matrix = np.zeros((max(capacity, 64), self.vectorizer.n_features), dtype=np.float32)
+        self.size = 0
+        self.next_slot = 0
+        self.locations: List[str] = []
+        self.age_groups: List[str] = []
+        self.genders: List[str] = []
+        self.histories: List[str] = []
+        self.severities = np.zeros(self.matrix.shape[0], dtype=np.int16)
+        self.assessments: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def exact_key(symptoms: Dict[str, Any]) -> str:
+        canonical = {
+            "location": (symptoms.get("location") or "").strip().lower(),
+            "symptoms": canonical_symptoms(symptoms.get("symptoms") or []),
+            "associated": canonical_symptoms(symptoms.get("associated_symptoms") or []),
+            "history": history_key(symptoms),
+            "severity": symptoms.get("severity"),
+            "duration": canonical_duration(symptoms.get("duration") or ""),
+            "age_group": age_group(symptoms.get("age")),
+            "gender": gender_key(symptoms),
+        }
+        return hashlib.sha1(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+    def _vector(self, symptoms: Dict[str, Any]) -> np.ndarray:
+        vector = np.log1p(self.vectorizer.counts(canonical_symptom_text(symptoms))) * self.idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def cacheable(self, assessment: Dict[str, Any]) -> bool:
+        return assessment.get("urgency_level") not in (None, "Emergency") and \
+            (assessment.get("confidence_score") or 0) >= self.min_confidence
+
+    def add(self, symptoms: Dict[str, Any], assessment: Dict[str, Any]):
+        if not self.cacheable(assessment):
+            return
+        if self._rebuild_adds is not None:
+            # Replayed onto the rebuilt index when it is swapped in
+            self._rebuild_adds.append((symptoms, assessment))
+        cached = {key: assessment.get(key) for key in
+                  ("analysis", "urgency_level", "confidence_score", "recommended_actions", "follow_up_questions")}
+        self.exact[self.exact_key(symptoms)] = cached
+        if len(self.exact) > self.max_entries:
+            self.exact.popitem(last=False)
+
+        if self.next_slot >= self.matrix.shape[0] and self.matrix.shape[0] < self.max_entries:
+            grown = min(self.matrix.shape[0] * 2, self.max_entries)
+            self.matrix = np.resize(self.matrix, (grown, self.matrix.shape[1]))
+            self.severities = np.resize(self.severities, grown)
+        # Once full, the index is a ring buffer that overwrites the oldest rows
+        slot = self.next_slot % self.matrix.shape[0]
+        self.matrix[slot] = self._vector(symptoms)
+        self.severities[slot] = symptoms.get("severity") or 0
+        metadata = ((symptoms.get("location") or "").lower(), age_group(symptoms.get("age")),
+                    gender_key(symptoms), history_key(symptoms), cached)
+        if slot < len(self.assessments):
+            (self.locations[slot], self.age_groups[slot], self.genders[slot], self.histories[slot],
+             self.assessments[slot]) = metadata
+        else:
+            self.locations.append(metadata[0])
+            self.age_groups.append(metadata[1])
+            self.genders.append(metadata[2])
+            self.histories.append(metadata[3])
+            self.assessments.append(metadata[4])
+        self.next_slot = slot + 1
+        self.size = max(self.size, slot + 1)
+
+    def lookup(self, symptoms: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            hit = self.exact.get(self.exact_key(symptoms))
+            if hit is not None:
+                self.stats["exact_hits"] += 1
+                return dict(hit)
+            if not self.size:
+                self.stats["misses"] += 1
+                return None
+            scores = self.matrix[:self.size] @ self._vector(symptoms)
+            location = (symptoms.get("location") or "").lower()
+            group = age_group(symptoms.get("age"))
+            gender = gender_key(symptoms)
+            history = history_key(symptoms)
+            eligible = np.abs(self.severities[:self.size] - (symptoms.get("severity") or 0)) <= 1
+            scores = np.where(eligible, scores, -1.0)
+            for index in np.argsort(scores)[::-1][:5]:
+                if scores[index] < self.min_similarity:
+                    break
+                if self.locations[index] == location and self.age_groups[index] == group and \
+                        self.genders[index] == gender and self.histories[index] == history:
+                    self.stats["similar_hits"] += 1
+                    return dict(self.assessments[index])
+            self.stats["misses"] += 1
+            return None
+        finally:
+            if self.lookup_ms is None:
+                self.lookup_ms = RunningStat()
+            self.lookup_ms.add((time.perf_counter() - started) * 1000)
+
+    async def rebuild(self):
+        """Rebuild the index and IDF weights from recent stored assessments"""
+        docs = await read_db.triage_sessions.find(
+            {"urgency_level": {"$in": ["Urgent", "Routine", "Self-Care"]}, "symptoms": {"$ne": None},
+             "confidence_score": {"$gte": self.min_confidence},
+             "assessment_source": {"$nin": ["fallback", "classifier", "llm_unparsed"]}},
+            {"_id": 0, "symptoms": 1, "urgency_level": 1, "ai_analysis": 1,
+             "recommended_actions": 1, "confidence_score": 1}
+        ).sort("updated_at", -1).limit(self.max_entries).to_list(self.max_entries)
+        self._rebuild_adds = []
+        try:
+            # Vectorizing thousands of documents takes most of a second, so
+            # the whole index is built off the event loop
+            fresh = await asyncio.to_thread(self._build, docs)
+            for name in self.INDEX_ATTRIBUTES:
+                setattr(self, name, getattr(fresh, name))
+            added, self._rebuild_adds = self._rebuild_adds, None
+            for symptoms, assessment in added:
+                self.add(symptoms, assessment)
+        finally:
+            self._rebuild_adds = None
+        self.stats["rebuilds"] += 1
+
+    def _build(self, docs: List[Dict[str, Any]]) -> "TriageCache":
+        fresh = TriageCache(self.max_entries, self.min_similarity, self.vectorizer.n_features,
+                            self.rebuild_interval, self.min_confidence)
+        frequencies = np.zeros(fresh.vectorizer.n_features, dtype=np.float32)
+        for doc in docs:
+            frequencies[np.unique(fresh.vectorizer.indices(canonical_symptom_text(doc["symptoms"])))] += 1
+        fresh.idf = (np.log((1 + len(docs)) / (1 + frequencies)) + 1).astype(np.float32)
+        fresh._reset_index(len(docs))
+        for doc in reversed(docs):
+            fresh.add(doc["symptoms"], {
+                "analysis": doc.get("ai_analysis"),
+                "urgency_level": doc["urgency_level"],
+                "confidence_score": doc.get("confidence_score"),
+                "recommended_actions": doc.get("recommended_actions") or [],
+                "follow_up_questions": [],
+            })
+        return fresh
+
+    async def run(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception:
+                logger.exception("Triage cache rebuild failed")
+            await asyncio.sleep(self.rebuild_interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["exact_hits"] + self.stats["similar_hits"] + self.stats["misses"]
+        return {
+            "entries": self.size,
+            "exact_entries": len(self.exact),
+            "min_similarity": self.min_similarity,
+            **dict(self.stats),
+            "hit_rate": round((lookups - self.stats["misses"]) / lookups, 3) if lookups else 0.0,
+            "lookup_ms_mean": round(self.lookup_ms.mean, 3) if self.lookup_ms else 0.0,
+        }
+
+# On hand-labelled pairs, paraphrases covered by SYMPTOM_SYNONYMS score 1.0
+# and other wording variants (plurals, typos) 0.88-1.0, while presentations
+# differing by one symptom score up to 0.86. 0.9 keeps a margin above those
+# at the cost of missing some variants.
+triage_cache: Optional[TriageCache] = None
+if os.environ.get("TRIAGE_CACHE_ENABLED", "true").lower() == "true":
+    triage_cache = TriageCache(
+        max_entries=int(os.environ.get("TRIAGE_CACHE_MAX_ENTRIES", "10000")),
+        min_similarity=float(os.environ.get("TRIAGE_CACHE_MIN_SIMILARITY", "0.9")),
+        rebuild_interval=float(os.environ.get("TRIAGE_CACHE_REBUILD_S", "3600")),
+    )
+
+# Local triage classifier
+# Multinomial logistic regression over the cache's hashed n-gram features
+# plus a few structured ones, trained offline from stored LLM assessments
+# (`python backend/cli.py train-classifier`). It backs degraded-mode triage
+# when the LLM is unavailable and cross-checks LLM assessments.
+TRIAGE_FEATURE_VERSION = 1
+TRIAGE_TEXT_FEATURES = 1024
+AGE_GROUPS = ("child", "adult", "senior", "unknown")
+CLASSIFIER_ACTIONS = {
+    "Emergency": ["Call emergency services or go to the nearest emergency department", "Do not delay medical care"],
+    "Urgent": ["Seek medical attention today", "Monitor symptoms closely", "Seek immediate care if symptoms worsen"],
+    "Routine": ["Schedule an appointment with your healthcare provider", "Monitor your symptoms"],
+    "Self-Care": ["Rest and monitor your symptoms", "Consult a healthcare provider if symptoms persist or worsen"],
+}
+classifier_vectorizer = HashingVectorizer(TRIAGE_TEXT_FEATURES)
+
+def classifier_features(symptoms_list: List[Dict[str, Any]]) -> np.ndarray:
+    """Feature matrix shared by training and serving"""
+    text_end = TRIAGE_TEXT_FEATURES
+    rows = np.zeros((len(symptoms_list), text_end + 8), dtype=np.float32)
+    for row, symptoms in zip(rows, symptoms_list):
+        counts = np.log1p(classifier_vectorizer.counts(symptom_text(symptoms)))
+        norm = np.linalg.norm(counts)
+        row[:text_end] = counts / norm if norm else counts
+        severity = symptoms.get("severity") or 0
+        row[text_end:text_end + 3] = (severity / 10, severity >= 6, severity >= 8)
+        row[text_end + 3 + AGE_GROUPS.index(age_group(symptoms.get("age")))] = 1
+        reported = [s.lower() for s in (symptoms.get("symptoms") or []) + (symptoms.get("associated_symptoms") or [])]
+        row[text_end + 7] = any(emergency in reported for emergency in EMERGENCY_SYMPTOMS)
+    return rows
+
+class TriageClassifier:
+    """Softmax regression over classifier_features with versioned .npz persistence"""
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: List[str], metadata: Dict[str, Any]):
+        self.weights = weights
+        self.bias = bias
+        self.labels = list(labels)
+        self.metadata = metadata
+        self.version = metadata.get("version", "unversioned")
+        self.stats: Counter = Counter()
+        self.predict_us: Optional[RunningStat] = None
+
+    @classmethod
+    def fit(cls, features: np.ndarray, targets: np.ndarray, labels: List[str], epochs: int = 300,
+            learning_rate: float = 0.05, l2: float = 1e-4, metadata: Optional[Dict[str, Any]] = None) -> "TriageClassifier":
+        """Full-batch Adam on class-balanced cross-entropy"""
+        samples, dims = features.shape
+        classes = len(labels)
+        onehot = np.eye(classes, dtype=np.float32)[targets]
+        # Emergency is rare; weight classes so it is not learned away
+        frequency = np.bincount(targets, minlength=classes).astype(np.float32)
+        sample_weight = (samples / (classes * np.maximum(frequency, 1)))[targets][:, None] / samples
+        params = [np.zeros((dims, classes), dtype=np.float32), np.zeros(classes, dtype=np.float32)]
+        moments = [[np.zeros_like(p), np.zeros_like(p)] for p in params]
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        for step in range(1, epochs + 1):
+            logits = features @ params[0] + params[1]
+            logits -= logits.max(axis=1, keepdims=True)
+            probs = np.exp(logits)
+            probs /= probs.sum(axis=1, keepdims=True)
+            error = (probs - onehot) * sample_weight
+            grads = [features.T @ error + l2 * params[0], error.sum(axis=0)]
+            for param, grad, moment in zip(params, grads, moments):
+                moment[0] = beta1 * moment[0] + (1 - beta1) * grad
+                moment[1] = beta2 * moment[1] + (1 - beta2) * grad * grad
+                param -= learning_rate * (moment[0] / (1 - beta1 ** step)) / (np.sqrt(moment[1] / (1 - beta2 ** step)) + eps)
+        return cls(params[0], params[1], labels, dict(metadata or {}, feature_version=TRIAGE_FEATURE_VERSION))
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        logits = features @ self.weights + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def predict(self, symptoms: Dict[str, Any]) -> tuple:
+        """(urgency_level, probability) for one symptom record"""
+        started = time.perf_counter()
+        probs = self.predict_proba(classifier_features([symptoms]))[0]
+        best = int(probs.argmax())
+        if self.predict_us is None:
+            self.predict_us = RunningStat()
+        self.predict_us.add((time.perf_counter() - started) * 1e6)
+        return self.labels[best], float(probs[best])
+
+    def save(self, path: Path):
+        np.savez(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels),
+                 metadata=np.array(json.dumps(self.metadata)))
+
+    @classmethod
+    def load(cls, path: Path) -> "TriageClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            metadata = json.loads(str(data["metadata"]))
+            if metadata.get("feature_version") != TRIAGE_FEATURE_VERSION:
+                raise ValueError(f"{path} was trained on feature version {metadata.get('feature_version')}")
+            return cls(data["weights"], data["bias"], [str(label) for label in data["labels"]], metadata)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "trained_at": self.metadata.get("trained_at"),
+            "evaluation": self.metadata.get("evaluation"),
+            **dict(self.stats),
+            "predict_us_mean": round(self.predict_us.mean, 1) if self.predict_us else None,
+        }
+
+def classifier_path() -> Optional[Path]:
+    """The model to serve: TRIAGE_MODEL_PATH, else the CURRENT pointer in TRIAGE_MODEL_DIR"""
+    if os.environ.get("TRIAGE_MODEL_PATH"):
+        return Path(os.environ["TRIAGE_MODEL_PATH"])
+    pointer = Path(os.environ.get("TRIAGE_MODEL_DIR", ROOT_DIR / "models")) / "CURRENT"
+    return pointer.parent / pointer.read_text().strip() if pointer.exists() else None
+
+triage_classifier: Optional[TriageClassifier] = None
+TRIAGE_CLASSIFIER_MIN_CONFIDENCE = float(os.environ.get("TRIAGE_CLASSIFIER_MIN_CONFIDENCE", "0.5"))
+TRIAGE_CROSSCHECK_CONFIDENCE = float(os.environ.get("TRIAGE_CROSSCHECK_CONFIDENCE", "0.8"))
+
+async def load_triage_classifier():
+    global triage_classifier
+    path = classifier_path()
+    if path is None:
+        return
+    try:
+        triage_classifier = await asyncio.to_thread(TriageClassifier.load, path)
+        log_event("triage_classifier_loaded", "Loaded triage classifier", version=triage_classifier.version)
+    except Exception:
+        logger.exception("Could not load triage classifier from %s", path)
+
+def classifier_check(symptoms: Dict[str, Any], urgency_level: str) -> Optional[Dict[str, Any]]:
+    """Compare an LLM urgency with the classifier's; confident disagreements are flagged"""
+    if triage_classifier is None or urgency_level not in URGENCY_LEVELS:
+        return None
+    predicted, probability = triage_classifier.predict(symptoms)
+    flagged = predicted != urgency_level and probability >= TRIAGE_CROSSCHECK_CONFIDENCE
+    triage_classifier.stats["checks"] += 1
+    triage_classifier.stats["disagreements"] += predicted != urgency_level
+    triage_classifier.stats["flagged"] += flagged
+    if flagged:
+        log_event("triage_disagreement", "Classifier disagrees with LLM urgency", level=logging.WARNING,
+                  llm_urgency=urgency_level, classifier_urgency=predicted, probability=round(probability, 3))
+    return {
+        "urgency_level": predicted,
+        "probability": round(probability, 3),
+        "flagged": flagged,
+        "model_version": triage_classifier.version,
+    }
+
+# Admin access
+async def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Guard admin endpoints with ADMIN_TOKEN when it is configured"""
+    expected = os.environ.get("ADMIN_TOKEN")
+    if expected and x_admin_token != expected:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# Event loop profiler
+class LoopProfiler:
+    """Opt-in event loop lag monitor and blocking-call detector
+
+    A coroutine on the loop records scheduling lag and a heartbeat; a watchdog
+    thread notices when the heartbeat stops advancing, captures the loop
+    thread's stack, and optionally samples stacks into collapsed flamegraph
+    files (one "frame;frame;frame count" line per stack).
+    """
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.25,
+                 sample_interval: float = 0.01, dump_dir: Optional[str] = None,
+                 dump_every: float = 60.0):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.sample_interval = sample_interval
+        self.dump_dir = Path(dump_dir) if dump_dir else None
+        self.dump_every = dump_every
+        self.lag_samples: deque = deque(maxlen=600)
+        self.slow_blocks: deque = deque(maxlen=50)
+        self.collapsed_stacks: Counter = Counter()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._measure_lag())
+        self._thread = threading.Thread(target=self._watch, name="loop-profiler", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+        if self._thread:
+            await asyncio.to_thread(self._thread.join, 1.0)
+        self._dump_flamegraph()
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag_samples.append(max(loop.time() - started - self.interval, 0.0))
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        poll = self.sample_interval if self.dump_dir else min(self.block_threshold / 2, 0.05)
+        stalled_since_report = False
+        last_dump = time.monotonic()
+        while not self._stop.wait(poll):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            if self.dump_dir:
+                self.collapsed_stacks[self._collapse(frame)] += 1
+            blocked_for = time.monotonic() - self._heartbeat - self.interval
+            if blocked_for > self.block_threshold:
+                if not stalled_since_report:
+                    stalled_since_report = True
+                    stack = traceback.format_stack(frame)
+                    self.slow_blocks.append({
+                        "detected_at": datetime.utcnow().isoformat(),
+                        "blocked_for_ms": round(blocked_for * 1000, 1),
+                        "stack": stack[-15:],
+                    })
+                    logger.warning("Event loop blocked", extra={"event": "loop_blocked", "fields": {
+                        "blocked_for_ms": round(blocked_for * 1000, 1),
+                        "where": stack[-1].strip() if stack else None,
+                    }})
+            else:
+                stalled_since_report = False
+            if self.dump_dir and time.monotonic() - last_dump >= self.dump_every:
+                last_dump = time.monotonic()
+                self._dump_flamegraph()
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _dump_flamegraph(self):
+        if not self.dump_dir or not self.collapsed_stacks:
+            return
+        stacks, self.collapsed_stacks = self.collapsed_stacks, Counter()
+        self.dump_dir.mkdir(parents=True, exist_ok=True)
+        path = self.dump_dir / f"loop-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.collapsed"
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def snapshot(self) -> Dict[str, Any]:
+        samples = sorted(self.lag_samples)
+        def pct(p: float) -> float:
+            return round(samples[min(int(len(samples) * p), len(samples) - 1)] * 1000, 2) if samples else 0.0
+        return {
+            "enabled": True,
+            "interval_ms": self.interval * 1000,
+            "block_threshold_ms": self.block_threshold * 1000,
+            "lag_ms": {
+                "current": round(self.lag_samples[-1] * 1000, 2) if self.lag_samples else 0.0,
+                "p50": pct(0.5),
+                "p99": pct(0.99),
+                "max": round(samples[-1] * 1000, 2) if samples else 0.0,
+            },
+            "slow_blocks": list(self.slow_blocks),
+        }
+
+loop_profiler: Optional[LoopProfiler] = None
+if os.environ.get("PROFILER_ENABLED", "false").lower() == "true":
+    loop_profiler = LoopProfiler(
+        block_threshold=float(os.environ.get("PROFILER_BLOCK_THRESHOLD_MS", "250")) / 1000,
+        dump_dir=os.environ.get("PROFILER_FLAMEGRAPH_DIR") or None,
+        dump_every=float(os.environ.get("PROFILER_FLAMEGRAPH_EVERY_S", "60")),
+    )
+
+# Rate limiting
+class MemoryTokenBuckets:
+    """Token buckets held in process memory
+
+    A bucket that has been idle long enough to refill completely is the same
+    as a missing one, so when the table grows past max_keys the oldest idle
+    entries are simply dropped.
+    """
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    async def acquire(self, key: str, capacity: float, rate: float) -> tuple:
+        now = time.monotonic()
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = [tokens, now]
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+class MongoTokenBuckets:
+    """Token buckets shared by all workers, updated atomically in Mongo
+
+    One find_one_and_update with an update pipeline refills, tests and
+    spends a token; a TTL index removes idle buckets.
+    """
+    collection_name = "rate_limits"
+
+    async def acquire(self, key: str, capacity: float, rate: float) -> tuple:
+        now = time.time()
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, rate]}
+        ]}]}
+        doc = await db[self.collection_name].find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "ts": now, "expires_at": "$$NOW"}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc["allowed"]:
+            return True, 0.0
+        return False, (1 - doc["tokens"]) / rate
+
+def parse_rate(spec: str) -> tuple:
+    """'30/60' -> capacity 30 refilled over 60 seconds -> (30, 0.5 per second)"""
+    count, seconds = spec.split("/")
+    return float(count), float(count) / float(seconds)
+
+class RateLimiter:
+    """Per-scope token-bucket limits with rejection counters"""
+    def __init__(self, store, limits: Dict[str, tuple]):
+        self.store = store
+        self.limits = limits
+        self.rejections: Counter = Counter()
+        self.store_errors = 0
+
+    async def check(self, scope: str, key: str) -> tuple:
+        limit = self.limits.get(scope)
+        if limit is None or not key:
+            return True, 0.0
+        try:
+            allowed, retry_after = await self.store.acquire(f"{scope}:{key}", *limit)
+        except Exception:
+            # A broken shared store must not take the API down with it
+            self.store_errors += 1
+            return True, 0.0
+        if not allowed:
+            self.rejections[scope] += 1
+        return allowed, retry_after
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "store": type(self.store).__name__,
+            "limits": {scope: {"capacity": capacity, "per_second": rate} for scope, (capacity, rate) in self.limits.items()},
+            "rejections": dict(self.rejections),
+            "store_errors": self.store_errors,
+        }
+
+rate_limiter = RateLimiter(
+    MongoTokenBuckets() if os.environ.get("RATE_LIMIT_STORE", "memory") == "mongo" else MemoryTokenBuckets(),
+    {
+        scope: parse_rate(os.environ.get(env_name, default))
+        for scope, env_name, default in [
+            ("ip", "RATE_LIMIT_IP", "30/60"),
+            ("session", "RATE_LIMIT_SESSION", "10/60"),
+            ("socket", "RATE_LIMIT_SOCKET", "100/2"),
+            ("batch", "RATE_LIMIT_BATCH", "5/60"),
+        ]
+        if os.environ.get(env_name, default)
+    }
+)
+
+def parse_trusted_proxies(value: str):
+    """"*" trusts whichever peer connects (the platform proxy); otherwise IPs/CIDRs"""
+    if value.strip() == "*":
+        return "*"
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in value.split(",") if part.strip()]
+
+# Legacy TRUST_PROXY_HEADERS=true behaves like TRUSTED_PROXIES=*
+TRUSTED_PROXIES = parse_trusted_proxies(os.environ.get(
+    "TRUSTED_PROXIES", "*" if os.environ.get("TRUST_PROXY_HEADERS", "false").lower() == "true" else ""
+))
+
+def is_trusted_proxy(host: str) -> bool:
+    if TRUSTED_PROXIES == "*":
+        return True
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> str:
+    """The client's address: the first X-Forwarded-For hop not added by a trusted proxy
+
+    Hops are read from the right, since anything left of the proxies' own
+    entries was supplied by the client and can be spoofed.
+    """
+    peer = request.client.host if request.client else ""
+    if not TRUSTED_PROXIES or not is_trusted_proxy(peer):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if TRUSTED_PROXIES == "*":
+        # Only the proxy in front of us is known; the entry it appended is last
+        return hops[-1] if hops else peer
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+async def enforce_rate_limit(scope: str, key: str):
+    allowed, retry_after = await rate_limiter.check(scope, key)
+    if not allowed:
+        retry_after = max(int(math.ceil(retry_after)), 1)
+        raise HTTPException(
+            status_code=429,
+            detail={"message": "Too many requests", "scope": scope, "retry_after": retry_after},
+            headers={"Retry-After": str(retry_after)}
+        )
+
+async def limit_llm_requests(request: Request, session_id: str):
+    """Dependency for endpoints that spend an LLM call per request"""
+    for scope, key in (("ip", client_ip(request)), ("session", session_id)):
+        await enforce_rate_limit(scope, key)
+
+async def limit_batch_requests(request: Request):
+    """Dependency for batch endpoints, which spend many LLM calls per request"""
+    await enforce_rate_limit("batch", client_ip(request))
+
+def socket_rate_limited(handler):
+    """Drop Socket.IO events from a sid that exceeds its bucket"""
+    @functools.wraps(handler)
+    async def wrapper(sid, *args):
+        allowed, retry_after = await rate_limiter.check("socket", sid)
+        if not allowed:
+            await sio.emit("rate_limited", {"event": handler.__name__, "retry_after": round(retry_after, 2)}, room=sid)
+            return None
+        return await handler(sid, *args)
+    return wrapper
+
+# Traffic capture
+# Opt-in with TRAFFIC_CAPTURE_PATH. API requests and Socket.IO events are
+# logged as compact NDJSON with payloads reduced to their shape: ids become
+# per-process pseudonyms, free text becomes its length and only known
+# vocabulary (symptom keywords, enum values) is kept verbatim. The log is
+# re-driven against an instance with `python backend/cli.py replay`.
+UUID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.IGNORECASE)
+ISO_DATETIME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+ID_FIELDS = ("id", "session_id", "consultation_id", "patient_id", "provider_id", "call_id")
+CAPTURE_BODY_LIMIT = 64 * 1024
+CAPTURE_SKIP_PREFIXES = ("/api/admin", "/api/health")
+# Numbers under any other key (phone numbers, identifiers) are reduced to their digit count
+CAPTURE_NUMERIC_KEYS = ("severity", "age", "limit", "confidence_score", "sdpMLineIndex")
+
+class TrafficCapture:
+    """Anonymizing NDJSON recorder for request and event streams"""
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024):
+        self.key = os.urandom(16)
+        self.started = time.monotonic()
+        self.written = 0
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=5)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        # Same queue arrangement as the application logs: handlers never block on disk
+        capture_queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(capture_queue, handler)
+        self.logger = logging.getLogger("traffic_capture")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(logging.handlers.QueueHandler(capture_queue))
+
+    @functools.cached_property
+    def vocabulary(self) -> set:
+        terms = [*EMERGENCY_SYMPTOMS, *URGENCY_LEVELS, *SPECIALIZATION_HINTS, *TERMINAL_CONSULTATION_STATUSES,
+                 "waiting", "in_progress", "available", "busy", "offline", "patient", "provider",
+                 "user", "ai", "offer", "answer", "candidate", "deflate"]
+        return {term.lower() for term in terms}
+
+    def offset(self) -> float:
+        return round(time.monotonic() - self.started, 4)
+
+    def pseudonym(self, value: str) -> str:
+        return hmac.new(self.key, value.encode(), hashlib.sha256).hexdigest()[:12]
+
+    def shape(self, value: Any, key: Optional[str] = None) -> Any:
+        """Anonymized stand-in for a payload that replays with the same structure"""
+        if value is None or isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)):
+            if key == "age":
+                return int(value // 10 * 10)
+            return value if key in CAPTURE_NUMERIC_KEYS else {"$num": len(str(int(abs(value))))}
+        if isinstance(value, str):
+            if UUID_PATTERN.match(value):
+                return {"$id": self.pseudonym(value)}
+            if ISO_DATETIME_PATTERN.match(value):
+                return {"$dt": 1}
+            if key == "candidate" and value.startswith("candidate:"):
+                return {"$ice": len(value)}
+            if key == "sdp":
+                return {"$sdp": len(value)}
+            if value.lower() in self.vocabulary:
+                return value
+            if value.isdigit() and key in CAPTURE_NUMERIC_KEYS:
+                return str(int(value) // 10 * 10) if key == "age" else value
+            return {"$str": len(value)}
+        if isinstance(value, (bytes, bytearray)):
+            return {"$bytes": len(value)}
+        if isinstance(value, dict):
+            return {k: self.shape(v, k) for k, v in value.items() if not str(k).startswith("$")}
+        if isinstance(value, (list, tuple)):
+            return [self.shape(item, key) for item in value[:100]]
+        return {"$str": len(str(value))}
+
+    def response_ids(self, body: bytes) -> Optional[Dict[str, str]]:
+        try:
+            doc = json.loads(body)
+        except ValueError:
+            return None
+        return self.document_ids(doc)
+
+    def document_ids(self, doc: Any) -> Optional[Dict[str, str]]:
+        """Pseudonyms of the ids a response or acknowledgement hands out"""
+        if not isinstance(doc, dict):
+            return None
+        ids = {field: self.pseudonym(doc[field]) for field in ID_FIELDS
+               if isinstance(doc.get(field), str) and UUID_PATTERN.match(doc[field])}
+        return ids or None
+
+    def write(self, record: Dict[str, Any]):
+        self.written += 1
+        self.logger.info(json.dumps({key: value for key, value in record.items() if value is not None},
+                                    separators=(",", ":")))
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+traffic_capture: Optional[TrafficCapture] = None
+if os.environ.get("TRAFFIC_CAPTURE_PATH"):
+    traffic_capture = TrafficCapture(
+        os.environ["TRAFFIC_CAPTURE_PATH"],
+        max_bytes=int(os.environ.get("TRAFFIC_CAPTURE_MAX_MB", "100")) * 1024 * 1024,
+    )
+
+async def traffic_capture_middleware(request: Request, call_next):
+    """Record the shape and timing of API requests; apply replayed LLM latency"""
+    path = request.url.path
+    if not path.startswith("/api/") or path.startswith(CAPTURE_SKIP_PREFIXES):
+        return await call_next(request)
+    replay_ms = request.headers.get("x-replay-llm-ms") if LLM_MODE == "fake" else None
+    replay_token = replay_llm_ms_var.set(float(replay_ms) if replay_ms else None)
+    if traffic_capture is None:
+        try:
+            return await call_next(request)
+        finally:
+            replay_llm_ms_var.reset(replay_token)
+
+    offset = traffic_capture.offset()
+    started = time.perf_counter()
+    body = None
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = json.loads(await request.body() or b"null")
+        except ValueError:
+            body = None
+    llm_elapsed = [0.0]
+    llm_token = llm_elapsed_var.set(llm_elapsed)
+    try:
+        response = await call_next(request)
+    finally:
+        llm_elapsed_var.reset(llm_token)
+        replay_llm_ms_var.reset(replay_token)
+
+    route = request.scope.get("route")
+    query = dict(request.query_params)
+    record = {
+        "t": offset,
+        "k": "h",
+        "r": f"{request.method} {getattr(route, 'path', path)}",
+        "p": traffic_capture.shape(dict(request.path_params)) or None,
+        "q": traffic_capture.shape(query) or None,
+        "b": traffic_capture.shape(body),
+        "s": response.status_code,
+    }
+    collect = response.headers.get("content-type", "").startswith("application/json")
+    original = response.body_iterator
+
+    # Timing ends when the last byte is sent, so streamed responses count in full
+    async def observed():
+        chunks, size = [], 0
+        try:
+            async for chunk in original:
+                if collect and size < CAPTURE_BODY_LIMIT:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                yield chunk
+        finally:
+            record["ms"] = round((time.perf_counter() - started) * 1000, 2)
+            record["llm"] = round(llm_elapsed[0], 1) if llm_elapsed[0] else None
+            record["ids"] = traffic_capture.response_ids(b"".join(chunks)) if collect else None
+            traffic_capture.write(record)
+
+    response.body_iterator = observed()
+    return response
+
+def socket_captured(handler):
+    """Record the shape and timing of Socket.IO events when capture is enabled"""
+    signature = inspect.signature(handler)
+
+    @functools.wraps(handler)
+    async def wrapper(sid, *args):
+        if traffic_capture is None:
+            return await handler(sid, *args)
+        try:
+            signature.bind(sid, *args)
+        except TypeError:
+            # python-socketio first calls connect/disconnect with extra
+            # arguments and retries without them on TypeError; record only
+            # the call the handler accepts
+            return await handler(sid, *args)
+        offset = traffic_capture.offset()
+        started = time.perf_counter()
+        result = None
+        try:
+            result = await handler(sid, *args)
+            return result
+        finally:
+            traffic_capture.write({
+                "t": offset,
+                "k": "s",
+                "c": traffic_capture.pseudonym(sid),
+                "e": handler.__name__,
+                # The connect argument is the WSGI environ, which is never recorded
+                "b": traffic_capture.shape(args[0]) if args and handler.__name__ != "connect" else None,
+                # Ids the acknowledgement hands out, so replay can map later events onto them
+                "ids": traffic_capture.document_ids(result),
+                "ms": round((time.perf_counter() - started) * 1000, 3),
+            })
+    return wrapper
+
+@api_router.get("/admin/llm-usage", dependencies=[Depends(verify_admin_token)])
+async def get_llm_usage():
+    """Get today's LLM token and cost totals"""
+    return llm_usage.snapshot()
+
+@api_router.get("/admin/model-router", dependencies=[Depends(verify_admin_token)])
+async def get_model_router_stats():
+    """Get model routing decisions and per-tier latency"""
+    return model_router.snapshot()
+
+@api_router.get("/admin/triage-cache", dependencies=[Depends(verify_admin_token)])
+async def get_triage_cache_stats():
+    """Get triage cache size, hit rate and lookup latency"""
+    if triage_cache is None:
+        return {"enabled": False}
+    return triage_cache.snapshot()
+
+@api_router.get("/admin/change-feed", dependencies=[Depends(verify_admin_token)])
+async def get_change_feed_stats():
+    """Get change stream status and delivered event counts per collection"""
+    if change_feed is None:
+        return {"enabled": False}
+    return change_feed.snapshot()
+
+@api_router.get("/admin/signaling", dependencies=[Depends(verify_admin_token)])
+async def get_signaling_stats():
+    """Get ICE batching, duplicate and SDP compression counters"""
+    return signaling_relay.snapshot()
+
+@api_router.get("/admin/expiry", dependencies=[Depends(verify_admin_token)])
+async def get_expiry_stats():
+    """Get pending expiry timers, live call state sizes and expiry counts"""
+    return state_reaper.snapshot()
+
+@api_router.get("/admin/triage-classifier", dependencies=[Depends(verify_admin_token)])
+async def get_triage_classifier_stats():
+    """Get the served classifier version, its evaluation and cross-check counts"""
+    if triage_classifier is None:
+        return {"loaded": False}
+    return triage_classifier.snapshot()
+
+@api_router.post("/admin/triage-classifier/reload", dependencies=[Depends(verify_admin_token)])
+async def reload_triage_classifier():
+    """Load the currently activated classifier version without a restart"""
+    await load_triage_classifier()
+    if triage_classifier is None:
+        raise HTTPException(status_code=404, detail="No classifier model available")
+    return {"version": triage_classifier.version}
+
+@api_router.get("/admin/rate-limits", dependencies=[Depends(verify_admin_token)])
+async def get_rate_limit_stats():
+    """Get rate limiter configuration and rejection counts"""
+    return rate_limiter.snapshot()
+
 # Basic routes
 @api_router.get("/")
 async def root():
     return {"message": "Telehealth AI Triage Platform"}
 
+# Health probes
+socket_stats = {"connected": 0, "peak": 0}
+
+class StartupSteps:
+    """Mongo-dependent startup work, retried in the background until it succeeds
+
+    A database outage at deploy time leaves the instance running (liveness
+    passes) but not ready, with the steps still pending listed by readiness,
+    instead of failing startup and crash-looping.
+    """
+    def __init__(self, retry_initial: float = 1.0, retry_max: float = 30.0):
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.pending: Dict[str, str] = {}  # step name -> last error
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, steps: Dict[str, Callable[[], Awaitable[Any]]]):
+        results = await asyncio.gather(*(step() for step in steps.values()), return_exceptions=True)
+        for name, result in zip(steps, results):
+            if isinstance(result, Exception):
+                self._failed(name, result)
+        if self.pending:
+            self._task = asyncio.create_task(self._retry(steps))
+
+    def _failed(self, name: str, error: Exception):
+        self.pending[name] = f"{type(error).__name__}: {error}"[:200]
+        log_event("startup_step_failed", f"Startup step {name} failed; retrying in the background",
+                  level=logging.WARNING, step=name, error=self.pending[name])
+
+    async def _retry(self, steps: Dict[str, Callable[[], Awaitable[Any]]]):
+        delay = self.retry_initial
+        while self.pending:
+            await asyncio.sleep(delay)
+            for name in list(self.pending):
+                try:
+                    await steps[name]()
+                except Exception as e:
+                    self._failed(name, e)
+                    continue
+                del self.pending[name]
+                log_event("startup_step_recovered", f"Startup step {name} succeeded on retry", step=name)
+            delay = min(delay * 2, self.retry_max)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def check(self) -> Dict[str, Any]:
+        return {"ok": not self.pending, "pending": dict(self.pending)}
+
+startup_steps = StartupSteps()
+
+class ReadinessProbe:
+    """Dependency checks for the load balancer, cached for a short TTL
+
+    Concurrent probes while a check is running share its result, so probe
+    traffic costs at most one Mongo ping per TTL.
+    """
+    def __init__(self, ttl: float = 2.0, max_mongo_ms: float = 500.0, max_loop_lag_ms: float = 200.0,
+                 max_sockets: int = 0):
+        self.ttl = ttl
+        self.max_mongo_ms = max_mongo_ms
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.max_sockets = max_sockets
+        self._result: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+
+    async def _mongo_check(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(db.command("ping"), timeout=self.max_mongo_ms / 1000 * 2)
+        except Exception as e:
+            return {"ok": False, "error": type(e).__name__}
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        return {"ok": latency_ms <= self.max_mongo_ms, "latency_ms": latency_ms}
+
+    async def _loop_check(self) -> Dict[str, Any]:
+        if loop_profiler is not None and loop_profiler.lag_samples:
+            lag_ms = round(loop_profiler.lag_samples[-1] * 1000, 1)
+        else:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            await asyncio.sleep(0)
+            lag_ms = round((loop.time() - started) * 1000, 1)
+        return {"ok": lag_ms <= self.max_loop_lag_ms, "lag_ms": lag_ms}
+
+    def _socket_check(self) -> Dict[str, Any]:
+        connected = socket_stats["connected"]
+        return {
+            "ok": not self.max_sockets or connected < self.max_sockets,
+            "connected": connected,
+            "peak": socket_stats["peak"],
+        }
+
+    def _llm_check(self) -> Dict[str, Any]:
+        # The rules-based fallback keeps triage working without the LLM, so
+        # a failing provider degrades the instance rather than failing it
+        return {
+            "ok": True,
+            "degraded": llm_health.degraded,
+            "consecutive_failures": llm_health.consecutive_failures,
+            "last_latency_ms": llm_health.last_latency_ms,
+            "last_error": llm_health.last_error,
+        }
+
+    async def _run(self) -> Dict[str, Any]:
+        mongo_check, loop_check = await asyncio.gather(self._mongo_check(), self._loop_check())
+        checks = {
+            "mongo": mongo_check,
+            "event_loop": loop_check,
+            "sockets": self._socket_check(),
+            "llm": self._llm_check(),
+            "startup": startup_steps.check(),
+        }
+        ready = all(check["ok"] for check in checks.values())
+        status = "ready" if ready else "not_ready"
+        if ready and checks["llm"]["degraded"]:
+            status = "degraded"
+        return {"status": status, "ready": ready, "checks": checks, "checked_at": datetime.utcnow().isoformat()}
+
+    async def check(self) -> Dict[str, Any]:
+        if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._run())
+            try:
+                self._result = await self._inflight
+                self._checked_at = time.monotonic()
+            finally:
+                self._inflight = None
+            return self._result
+        return await asyncio.shield(self._inflight)
+
+readiness_probe = ReadinessProbe(
+    ttl=float(os.environ.get("READY_CACHE_TTL_S", "2")),
+    max_mongo_ms=float(os.environ.get("READY_MAX_MONGO_MS", "500")),
+    max_loop_lag_ms=float(os.environ.get("READY_MAX_LOOP_LAG_MS", "200")),
+    max_sockets=int(os.environ.get("READY_MAX_SOCKETS", "0")),
+)
+
+@api_router.get("/health/live")
+async def liveness():
+    """Process is up and the event loop is serving requests"""
+    return {"status": "alive"}
+
+@api_router.get("/health/ready")
+async def readiness():
+    """Dependencies are healthy enough to take traffic; 503 otherwise"""
+    result = await readiness_probe.check()
+    return ORJSONResponse(result, status_code=200 if result["ready"] else 503)
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
@@ -154,23 +2112,44 @@ async def create_status_check(input: StatusCheckCreate):
 
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+    status_checks = await read_db.status_checks.find({}, NO_MONGO_ID).to_list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+@api_router.get("/admin/profiler", dependencies=[Depends(verify_admin_token)])
+async def get_profiler_report():
+    """Get event loop lag and blocking-call report"""
+    if loop_profiler is None:
+        return {"enabled": False}
+    return loop_profiler.snapshot()
+
+@api_router.get("/admin/db-pool", dependencies=[Depends(verify_admin_token)])
+async def get_db_pool_metrics():
+    """Get MongoDB connection pool usage"""
+    return pool_metrics.snapshot()
+
 # AI Triage Routes
+def session_document(session: TriageSession) -> Dict[str, Any]:
+    """Stored form of a new session, starting with an empty recent-chat buffer"""
+    return {**session.dict(), "recent_chat": [], "chat_count": 0}
+
 @api_router.post("/triage/start")
 async def start_triage():
     """Start a new triage session"""
     session = TriageSession()
-    await db.triage_sessions.insert_one(session.dict())
+    await db.triage_sessions.insert_one(session_document(session))
+    bump_version("triage_sessions")
     return {"session_id": session.id, "message": "Triage session started"}
 
-@api_router.post("/triage/symptoms/{session_id}")
-async def submit_symptoms(session_id: str, symptoms: SymptomInput):
-    """Submit symptoms for AI analysis"""
-    try:
-        # Prepare symptom data for AI analysis
-        symptom_data = f"""
+TRIAGE_SYSTEM_MESSAGE = """You are an AI medical triage assistant. Your role is to:\n1. Analyze patient symptoms and provide accurate medical assessments\n2. Classify urgency levels: Emergency (immediate care), Urgent (same day), Routine (within days), Self-Care\n3. Ask clarifying questions to better understand symptoms\n4. Provide clear, helpful recommendations while emphasizing that this is not a substitute for professional medical advice\n5. Be empathetic and reassuring while maintaining medical accuracy\n\nAlways respond in JSON format with the following structure:\n{\n    \"analysis\": \"Your medical analysis\",\n    \"urgency_level\": \"Emergency|Urgent|Routine|Self-Care\",\n    \"confidence_score\": 0.0-1.0,\n    \"recommended_actions\": [\"action1\", \"action2\"],\n    \"follow_up_questions\": [\"question1\", \"question2\"] (optional)\n}\n\nFor emergency situations (severe chest pain, difficulty breathing, severe bleeding, etc.), always classify as \"Emergency\" and recommend immediate medical attention."""
+TRIAGE_BATCH_MAX_ITEMS = int(os.environ.get("TRIAGE_BATCH_MAX_ITEMS", "100"))
+TRIAGE_BATCH_CONCURRENCY = int(os.environ.get("TRIAGE_BATCH_CONCURRENCY", "8"))
+TRIAGE_BATCH_WRITE_SIZE = 50
+
+class TriageBatchRequest(BaseModel):
+    items: List[SymptomInput]
+
+def symptom_prompt(symptoms: SymptomInput) -> str:
+    return f"""
 Patient presents with:
 - Location: {symptoms.location}
 - Primary symptoms: {', '.join(symptoms.symptoms)}
@@ -183,133 +2162,309 @@ Patient presents with:
 
 Please provide your medical triage assessment.
 """
-        system_message = """You are an AI medical triage assistant. Your role is to:\n1. Analyze patient symptoms and provide accurate medical assessments\n2. Classify urgency levels: Emergency (immediate care), Urgent (same day), Routine (within days), Self-Care\n3. Ask clarifying questions to better understand symptoms\n4. Provide clear, helpful recommendations while emphasizing that this is not a substitute for professional medical advice\n5. Be empathetic and reassuring while maintaining medical accuracy\n\nAlways respond in JSON format with the following structure:\n{\n    \"analysis\": \"Your medical analysis\",\n    \"urgency_level\": \"Emergency|Urgent|Routine|Self-Care\",\n    \"confidence_score\": 0.0-1.0,\n    \"recommended_actions\": [\"action1\", \"action2\"],\n    \"follow_up_questions\": [\"question1\", \"question2\"] (optional)\n}\n\nFor emergency situations (severe chest pain, difficulty breathing, severe bleeding, etc.), always classify as \"Emergency\" and recommend immediate medical attention."""
-        ai_response = await call_openai_chat(session_id, symptom_data, system_message)
-        try:
-            ai_data = json.loads(ai_response)
-        except:
-            ai_data = {
-                "analysis": ai_response,
-                "urgency_level": "Routine",
-                "confidence_score": 0.7,
-                "recommended_actions": ["Consult with a healthcare provider"],
-                "follow_up_questions": []
-            }
-        update_data = {
-            "symptoms": symptoms.dict(),
-            "urgency_level": ai_data.get("urgency_level", "Routine"),
-            "ai_analysis": ai_data.get("analysis", ""),
-            "recommended_actions": ai_data.get("recommended_actions", []),
-            "confidence_score": ai_data.get("confidence_score", 0.7),
-            "updated_at": datetime.utcnow()
-        }
+
+def is_llm_unavailable(e: Exception) -> bool:
+    return isinstance(e, LLMBudgetExceeded) or "quota" in str(e).lower() or "rate" in str(e).lower()
+
+def rule_assessment(symptoms: SymptomInput) -> Optional[Dict[str, Any]]:
+    """Classify explicit emergency presentations without waiting on the model"""
+    reported = [s.lower() for s in symptoms.symptoms + symptoms.associated_symptoms]
+    matched = [emergency for emergency in EMERGENCY_SYMPTOMS if emergency in reported]
+    if not matched:
+        return None
+    return {
+        "analysis": f"Reported {', '.join(matched)} requires immediate medical evaluation.",
+        "urgency_level": "Emergency",
+        "confidence_score": 0.9,
+        "recommended_actions": ["Call emergency services or go to the nearest emergency department", "Do not delay medical care"],
+        "follow_up_questions": []
+    }
+
+def fallback_assessment(symptoms: SymptomInput) -> Dict[str, Any]:
+    """Severity-based assessment used when the model is unavailable"""
+    fallback_urgency = "Routine"
+    fallback_analysis = "Our AI system is currently experiencing high demand. Based on your symptoms, please consider consulting with a healthcare provider."
+    fallback_actions = ["Schedule an appointment with your healthcare provider", "Monitor your symptoms", "Seek immediate care if symptoms worsen"]
+
+    # Adjust urgency based on severity and symptoms
+    if symptoms.severity >= 8 or any(emergency_symptom in [s.lower() for s in symptoms.symptoms] for emergency_symptom in EMERGENCY_SYMPTOMS):
+        fallback_urgency = "Urgent"
+        fallback_analysis = "Based on your high severity symptoms, you should seek medical attention promptly."
+        fallback_actions = ["Seek immediate medical attention", "Call emergency services if symptoms are severe", "Do not delay medical care"]
+    elif symptoms.severity >= 6:
+        fallback_urgency = "Urgent"
+        fallback_actions = ["Schedule same-day appointment if possible", "Monitor symptoms closely", "Seek immediate care if symptoms worsen"]
+    return {
+        "analysis": fallback_analysis,
+        "urgency_level": fallback_urgency,
+        "confidence_score": 0.6,
+        "recommended_actions": fallback_actions,
+        "follow_up_questions": []
+    }
+
+def degraded_assessment(symptoms: SymptomInput) -> tuple:
+    """Assessment without the LLM: the classifier where it is confident and
+    more urgent than the severity thresholds, otherwise the thresholds"""
+    ai_data = fallback_assessment(symptoms)
+    if triage_classifier is None:
+        return ai_data, "fallback"
+    urgency, probability = triage_classifier.predict(symptoms.dict())
+    if probability < TRIAGE_CLASSIFIER_MIN_CONFIDENCE or \
+            URGENCY_LEVELS.index(urgency) >= URGENCY_LEVELS.index(ai_data["urgency_level"]):
+        return ai_data, "fallback"
+    triage_classifier.stats["degraded_escalations"] += 1
+    return {
+        "analysis": "Our AI system is currently experiencing high demand. Based on similar past cases, "
+                    f"your symptoms suggest {urgency.lower()} care.",
+        "urgency_level": urgency,
+        "confidence_score": round(probability, 2),
+        "recommended_actions": CLASSIFIER_ACTIONS[urgency],
+        "follow_up_questions": []
+    }, "classifier"
+
+def cached_assessment(symptoms: SymptomInput) -> Optional[Dict[str, Any]]:
+    # Serious presentations always get a fresh strong-model assessment
+    if triage_cache is None or needs_strong_model(symptoms):
+        return None
+    ai_data = triage_cache.lookup(symptoms.dict())
+    if ai_data is not None:
+        log_event("triage_cache_hit", "Served triage assessment from cache")
+    return ai_data
+
+def fast_assessment(symptoms: SymptomInput) -> tuple:
+    """Rules, then cache: assessments available without the model, else (None, None)"""
+    ai_data = rule_assessment(symptoms)
+    if ai_data is not None:
+        return ai_data, "rules"
+    ai_data = cached_assessment(symptoms)
+    return (ai_data, "cache") if ai_data is not None else (None, None)
+
+async def llm_assessment(session_id: str, symptoms: SymptomInput) -> tuple:
+    ai_response = await model_router.complete(
+        session_id, symptom_prompt(symptoms), TRIAGE_SYSTEM_MESSAGE, endpoint="triage_symptoms",
+        force_strong=needs_strong_model(symptoms)
+    )
+    ai_data = parse_assessment(ai_response)
+    if ai_data is None:
+        return {
+            "analysis": ai_response,
+            "urgency_level": "Routine",
+            "confidence_score": 0.7,
+            "recommended_actions": ["Consult with a healthcare provider"],
+            "follow_up_questions": []
+        }, "llm_unparsed"
+    if triage_cache is not None:
+        triage_cache.add(symptoms.dict(), ai_data)
+    return ai_data, "llm"
+
+def assessment_update(symptoms: SymptomInput, ai_data: Dict[str, Any], source: str) -> Dict[str, Any]:
+    update = {
+        "symptoms": symptoms.dict(),
+        "urgency_level": ai_data.get("urgency_level", "Routine"),
+        "ai_analysis": ai_data.get("analysis", ""),
+        "recommended_actions": ai_data.get("recommended_actions", []),
+        "confidence_score": ai_data.get("confidence_score", 0.7),
+        # Training only learns from fresh LLM labels, so record where each came from
+        "assessment_source": source,
+        "updated_at": datetime.utcnow()
+    }
+    if source == "llm":
+        update["classifier_check"] = classifier_check(update["symptoms"], update["urgency_level"])
+    return update
+
+def assessment_response(session_id: str, ai_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "session_id": session_id,
+        "urgency_level": ai_data.get("urgency_level"),
+        "analysis": ai_data.get("analysis"),
+        "recommended_actions": ai_data.get("recommended_actions"),
+        "confidence_score": ai_data.get("confidence_score"),
+        "follow_up_questions": ai_data.get("follow_up_questions", [])
+    }
+
+@api_router.post("/triage/symptoms/{session_id}", dependencies=[Depends(limit_llm_requests)])
+async def submit_symptoms(session_id: str, symptoms: SymptomInput):
+    """Submit symptoms for AI analysis"""
+    session_id_var.set(session_id)
+    try:
+        ai_data, source = fast_assessment(symptoms)
+        if ai_data is None:
+            ai_data, source = await llm_assessment(session_id, symptoms)
+    except Exception as e:
+        # Handle OpenAI quota exceeded gracefully
+        if not is_llm_unavailable(e):
+            raise HTTPException(status_code=500, detail=f"Error processing symptoms: {str(e)}")
+        ai_data, source = degraded_assessment(symptoms)
+    try:
         await db.triage_sessions.update_one(
             {"id": session_id},
-            {"$set": update_data}
+            {"$set": assessment_update(symptoms, ai_data, source)}
         )
-        return {
-            "session_id": session_id,
-            "urgency_level": ai_data.get("urgency_level"),
-            "analysis": ai_data.get("analysis"),
-            "recommended_actions": ai_data.get("recommended_actions"),
-            "confidence_score": ai_data.get("confidence_score"),
-            "follow_up_questions": ai_data.get("follow_up_questions", [])
-        }
+        bump_version("triage_sessions")
+        return assessment_response(session_id, ai_data)
     except Exception as e:
-        # Handle OpenAI quota exceeded gracefully
-        if "quota" in str(e).lower() or "rate" in str(e).lower():
-            # Provide fallback response based on symptom severity
-            fallback_urgency = "Routine"
-            fallback_analysis = "Our AI system is currently experiencing high demand. Based on your symptoms, please consider consulting with a healthcare provider."
-            fallback_actions = ["Schedule an appointment with your healthcare provider", "Monitor your symptoms", "Seek immediate care if symptoms worsen"]
-            
-            # Adjust urgency based on severity and symptoms
-            if symptoms.severity >= 8 or any(emergency_symptom in [s.lower() for s in symptoms.symptoms] for emergency_symptom in ['chest pain', 'difficulty breathing', 'severe bleeding']):
-                fallback_urgency = "Urgent"
-                fallback_analysis = "Based on your high severity symptoms, you should seek medical attention promptly."
-                fallback_actions = ["Seek immediate medical attention", "Call emergency services if symptoms are severe", "Do not delay medical care"]
-            elif symptoms.severity >= 6:
-                fallback_urgency = "Urgent"
-                fallback_actions = ["Schedule same-day appointment if possible", "Monitor symptoms closely", "Seek immediate care if symptoms worsen"]
-            
-            # Update session with fallback data
-            update_data = {
-                "symptoms": symptoms.dict(),
-                "urgency_level": fallback_urgency,
-                "ai_analysis": fallback_analysis,
-                "recommended_actions": fallback_actions,
-                "confidence_score": 0.6,
-                "updated_at": datetime.utcnow()
-            }
-            
-            await db.triage_sessions.update_one(
-                {"id": session_id},
-                {"$set": update_data}
-            )
-            
-            return {
-                "session_id": session_id,
-                "urgency_level": fallback_urgency,
-                "analysis": fallback_analysis,
-                "recommended_actions": fallback_actions,
-                "confidence_score": 0.6,
-                "follow_up_questions": []
-            }
-        
         raise HTTPException(status_code=500, detail=f"Error processing symptoms: {str(e)}")
 
-@api_router.post("/triage/chat/{session_id}")
+@api_router.post("/triage/batch", dependencies=[Depends(limit_batch_requests)])
+async def submit_symptoms_batch(batch: TriageBatchRequest):
+    """Create and triage many sessions, streaming NDJSON results as they complete"""
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="At least one item is required")
+    if len(batch.items) > TRIAGE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {TRIAGE_BATCH_MAX_ITEMS} items")
+
+    sessions = [TriageSession(symptoms=item) for item in batch.items]
+    await db.triage_sessions.insert_many([session_document(session) for session in sessions], ordered=False)
+    bump_version("triage_sessions")
+    llm_slots = asyncio.Semaphore(TRIAGE_BATCH_CONCURRENCY)
+
+    async def triage_item(index: int, session_id: str, symptoms: SymptomInput) -> tuple:
+        session_id_var.set(session_id)
+        # Rules and cache hits complete immediately; only misses queue for the model
+        ai_data, source = fast_assessment(symptoms)
+        try:
+            if ai_data is None:
+                async with llm_slots:
+                    ai_data, source = await llm_assessment(session_id, symptoms)
+        except Exception as e:
+            if not is_llm_unavailable(e):
+                log_event("triage_batch_item_failed", f"Batch triage failed: {e}", level=logging.ERROR)
+                return {"index": index, "session_id": session_id, "error": "Error processing symptoms"}, None
+            ai_data, source = degraded_assessment(symptoms)
+        return {"index": index, "source": source, **assessment_response(session_id, ai_data)}, \
+            assessment_update(symptoms, ai_data, source)
+
+    async def flush(writes: List[UpdateOne]):
+        if writes:
+            await db.triage_sessions.bulk_write(writes, ordered=False)
+            bump_version("triage_sessions")
+            writes.clear()
+
+    async def results():
+        tasks = [
+            asyncio.create_task(triage_item(index, session.id, item))
+            for index, (session, item) in enumerate(zip(sessions, batch.items))
+        ]
+        writes: List[UpdateOne] = []
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result, update = await next_result
+                if update is not None:
+                    writes.append(UpdateOne({"id": result["session_id"]}, {"$set": update}))
+                if len(writes) >= TRIAGE_BATCH_WRITE_SIZE:
+                    await flush(writes)
+                yield json.dumps(result) + "\n"
+        finally:
+            # A client that disconnects mid-stream still gets completed work persisted
+            for task in tasks:
+                task.cancel()
+            await flush(writes)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+# Sessions embed their last CHAT_RECENT_TURNS messages so the session view
+# is a single read; chat_messages keeps the full history for paging
+CHAT_RECENT_TURNS = int(os.environ.get("CHAT_RECENT_TURNS", "20"))
+
+async def append_chat(session_id: str, messages: List[ChatMessage]):
+    """Store messages and push them onto the session's recent-chat ring buffer"""
+    docs = [message.dict() for message in messages]
+    push = {
+        "$push": {"recent_chat": {"$each": docs, "$slice": -CHAT_RECENT_TURNS}},
+        "$inc": {"chat_count": len(docs)}
+    }
+    _, pushed = await asyncio.gather(
+        db.chat_messages.insert_many([dict(doc) for doc in docs]),
+        db.triage_sessions.update_one({"id": session_id, "recent_chat": {"$exists": True}}, push)
+    )
+    if pushed.matched_count:
+        return
+    # Sessions from before the buffer: seed it from the stored history, which
+    # now includes these messages, so chat_count covers the older turns too
+    count, recent = await asyncio.gather(
+        db.chat_messages.count_documents({"session_id": session_id}),
+        db.chat_messages.find({"session_id": session_id}, NO_MONGO_ID)
+        .sort("timestamp", -1).limit(CHAT_RECENT_TURNS).to_list(CHAT_RECENT_TURNS)
+    )
+    recent.reverse()
+    seeded = await db.triage_sessions.update_one(
+        {"id": session_id, "recent_chat": {"$exists": False}},
+        {"$set": {"recent_chat": recent, "chat_count": count}}
+    )
+    if not seeded.matched_count:
+        # A concurrent append seeded the buffer first, maybe before these
+        # messages were stored; push them unless its seed already has them
+        first = docs[0]
+        await db.triage_sessions.update_one({
+            "id": session_id,
+            "recent_chat": {"$exists": True, "$not": {"$elemMatch": {
+                "timestamp": first["timestamp"], "sender": first["sender"], "message": first["message"]
+            }}}
+        }, push)
+
+@api_router.post("/triage/chat/{session_id}", dependencies=[Depends(limit_llm_requests)])
 async def chat_with_ai(session_id: str, request: dict):
     """Continue conversation with AI for symptom clarification"""
+    session_id_var.set(session_id)
+    user_msg = None
     try:
         message = request.get("message", "")
         if not message:
             raise HTTPException(status_code=400, detail="Message is required")
             
-        # Save user message
         user_msg = ChatMessage(
             session_id=session_id,
             message=message,
             sender="user"
         )
-        await db.chat_messages.insert_one(user_msg.dict())
-        
-        # Use the same system message as above for context
-        system_message = """You are an AI medical triage assistant. Your role is to:\n1. Analyze patient symptoms and provide accurate medical assessments\n2. Classify urgency levels: Emergency (immediate care), Urgent (same day), Routine (within days), Self-Care\n3. Ask clarifying questions to better understand symptoms\n4. Provide clear, helpful recommendations while emphasizing that this is not a substitute for professional medical advice\n5. Be empathetic and reassuring while maintaining medical accuracy\n\nAlways respond in JSON format with the following structure:\n{\n    \"analysis\": \"Your medical analysis\",\n    \"urgency_level\": \"Emergency|Urgent|Routine|Self-Care\",\n    \"confidence_score\": 0.0-1.0,\n    \"recommended_actions\": [\"action1\", \"action2\"],\n    \"follow_up_questions\": [\"question1\", \"question2\"] (optional)\n}\n\nFor emergency situations (severe chest pain, difficulty breathing, severe bleeding, etc.), always classify as \"Emergency\" and recommend immediate medical attention."""
-        ai_response = await call_openai_chat(session_id, message, system_message)
+        ai_response = await model_router.complete(
+            session_id, message, TRIAGE_SYSTEM_MESSAGE, endpoint="triage_chat", structured=False
+        )
         
-        # Save AI response
+        # Save both turns together
         ai_msg = ChatMessage(
             session_id=session_id,
             message=ai_response,
             sender="ai"
         )
-        await db.chat_messages.insert_one(ai_msg.dict())
+        await append_chat(session_id, [user_msg, ai_msg])
         
         return {"response": ai_response}
         
     except Exception as e:
-        if "quota" in str(e).lower():
+        if is_llm_unavailable(e):
+            # Keep the patient's message even though the model could not answer
+            if user_msg is not None:
+                await append_chat(session_id, [user_msg])
             return {"response": "I'm currently experiencing high demand. Please try again in a few moments, or consult with a healthcare professional if this is urgent."}
         raise HTTPException(status_code=500, detail=f"Error in chat: {str(e)}")
 
-@api_router.get("/triage/session/{session_id}")
+@api_router.get("/triage/session/{session_id}", response_model=TriageSessionView)
 async def get_triage_session(session_id: str):
     """Get triage session details"""
+    session_id_var.set(session_id)
     try:
-        session = await db.triage_sessions.find_one({"id": session_id})
+        session, archived = await find_one_with_archive("triage_sessions", {"id": session_id})
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        # Remove MongoDB _id field
-        if "_id" in session:
-            del session["_id"]
+        recent_chat = session.pop("recent_chat", None)
+        if recent_chat is not None:
+            return {
+                "session": session,
+                "chat_history": recent_chat,
+                "has_older_chat": session.get("chat_count", 0) > len(recent_chat)
+            }
         
-        # Get chat history
-        chat_messages = await db.chat_messages.find({"session_id": session_id}).to_list(100)
-        for msg in chat_messages:
-            if "_id" in msg:
-                del msg["_id"]
+        # Sessions from before the embedded buffer read their chat history
+        # directly; an archived session may still have messages in the hot
+        # collection if its archival pass was interrupted
+        chat_messages = await db.chat_messages.find({"session_id": session_id}, NO_MONGO_ID).to_list(100)
+        if archived:
+            chat_messages += await archive_of("chat_messages").find(
+                {"session_id": session_id}, NO_MONGO_ID
+            ).to_list(100)
+            chat_messages.sort(key=lambda msg: msg["timestamp"])
         
         return {
             "session": session,
@@ -320,58 +2475,156 @@ async def get_triage_session(session_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving session: {str(e)}")
 
+@api_router.get("/triage/session/{session_id}/messages", response_model=ChatHistoryPage)
+async def get_chat_history(session_id: str, before: Optional[datetime] = None, limit: int = 50):
+    """Page through chat history older than a timestamp, oldest message first"""
+    limit = max(1, min(limit, 200))
+    query: Dict[str, Any] = {"session_id": session_id}
+    if before is not None:
+        query["timestamp"] = {"$lt": before}
+    hot, cold = await asyncio.gather(*[
+        collection.find(query, NO_MONGO_ID).sort("timestamp", -1).limit(limit).to_list(limit)
+        for collection in (db.chat_messages, archive_of("chat_messages"))
+    ])
+    page = sorted(hot + cold, key=lambda msg: msg["timestamp"], reverse=True)[:limit]
+    page.reverse()
+    return {
+        "messages": page,
+        "next_before": page[0]["timestamp"] if len(page) == limit else None
+    }
+
 @api_router.get("/triage/urgency-stats")
-async def get_urgency_stats():
+async def get_urgency_stats(request: Request, response: Response):
     """Get urgency level statistics"""
+    cached = not_modified(request, response, collection_etag("triage_sessions"))
+    if cached:
+        return cached
     pipeline = [
+        {"$project": {"_id": 0, "urgency_level": 1}},
+        {"$unionWith": {"coll": "triage_sessions_archive", "pipeline": [{"$project": {"_id": 0, "urgency_level": 1}}]}},
         {"$group": {
             "_id": "$urgency_level",
             "count": {"$sum": 1}
         }}
     ]
     
-    stats = await db.triage_sessions.aggregate(pipeline).to_list(10)
+    stats = await read_db.triage_sessions.aggregate(pipeline).to_list(10)
     return {"urgency_stats": stats}
 
 # Video Consultation Routes
+def consultation_created_response(consultation: Dict[str, Any]) -> Dict[str, Any]:
+    position = consultation_scheduler.position(consultation["id"])
+    estimate = wait_time_estimator.estimate(position or 0, consultation.get("urgency_level"))
+    return {
+        "consultation_id": consultation["id"],
+        "patient_id": consultation["patient_id"],
+        "status": consultation["status"],
+        "estimated_wait": format_wait(estimate),
+        "estimated_wait_minutes": estimate
+    }
+
+async def upsert_patient(patient_name: str, email: Optional[str], phone: Optional[str]) -> Dict[str, Any]:
+    """Find or create a patient keyed by email, else phone, in a single round trip"""
+    email = email.strip().lower() if email and email.strip() else None
+    phone = phone.strip() if phone and phone.strip() else None
+    patient = Patient(name=patient_name, email=email, phone=phone)
+    if email is None and phone is None:
+        # A name does not identify a person, so anonymous visits get a new record
+        await db.patients.insert_one(patient.dict())
+        return {"id": patient.id}
+    return await db.patients.find_one_and_update(
+        {"email": email} if email else {"phone": phone, "email": None},
+        {"$setOnInsert": patient.dict()},
+        upsert=True,
+        projection={"_id": 0, "id": 1},
+        return_document=ReturnDocument.AFTER
+    )
+
 @api_router.post("/consultation/create")
-async def create_consultation(triage_session_id: str, patient_name: str):
-    """Create a video consultation from triage session"""
-    # Get triage session
-    triage_session = await db.triage_sessions.find_one({"id": triage_session_id})
+async def create_consultation(
+    triage_session_id: str,
+    patient_name: str,
+    patient_email: Optional[str] = None,
+    patient_phone: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Create a video consultation from triage session
+
+    Retries carrying the same Idempotency-Key header return the consultation
+    created by the first attempt.
+    """
+    # Independent reads go out together; the patient is written only once they pass
+    triage_session, existing = await asyncio.gather(
+        db.triage_sessions.find_one(
+            {"id": triage_session_id},
+            {"_id": 0, "urgency_level": 1, "symptoms.location": 1}
+        ),
+        db.consultations.find_one({"idempotency_key": idempotency_key}, NO_MONGO_ID)
+        if idempotency_key else asyncio.sleep(0)
+    )
+    if existing:
+        return consultation_created_response(existing)
     if not triage_session:
         raise HTTPException(status_code=404, detail="Triage session not found")
+    patient = await upsert_patient(patient_name, patient_email, patient_phone)
+    patient_id = patient["id"]
     
-    # Create patient if not exists
-    patient_id = str(uuid.uuid4())
-    patient = Patient(id=patient_id, name=patient_name, email=f"{patient_name.lower().replace(' ', '')}@temp.com")
-    await db.patients.insert_one(patient.dict())
-    
-    # Create consultation
+    # Create consultation; the unique idempotency_key index makes a
+    # concurrent retry lose the race here instead of creating a duplicate
     consultation = VideoConsultation(
         triage_session_id=triage_session_id,
         patient_id=patient_id,
+        urgency_level=triage_session.get("urgency_level"),
         status="waiting"
     )
-    await db.consultations.insert_one(consultation.dict())
+    consultation_doc = consultation.dict()
+    if idempotency_key:
+        consultation_doc["idempotency_key"] = idempotency_key
     
-    # Update triage session
-    await db.triage_sessions.update_one(
-        {"id": triage_session_id},
-        {"$set": {"patient_id": patient_id, "patient_name": patient_name, "status": "waiting_consultation"}}
+    # The insert and the triage session update go out together, so creation
+    # takes three sequential round trips: reads, patient upsert, writes
+    def link_session(linked_patient_id: str):
+        return db.triage_sessions.update_one(
+            {"id": triage_session_id},
+            {"$set": {"patient_id": linked_patient_id, "patient_name": patient_name, "status": "waiting_consultation"}}
+        )
+    inserted, linked = await asyncio.gather(
+        db.consultations.insert_one(consultation_doc), link_session(patient_id), return_exceptions=True
+    )
+    if isinstance(inserted, DuplicateKeyError):
+        # A concurrent retry won; point the session back at its patient
+        existing = await db.consultations.find_one({"idempotency_key": idempotency_key}, NO_MONGO_ID)
+        await link_session(existing["patient_id"])
+        return consultation_created_response(existing)
+    for outcome in (inserted, linked):
+        if isinstance(outcome, BaseException):
+            raise outcome
+    bump_version("patients", "consultations", "triage_sessions")
+    consultation_scheduler.enqueue(
+        consultation.id,
+        triage_session.get("urgency_level"),
+        consultation.created_at,
+        (triage_session.get("symptoms") or {}).get("location"),
     )
     
-    return {
-        "consultation_id": consultation.id,
-        "patient_id": patient_id,
-        "status": "waiting",
-        "estimated_wait": "5-10 minutes"
-    }
+    return consultation_created_response(consultation_doc)
 
 @api_router.get("/consultation/queue")
-async def get_consultation_queue():
+async def get_consultation_queue(request: Request, response: Response):
     """Get patient queue for providers"""
+    # wait_time is reported in minutes, so the ETag also rolls over each minute.
+    # Wait estimates depend on which providers are online, so providers count too
+    etag = collection_etag("consultations", "triage_sessions", "patients", "providers",
+                           extra=str(int(time.time() // 60)))
+    cached = not_modified(request, response, etag)
+    if cached:
+        return cached
+    # Filter and sort before the lookups so only queued consultations are
+    # joined, and project down to the fields the queue actually renders
     pipeline = [
+        {"$match": {"status": {"$in": ["waiting", "in_progress"]}}},
+        {"$sort": {"created_at": 1}},
+        {"$limit": 50},
         {
             "$lookup": {
                 "from": "triage_sessions",
@@ -388,36 +2641,66 @@ async def get_consultation_queue():
                 "as": "patient"
             }
         },
-        {"$match": {"status": {"$in": ["waiting", "in_progress"]}}},
-        {"$sort": {"created_at": 1}}
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "status": 1,
+            "created_at": 1,
+            "triage_session_id": 1,
+            "triage.urgency_level": 1,
+            "triage.symptoms": 1,
+            "patient.name": 1
+        }}
     ]
     
     queue = await db.consultations.aggregate(pipeline).to_list(50)
     
     # Process queue data
+    now = datetime.utcnow()
+    positions = consultation_scheduler.positions()
     processed_queue = []
     for item in queue:
-        triage_data = item.get("triage", [{}])[0]
-        patient_data = item.get("patient", [{}])[0]
+        triage_data = (item.get("triage") or [{}])[0]
+        patient_data = (item.get("patient") or [{}])[0]
+        urgency_level = triage_data.get("urgency_level", "Routine")
+        position = positions.get(item["id"])
         
         processed_queue.append({
             "consultation_id": item["id"],
+            "triage_session_id": item.get("triage_session_id"),
             "patient_name": patient_data.get("name", "Unknown"),
-            "urgency_level": triage_data.get("urgency_level", "Routine"),
+            "urgency_level": urgency_level,
             "symptoms": triage_data.get("symptoms", {}),
-            "wait_time": (datetime.utcnow() - item["created_at"]).seconds // 60,
+            "wait_time": int((now - item["created_at"]).total_seconds() // 60),
+            "queue_position": position,
+            "estimated_wait_minutes": (
+                wait_time_estimator.estimate(position, urgency_level) if position is not None else None
+            ),
             "status": item["status"]
         })
     
     return {"queue": processed_queue}
 
 @api_router.post("/consultation/{consultation_id}/start")
-async def start_consultation(consultation_id: str, provider_id: str):
-    """Start a video consultation"""
+async def start_consultation(consultation_id: str, provider_id: Optional[str] = None):
+    """Start a video consultation, picking a provider when none is given"""
     consultation = await db.consultations.find_one({"id": consultation_id})
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found")
     
+    if provider_id is None:
+        provider_id = consultation.get("provider_id")
+    if provider_id is None:
+        entry = consultation_scheduler.waiting.get(consultation_id, {"location": ""})
+        provider = consultation_scheduler.best_provider(entry)
+        if provider is None:
+            raise HTTPException(status_code=409, detail="No provider available")
+        provider_id = provider["id"]
+    # Mark the provider busy before awaiting so the scheduler cannot pick them too
+    provider_presence.assign(consultation_id, provider_id)
+    consultation_scheduler.remove(consultation_id)
+    state_reaper.consultation_started(consultation_id)
+    
     # Update consultation status
     await db.consultations.update_one(
         {"id": consultation_id},
@@ -429,13 +2712,17 @@ async def start_consultation(consultation_id: str, provider_id: str):
             }
         }
     )
+    bump_version("consultations")
     
     return {"message": "Consultation started", "consultation_id": consultation_id}
 
 @api_router.post("/consultation/{consultation_id}/end")
 async def end_consultation(consultation_id: str, notes: str = ""):
     """End a video consultation"""
-    await db.consultations.update_one(
+    consultation_scheduler.remove(consultation_id)
+    state_reaper.consultation_ended(consultation_id)
+    provider_presence.release(consultation_id)
+    consultation = await db.consultations.find_one_and_update(
         {"id": consultation_id},
         {
             "$set": {
@@ -443,87 +2730,1291 @@ async def end_consultation(consultation_id: str, notes: str = ""):
                 "ended_at": datetime.utcnow(),
                 "notes": notes
             }
-        }
+        },
+        projection={"_id": 0, "started_at": 1, "ended_at": 1, "urgency_level": 1},
+        return_document=ReturnDocument.AFTER
     )
+    bump_version("consultations")
+    if consultation:
+        wait_time_estimator.record(consultation.get("started_at"), consultation.get("ended_at"),
+                                   consultation.get("urgency_level"))
     
     return {"message": "Consultation ended", "consultation_id": consultation_id}
 
-@api_router.get("/consultation/{consultation_id}")
+@api_router.get("/consultation/{consultation_id}", response_model=VideoConsultation)
 async def get_consultation(consultation_id: str):
     """Get consultation details"""
-    consultation = await db.consultations.find_one({"id": consultation_id})
+    consultation, _ = await find_one_with_archive("consultations", {"id": consultation_id})
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found")
     
-    # Remove MongoDB _id field
-    if "_id" in consultation:
-        del consultation["_id"]
-    
     return consultation
 
+# Provider presence
+class ProviderPresence:
+    """In-memory provider availability index synced to Mongo in batches
+
+    Profiles are loaded once at startup and kept current by create_provider.
+    Socket events move providers between available, busy and offline; the
+    changes are collected in a dirty set and written with one bulk_write per
+    flush interval, so availability reads never touch Mongo. A provider is
+    busy while they hold a consultation assignment or a live call.
+    """
+    def __init__(self, flush_interval: float = 2.0, heartbeat_timeout: float = 60.0):
+        self.flush_interval = flush_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.profiles: Dict[str, Dict[str, Any]] = {}
+        self.sockets: Dict[str, set] = {}  # provider_id -> socket ids
+        self.sid_to_provider: Dict[str, str] = {}
+        self.last_seen: Dict[str, float] = {}
+        self.assignments: Dict[str, str] = {}  # consultation_id -> provider_id
+        self._dirty: set = set()
+        self._pending_counts: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+        self.listeners: List[Callable[[str, str], None]] = []
+
+    async def load(self):
+        # Stored statuses describe sockets and calls of a previous process;
+        # everyone starts offline until provider_ready
+        async for doc in db.providers.find({}, NO_MONGO_ID):
+            doc["status"] = "offline"
+            self.profiles[doc["id"]] = doc
+        await db.providers.update_many(
+            {"status": {"$ne": "offline"}},
+            {"$set": {"status": "offline", "status_updated_at": datetime.utcnow()}}
+        )
+        # A load retried after startup can find providers already connected
+        for provider_id in list(self.sockets):
+            self._settle(provider_id)
+
+    def upsert_profile(self, profile: Dict[str, Any]):
+        self.profiles[profile["id"]] = profile
+        bump_version("providers")
+
+    def set_status(self, provider_id: str, status: str):
+        profile = self.profiles.get(provider_id)
+        if profile is None or profile.get("status") == status:
+            return
+        profile["status"] = status
+        self._dirty.add(provider_id)
+        bump_version("providers")
+        for listener in self.listeners:
+            listener(provider_id, status)
+
+    def connect(self, provider_id: str, sid: str):
+        self.sockets.setdefault(provider_id, set()).add(sid)
+        self.sid_to_provider[sid] = provider_id
+        self.last_seen[provider_id] = time.monotonic()
+        self._settle(provider_id)
+
+    def heartbeat(self, sid: str) -> Optional[str]:
+        provider_id = self.sid_to_provider.get(sid)
+        if provider_id:
+            self.last_seen[provider_id] = time.monotonic()
+        return provider_id
+
+    def disconnect(self, sid: str) -> Optional[str]:
+        """Drop a socket; returns the provider id if they just went offline"""
+        provider_id = self.sid_to_provider.pop(sid, None)
+        if provider_id is None:
+            return None
+        sids = self.sockets.get(provider_id, set())
+        sids.discard(sid)
+        if sids:
+            return None
+        self._go_offline(provider_id)
+        return provider_id
+
+    def _go_offline(self, provider_id: str):
+        self.sockets.pop(provider_id, None)
+        self.last_seen.pop(provider_id, None)
+        self.set_status(provider_id, "offline")
+
+    def call_started(self, provider_id: str):
+        self.set_status(provider_id, "busy")
+
+    def call_ended(self, provider_id: str):
+        self._pending_counts[provider_id] += 1
+        profile = self.profiles.get(provider_id)
+        if profile is not None:
+            profile["consultations_count"] = profile.get("consultations_count", 0) + 1
+            self._dirty.add(provider_id)
+        self._settle(provider_id)
+
+    def assign(self, consultation_id: str, provider_id: str):
+        """Hold a provider for a consultation, releasing any previous holder"""
+        previous = self.assignments.get(consultation_id)
+        self.assignments[consultation_id] = provider_id
+        if previous and previous != provider_id:
+            self._settle(previous)
+        self.set_status(provider_id, "busy")
+
+    def release(self, consultation_id: str) -> Optional[str]:
+        """Free the provider held for a consultation that ended or expired"""
+        provider_id = self.assignments.pop(consultation_id, None)
+        if provider_id:
+            self._settle(provider_id)
+        return provider_id
+
+    def is_engaged(self, provider_id: str) -> bool:
+        return provider_id in self.assignments.values() or any(
+            call.provider_id == provider_id for call in active_calls.values()
+        )
+
+    def _settle(self, provider_id: str):
+        if self.is_engaged(provider_id):
+            self.set_status(provider_id, "busy")
+        else:
+            self.set_status(provider_id, "available" if self.sockets.get(provider_id) else "offline")
+
+    def provider_for_sid(self, sid: str) -> Optional[str]:
+        return self.sid_to_provider.get(sid)
+
+    def available(self) -> List[Dict[str, Any]]:
+        return [profile for profile in self.profiles.values() if profile.get("status") == "available"]
+
+    def expire_stale(self) -> List[str]:
+        cutoff = time.monotonic() - self.heartbeat_timeout
+        stale = [provider_id for provider_id, seen in self.last_seen.items() if seen < cutoff]
+        for provider_id in stale:
+            for sid in self.sockets.get(provider_id, ()):
+                self.sid_to_provider.pop(sid, None)
+            self._go_offline(provider_id)
+        return stale
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        counts, self._pending_counts = self._pending_counts, Counter()
+        now = datetime.utcnow()
+        operations = []
+        for provider_id in dirty:
+            profile = self.profiles.get(provider_id)
+            if profile is None:
+                continue
+            update: Dict[str, Any] = {"$set": {"status": profile["status"], "status_updated_at": now}}
+            if counts.get(provider_id):
+                update["$inc"] = {"consultations_count": counts[provider_id]}
+            operations.append(UpdateOne({"id": provider_id}, update))
+        if operations:
+            written = False
+            try:
+                await db.providers.bulk_write(operations, ordered=False)
+                written = True
+            except Exception:
+                logger.exception("Provider presence flush failed")
+            finally:
+                if not written:
+                    # Keep the changes for the next flush rather than losing
+                    # them, including a write cancelled at shutdown
+                    self._dirty |= dirty
+                    self._pending_counts.update(counts)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for provider_id in self.expire_stale():
+                await sio.emit("provider_offline", {"provider_id": provider_id, "reason": "heartbeat_timeout"})
+            await self.flush()
+
+    async def start(self):
+        await self.load()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+provider_presence = ProviderPresence(
+    flush_interval=float(os.environ.get("PRESENCE_FLUSH_INTERVAL_S", "2")),
+    heartbeat_timeout=float(os.environ.get("PRESENCE_HEARTBEAT_TIMEOUT_S", "60")),
+)
+
+# Consultation scheduler
+# Urgency is expressed as wait-time credit: an Emergency patient is ranked as
+# if they had already waited an extra hour. Because every waiting patient
+# ages at the same rate, ranking by (created_at - credit) never changes over
+# time and a plain heap stays valid without periodic rescoring.
+URGENCY_WAIT_CREDIT_S = {"Emergency": 3600, "Urgent": 1200, "Routine": 300, "Self-Care": 0}
+
+# Symptom locations that should prefer providers with a matching specialization
+SPECIALIZATION_HINTS = {
+    "chest": ("cardio",),
+    "heart": ("cardio",),
+    "head": ("neuro",),
+    "skin": ("derma",),
+    "abdomen": ("gastro",),
+    "stomach": ("gastro",),
+    "lungs": ("pulmo", "respir"),
+    "bones": ("ortho",),
+    "joints": ("ortho", "rheum"),
+}
+
+class ConsultationScheduler:
+    """Pair waiting consultations with available providers
+
+    Waiting consultations live in a heap ordered by urgency-adjusted arrival
+    time (entries are removed lazily). Arrivals, departures and providers
+    becoming available only set a wake-up event, so bursts are coalesced into
+    a single matching pass. Each pass takes the highest priority patient who
+    is in the waiting room and gives them the connected provider with the
+    best specialization match and the lowest load. An assignment the
+    provider does not accept in time is released and the consultation goes
+    back in the queue, preferring a different provider.
+    """
+    def __init__(self, presence: ProviderPresence, enabled: bool = True):
+        self.presence = presence
+        self.enabled = enabled
+        self.waiting: Dict[str, Dict[str, Any]] = {}
+        self.assigned: Dict[str, tuple] = {}  # consultation_id -> (entry, provider_id) awaiting acceptance
+        self._heap: List[tuple] = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        presence.listeners.append(self._on_provider_status)
+
+    @staticmethod
+    def priority(urgency_level: Optional[str], created_at: datetime) -> float:
+        return created_at.timestamp() - URGENCY_WAIT_CREDIT_S.get(urgency_level or "Routine", 300)
+
+    def enqueue(self, consultation_id: str, urgency_level: Optional[str], created_at: datetime,
+                location: Optional[str] = None):
+        entry = {
+            "consultation_id": consultation_id,
+            "urgency_level": urgency_level or "Routine",
+            "location": (location or "").lower(),
+            "created_at": created_at,
+        }
+        self.waiting[consultation_id] = entry
+        heapq.heappush(self._heap, (self.priority(urgency_level, created_at), consultation_id))
+        self._wake.set()
+
+    def _requeue(self, entry: Dict[str, Any]):
+        self.waiting[entry["consultation_id"]] = entry
+        heapq.heappush(self._heap, (self.priority(entry["urgency_level"], entry["created_at"]),
+                                    entry["consultation_id"]))
+        self._wake.set()
+
+    def remove(self, consultation_id: str):
+        """Drop a consultation that started, ended or expired"""
+        self.waiting.pop(consultation_id, None)
+        self.assigned.pop(consultation_id, None)
+
+    def patient_arrived(self):
+        if self.waiting:
+            self._wake.set()
+
+    def _on_provider_status(self, provider_id: str, status: str):
+        if status == "available" and self.waiting:
+            self._wake.set()
+
+    def position(self, consultation_id: str) -> Optional[int]:
+        """Zero-based queue position of a waiting consultation"""
+        entry = self.waiting.get(consultation_id)
+        if entry is None:
+            return None
+        key = self.priority(entry["urgency_level"], entry["created_at"])
+        return sum(
+            1 for other in self.waiting.values()
+            if self.priority(other["urgency_level"], other["created_at"]) < key
+        )
+
+    def positions(self) -> Dict[str, int]:
+        """Queue positions of every waiting consultation"""
+        ranked = sorted(self.waiting.values(), key=lambda e: self.priority(e["urgency_level"], e["created_at"]))
+        return {entry["consultation_id"]: index for index, entry in enumerate(ranked)}
+
+    def ready(self) -> List[Dict[str, Any]]:
+        """Waiting consultations whose patient is in the waiting room, highest priority first"""
+        # Drop entries that were removed or re-pushed since the last pass
+        live, self._heap = set(), [item for item in self._heap if item[1] in self.waiting]
+        heapq.heapify(self._heap)
+        entries = []
+        for _, consultation_id in sorted(self._heap):
+            if consultation_id not in live and waiting_room.get(consultation_id) is not None:
+                live.add(consultation_id)
+                entries.append(self.waiting[consultation_id])
+        return entries
+
+    def best_provider(self, entry: Dict[str, Any], connected_only: bool = True) -> Optional[Dict[str, Any]]:
+        hints = SPECIALIZATION_HINTS.get(entry.get("location", ""), ())
+        best, best_score = None, None
+        for profile in self.presence.available():
+            if connected_only and not self.presence.sockets.get(profile["id"]):
+                continue
+            specialization = profile.get("specialization", "").lower()
+            matches = any(hint in specialization for hint in hints)
+            passed = profile["id"] in entry.get("passed_over", ())
+            score = (passed, 0 if matches else 1, profile.get("consultations_count", 0), -profile.get("rating", 0))
+            if best_score is None or score < best_score:
+                best, best_score = profile, score
+        return best
+
+    async def _assign(self, entry: Dict[str, Any], provider: Dict[str, Any]):
+        consultation_id = entry["consultation_id"]
+        provider_id = provider["id"]
+        self.waiting.pop(consultation_id, None)
+        self.assigned[consultation_id] = (entry, provider_id)
+        self.presence.assign(consultation_id, provider_id)
+        result = await db.consultations.update_one(
+            {"id": consultation_id, "status": "waiting"},
+            {"$set": {"provider_id": provider_id, "assigned_at": datetime.utcnow()}}
+        )
+        if not result.matched_count:
+            # Started or ended elsewhere while we were matching
+            if self.assigned.get(consultation_id, (None, None))[1] == provider_id:
+                self.assigned.pop(consultation_id)
+                self.presence.release(consultation_id)
+            return
+        state_reaper.consultation_assigned(consultation_id)
+        bump_version("consultations")
+        assignment = {
+            "consultation_id": consultation_id,
+            "provider_id": provider_id,
+            "provider_name": provider.get("name"),
+            "urgency_level": entry["urgency_level"],
+        }
+        for sid in self.presence.sockets.get(provider_id, ()):
+            await sio.emit("consultation_assigned", assignment, room=sid)
+        patient = waiting_room.get(consultation_id)
+        if patient:
+            await sio.emit("consultation_assigned", assignment, room=patient.socket_id)
+        log_event("consultation_assigned", "Consultation auto-assigned", **assignment)
+
+    async def match(self):
+        for entry in self.ready():
+            if entry["consultation_id"] not in self.waiting:
+                continue
+            provider = self.best_provider(entry)
+            if provider is None:
+                return
+            await self._assign(entry, provider)
+
+    async def assignment_expired(self, consultation_id: str) -> bool:
+        """Release an assignment the provider never accepted and queue the consultation again"""
+        assigned = self.assigned.pop(consultation_id, None)
+        if assigned is None:
+            # Accepted, ended or already expired
+            return False
+        entry, provider_id = assigned
+        self.presence.release(consultation_id)
+        entry["passed_over"] = {*entry.get("passed_over", ()), provider_id}
+        self._requeue(entry)
+        result = await db.consultations.update_one(
+            {"id": consultation_id, "status": "waiting", "provider_id": provider_id},
+            {"$unset": {"provider_id": "", "assigned_at": ""}}
+        )
+        if not result.matched_count:
+            # Started (or reassigned) while the update was in flight
+            if consultation_id not in self.assigned:
+                self.waiting.pop(consultation_id, None)
+            return False
+        bump_version("consultations")
+        expiry = {"consultation_id": consultation_id, "provider_id": provider_id}
+        for sid in self.presence.sockets.get(provider_id, ()):
+            await sio.emit("assignment_expired", expiry, room=sid)
+        patient = waiting_room.get(consultation_id)
+        if patient:
+            await sio.emit("assignment_expired", expiry, room=patient.socket_id)
+        return True
+
+    async def load(self):
+        # Assignments made by a previous process were never accepted
+        await db.consultations.update_many(
+            {"status": "waiting", "provider_id": {"$ne": None}},
+            {"$unset": {"provider_id": "", "assigned_at": ""}}
+        )
+        pipeline = [
+            {"$match": {"status": "waiting"}},
+            {"$lookup": {
+                "from": "triage_sessions",
+                "localField": "triage_session_id",
+                "foreignField": "id",
+                "as": "triage"
+            }},
+            {"$project": {"_id": 0, "id": 1, "created_at": 1, "triage.urgency_level": 1, "triage.symptoms.location": 1}}
+        ]
+        async for item in db.consultations.aggregate(pipeline):
+            triage = (item.get("triage") or [{}])[0]
+            self.enqueue(item["id"], triage.get("urgency_level"), item["created_at"],
+                         (triage.get("symptoms") or {}).get("location"))
+
+    async def run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                await self.match()
+            except Exception:
+                logger.exception("Consultation scheduling pass failed")
+
+    async def start(self):
+        await self.load()
+        if self.enabled:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+consultation_scheduler = ConsultationScheduler(
+    provider_presence,
+    enabled=os.environ.get("SCHEDULER_AUTO_ASSIGN", "true").lower() == "true",
+)
+
+# Wait-time estimation
+class RunningStat:
+    """Exponentially weighted mean and variance, updated in O(1)"""
+    __slots__ = ("alpha", "count", "mean", "var")
+
+    def __init__(self, alpha: float = 0.05):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        if self.count == 1:
+            self.mean = value
+            return
+        diff = value - self.mean
+        increment = self.alpha * diff
+        self.mean += increment
+        self.var = (1 - self.alpha) * (self.var + diff * increment)
+
+class WaitTimeEstimator:
+    """Estimate queue waits from rolling consultation durations
+
+    Durations (started_at to ended_at) are tracked per urgency level and
+    overall. A patient at queue position k with c providers on shift waits
+    roughly (k + 1) / c service times; the spread of a sum of k + 1 service
+    times grows with sqrt(k + 1), which gives the low/high band (~80%).
+    Until enough consultations have completed, a prior is blended in.
+    """
+    PRIOR_MEAN_MIN = 12.0
+    PRIOR_STD_MIN = 6.0
+    PRIOR_WEIGHT = 5
+    Z_80 = 1.28
+
+    def __init__(self, presence: ProviderPresence):
+        self.presence = presence
+        self.durations: Dict[str, RunningStat] = {}
+
+    def record(self, started_at: Optional[datetime], ended_at: Optional[datetime], urgency_level: Optional[str] = None):
+        if not started_at or not ended_at or ended_at <= started_at:
+            return
+        minutes = (ended_at - started_at).total_seconds() / 60
+        for key in ("all", urgency_level or "Routine"):
+            self.durations.setdefault(key, RunningStat()).add(minutes)
+
+    def service_time(self, urgency_level: Optional[str]) -> tuple:
+        stat = self.durations.get(urgency_level or "Routine")
+        if stat is None or stat.count < self.PRIOR_WEIGHT:
+            stat = self.durations.get("all")
+        if stat is None or stat.count == 0:
+            return self.PRIOR_MEAN_MIN, self.PRIOR_STD_MIN
+        weight = min(stat.count, self.PRIOR_WEIGHT) / self.PRIOR_WEIGHT
+        mean = weight * stat.mean + (1 - weight) * self.PRIOR_MEAN_MIN
+        std = weight * math.sqrt(stat.var) + (1 - weight) * self.PRIOR_STD_MIN
+        return mean, std
+
+    def capacity(self) -> int:
+        online = sum(1 for sids in self.presence.sockets.values() if sids)
+        return max(online or len(self.presence.available()), 1)
+
+    def estimate(self, position: int, urgency_level: Optional[str]) -> Dict[str, int]:
+        mean, std = self.service_time(urgency_level)
+        servers = self.capacity()
+        ahead = position + 1
+        expected = ahead * mean / servers
+        spread = self.Z_80 * std * math.sqrt(ahead) / servers
+        return {
+            "low": max(int(expected - spread), 0),
+            "expected": int(round(expected)),
+            "high": int(math.ceil(expected + spread)),
+        }
+
+    async def load(self, limit: int = 500):
+        cursor = read_db.consultations.find(
+            {"status": "completed", "started_at": {"$ne": None}, "ended_at": {"$ne": None}},
+            {"_id": 0, "started_at": 1, "ended_at": 1, "urgency_level": 1},
+        ).sort("ended_at", -1).limit(limit)
+        history = await cursor.to_list(limit)
+        for doc in reversed(history):
+            self.record(doc["started_at"], doc["ended_at"], doc.get("urgency_level"))
+
+wait_time_estimator = WaitTimeEstimator(provider_presence)
+
+def format_wait(estimate: Dict[str, int]) -> str:
+    if estimate["high"] <= 1:
+        return "less than a minute"
+    return f"{estimate['low']}-{estimate['high']} minutes"
+
+# Hot/cold data tiering
+# Finished records older than ARCHIVE_AFTER_DAYS are moved into
+# <collection>_archive so the live collections stay small. Reads for a single
+# session or consultation fall through to the archive on a miss.
+TERMINAL_CONSULTATION_STATUSES = ["completed", "cancelled", "abandoned"]
+
+def archive_of(collection_name: str):
+    return db[f"{collection_name}_archive"]
+
+async def find_one_with_archive(collection_name: str, query: Dict[str, Any], projection=NO_MONGO_ID):
+    """find_one on the hot collection, falling back to its archive; returns (doc, archived)"""
+    doc = await db[collection_name].find_one(query, projection)
+    if doc is not None:
+        return doc, False
+    doc = await archive_of(collection_name).find_one(query, projection)
+    return doc, doc is not None
+
+class Archiver:
+    """Background mover of finished records into archive collections
+
+    Documents are copied with their original _id, so a pass interrupted
+    between the insert and the delete is safely repeated. Each batch sleeps
+    long enough to stay under docs_per_second.
+    """
+    def __init__(self, after_days: float, batch_size: int = 500, docs_per_second: float = 1000.0,
+                 interval: float = 3600.0):
+        self.after = timedelta(days=after_days)
+        self.batch_size = batch_size
+        self.docs_per_second = docs_per_second
+        self.interval = interval
+        self.last_run: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def _copy_then_delete(self, collection_name: str, docs: List[Dict[str, Any]]):
+        try:
+            await archive_of(collection_name).insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        await db[collection_name].delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        await asyncio.sleep(len(docs) / self.docs_per_second)
+
+    async def archive_consultations(self, cutoff: datetime) -> int:
+        moved = 0
+        query = {"status": {"$in": TERMINAL_CONSULTATION_STATUSES}, "created_at": {"$lt": cutoff}}
+        while True:
+            docs = await db.consultations.find(query).limit(self.batch_size).to_list(self.batch_size)
+            if not docs:
+                return moved
+            await self._copy_then_delete("consultations", docs)
+            moved += len(docs)
+
+    async def archive_triage_sessions(self, cutoff: datetime) -> Dict[str, int]:
+        moved = {"triage_sessions": 0, "chat_messages": 0}
+        live_session_ids = await db.consultations.distinct(
+            "triage_session_id", {"status": {"$nin": TERMINAL_CONSULTATION_STATUSES}}
+        )
+        query = {"updated_at": {"$lt": cutoff}, "id": {"$nin": live_session_ids}}
+        while True:
+            sessions = await db.triage_sessions.find(query).limit(self.batch_size).to_list(self.batch_size)
+            if not sessions:
+                return moved
+            # Sessions move before their chat so an archived session always
+            # knows to look in both tiers for its messages
+            await self._copy_then_delete("triage_sessions", sessions)
+            moved["triage_sessions"] += len(sessions)
+            session_ids = [session["id"] for session in sessions]
+            while True:
+                messages = await db.chat_messages.find(
+                    {"session_id": {"$in": session_ids}}
+                ).limit(self.batch_size).to_list(self.batch_size)
+                if not messages:
+                    break
+                await self._copy_then_delete("chat_messages", messages)
+                moved["chat_messages"] += len(messages)
+
+    async def run_once(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        cutoff = datetime.utcnow() - self.after
+        moved = await self.archive_triage_sessions(cutoff)
+        moved["consultations"] = await self.archive_consultations(cutoff)
+        if moved["consultations"]:
+            bump_version("consultations")
+        if moved["triage_sessions"]:
+            bump_version("triage_sessions")
+        self.last_run = {
+            "finished_at": datetime.utcnow().isoformat(),
+            "cutoff": cutoff.isoformat(),
+            "moved": moved,
+            "duration_s": round(time.monotonic() - started, 2),
+        }
+        log_event("archive_run", "Archival pass finished", **self.last_run)
+        return self.last_run
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Archival pass failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+archiver: Optional[Archiver] = None
+if os.environ.get("ARCHIVE_AFTER_DAYS"):
+    archiver = Archiver(
+        after_days=float(os.environ["ARCHIVE_AFTER_DAYS"]),
+        batch_size=int(os.environ.get("ARCHIVE_BATCH_SIZE", "500")),
+        docs_per_second=float(os.environ.get("ARCHIVE_DOCS_PER_SECOND", "1000")),
+        interval=float(os.environ.get("ARCHIVE_INTERVAL_S", "3600")),
+    )
+
+@api_router.get("/admin/archive", dependencies=[Depends(verify_admin_token)])
+async def get_archive_status():
+    """Get the result of the last archival pass"""
+    if archiver is None:
+        return {"enabled": False}
+    return {"enabled": True, "after_days": archiver.after.days, "last_run": archiver.last_run}
+
 # Provider Routes
 @api_router.post("/providers")
 async def create_provider(provider: Provider):
     """Create a new provider"""
     await db.providers.insert_one(provider.dict())
+    provider_presence.upsert_profile(provider.dict())
     return provider
 
-@api_router.get("/providers")
+@api_router.get("/providers", response_model=List[Provider])
 async def get_providers():
     """Get all providers"""
-    providers = await db.providers.find().to_list(100)
-    for provider in providers:
-        if "_id" in provider:
-            del provider["_id"]
+    providers = await read_db.providers.find({}, NO_MONGO_ID).to_list(100)
     return providers
 
-@api_router.get("/providers/available")
-async def get_available_providers():
+@api_router.get("/providers/available", response_model=List[Provider])
+async def get_available_providers(request: Request, response: Response):
     """Get available providers"""
-    providers = await db.providers.find({"status": "available"}).to_list(100)
-    return providers
+    cached = not_modified(request, response, collection_etag("providers"))
+    if cached:
+        return cached
+    return provider_presence.available()
+
+# Change feed
+PROVIDERS_ROOM = "providers"
+# Error codes meaning a resume token can no longer be used
+STALE_RESUME_TOKEN_CODES = {260, 280, 286}
+NOT_REPLICA_SET_CODE = 40573
+
+def live_fields(doc: Dict[str, Any], fields: tuple) -> Dict[str, Any]:
+    return {field: doc[field].isoformat() if isinstance(doc.get(field), datetime) else doc.get(field) for field in fields}
+
+class ChangeFeed:
+    """Push collection changes to interested Socket.IO rooms via change streams
+
+    Each watched collection runs its own change stream. The last delivered
+    resume token is checkpointed to change_feed_tokens, so a restarted
+    process resumes where it stopped. When a token has aged out of the oplog
+    the stream restarts from now and dashboards are told to resync. Every
+    change, including deletes, also bumps the collection's ETag version so
+    writes made by other processes invalidate this one's cached responses.
+    """
+    collections = ("consultations", "triage_sessions", "providers", "patients")
+
+    def __init__(self, checkpoint_interval: float = 1.0):
+        self.checkpoint_interval = checkpoint_interval
+        self.tokens: Dict[str, Any] = {}
+        self.dirty: set = set()
+        self.delivered: Counter = Counter()
+        self.status: Dict[str, str] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    async def dispatch(self, name: str, change: Dict[str, Any]):
+        doc = change.get("fullDocument")
+        if not doc or "id" not in doc:
+            return
+        updated = list(((change.get("updateDescription") or {}).get("updatedFields") or {}).keys())
+        payload = {"operation": change["operationType"], "updated_fields": updated}
+        if name == "consultations":
+            payload.update(live_fields(doc, ("id", "status", "urgency_level", "provider_id", "triage_session_id",
+                                             "started_at", "ended_at")))
+            await sio.emit("consultation_changed", payload, room=PROVIDERS_ROOM)
+            await sio.emit("consultation_status", payload, room=f"consultation:{doc['id']}")
+        elif name == "triage_sessions":
+            # Dashboards only care when the urgency mix changes
+            if change["operationType"] != "update" or "urgency_level" in updated:
+                payload.update(live_fields(doc, ("id", "status", "urgency_level", "confidence_score", "updated_at")))
+                await sio.emit("triage_changed", payload, room=PROVIDERS_ROOM)
+        elif name == "providers":
+            payload.update(live_fields(doc, ("id", "name", "specialization", "status", "rating")))
+            await sio.emit("provider_changed", payload, room=PROVIDERS_ROOM)
+
+    async def watch(self, name: str):
+        saved = await db.change_feed_tokens.find_one({"_id": name})
+        resume_after = saved["token"] if saved else None
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        backoff = 1.0
+        while True:
+            try:
+                async with db[name].watch(pipeline, full_document="updateLookup", resume_after=resume_after) as stream:
+                    self.status[name] = "watching"
+                    backoff = 1.0
+                    async for change in stream:
+                        bump_version(name)
+                        await self.dispatch(name, change)
+                        resume_after = change["_id"]
+                        self.tokens[name] = resume_after
+                        self.dirty.add(name)
+                        self.delivered[name] += 1
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == NOT_REPLICA_SET_CODE:
+                    self.status[name] = "unsupported"
+                    log_event("change_feed_unsupported", "Change streams need a replica set; live updates disabled",
+                              level=logging.WARNING, collection=name)
+                    return
+                if e.code in STALE_RESUME_TOKEN_CODES and resume_after is not None:
+                    log_event("change_feed_resync", "Resume token expired; restarting stream",
+                              level=logging.WARNING, collection=name)
+                    resume_after = None
+                    self.tokens.pop(name, None)
+                    self.dirty.discard(name)
+                    await db.change_feed_tokens.delete_one({"_id": name})
+                    await sio.emit("resync", {"collection": name}, room=PROVIDERS_ROOM)
+                    continue
+                logger.exception("Change stream on %s failed", name)
+            except Exception:
+                logger.exception("Change stream on %s failed", name)
+            self.status[name] = "reconnecting"
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    async def checkpoint(self):
+        if not self.dirty:
+            return
+        names, self.dirty = self.dirty, set()
+        now = datetime.utcnow()
+        await db.change_feed_tokens.bulk_write([
+            UpdateOne({"_id": name}, {"$set": {"token": self.tokens[name], "updated_at": now}}, upsert=True)
+            for name in names if name in self.tokens
+        ], ordered=False)
+
+    async def run_checkpoints(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception:
+                logger.exception("Change feed checkpoint failed")
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self.watch(name)) for name in self.collections]
+        self._tasks.append(asyncio.create_task(self.run_checkpoints()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            await self.checkpoint()
+        except Exception:
+            logger.exception("Final change feed checkpoint failed")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "status": dict(self.status),
+            "delivered": dict(self.delivered),
+            "checkpointed": sorted(self.tokens),
+        }
+
+change_feed: Optional[ChangeFeed] = None
+if os.environ.get("CHANGE_FEED_ENABLED", "true").lower() == "true":
+    change_feed = ChangeFeed(checkpoint_interval=float(os.environ.get("CHANGE_FEED_CHECKPOINT_S", "1")))
+
+# Signaling relay
+ICE_CANDIDATE_MAX_LENGTH = 1024
+SDP_MAX_BYTES = 64 * 1024
+
+class SignalingRelay:
+    """Coalesce, validate and de-duplicate WebRTC signaling between call peers
+
+    Clients opt in with signaling_capabilities. Candidates for an opted-in
+    receiver are held for batch_window seconds and delivered together as
+    webrtc_ice_candidates; other receivers keep getting one
+    webrtc_ice_candidate per candidate, without the added delay. Large SDP
+    is deflated for receivers that accept it.
+    """
+    def __init__(self, batch_window: float = 0.02, max_batch: int = 16, sdp_compress_min_bytes: int = 1024):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.sdp_compress_min_bytes = sdp_compress_min_bytes
+        self.capabilities: Dict[str, Dict[str, bool]] = {}
+        self.seen: Dict[str, set] = {}  # call_id -> (sender sid, candidate key)
+        self.pending: Dict[tuple, List[Any]] = {}  # (call_id, sender sid, target sid) -> candidates
+        self._timers: Dict[tuple, asyncio.Task] = {}
+        self.stats: Counter = Counter()
+
+    def set_capabilities(self, sid: str, data: Dict[str, Any]):
+        self.capabilities[sid] = {
+            "ice_batch": bool(data.get("ice_batch")),
+            "deflate": "deflate" in (data.get("sdp_encodings") or []),
+        }
+
+    def supports(self, sid: str, feature: str) -> bool:
+        return self.capabilities.get(sid, {}).get(feature, False)
+
+    @staticmethod
+    def candidate_key(candidate: Dict[str, Any]) -> Optional[tuple]:
+        """Identity of an ICE candidate, or None if it is malformed"""
+        init = candidate
+        # simple-peer wraps the RTCIceCandidateInit in {"type": "candidate", "candidate": {...}}
+        if isinstance(candidate.get("candidate"), dict):
+            init = candidate["candidate"]
+        line = init.get("candidate")
+        if not isinstance(line, str) or len(line) > ICE_CANDIDATE_MAX_LENGTH:
+            return None
+        # An empty candidate line is the end-of-candidates marker
+        if line and not line.startswith("candidate:"):
+            return None
+        mid, line_index = init.get("sdpMid"), init.get("sdpMLineIndex")
+        if mid is not None and not isinstance(mid, str) or line_index is not None and not isinstance(line_index, int):
+            return None
+        return line, mid, line_index
+
+    async def relay_candidates(self, call_id: str, sender_sid: str, target_sid: str, candidates: List[Any]):
+        seen = self.seen.setdefault(call_id, set())
+        accepted = []
+        end_of_candidates = False
+        for candidate in candidates:
+            self.stats["received"] += 1
+            if candidate is None or isinstance(candidate, dict) and "candidate" not in candidate:
+                # End-of-candidates, or another simple-peer signal such as renegotiate
+                end_of_candidates = end_of_candidates or candidate is None
+                accepted.append(candidate)
+                continue
+            key = self.candidate_key(candidate) if isinstance(candidate, dict) else None
+            if key is None:
+                self.stats["invalid"] += 1
+                continue
+            if (sender_sid, key) in seen:
+                self.stats["duplicates"] += 1
+                continue
+            seen.add((sender_sid, key))
+            end_of_candidates = end_of_candidates or not key[0]
+            accepted.append(candidate)
+        if not accepted:
+            return
+
+        if not self.supports(target_sid, "ice_batch"):
+            for candidate in accepted:
+                await sio.emit("webrtc_ice_candidate", {
+                    "call_id": call_id,
+                    "candidate": candidate,
+                    "from": sender_sid
+                }, room=target_sid)
+            self.stats["emitted"] += len(accepted)
+            return
+
+        slot = (call_id, sender_sid, target_sid)
+        buffer = self.pending.setdefault(slot, [])
+        buffer.extend(accepted)
+        if len(buffer) >= self.max_batch or end_of_candidates:
+            await self.flush(slot)
+        elif slot not in self._timers:
+            self._timers[slot] = asyncio.create_task(self._flush_later(slot))
+
+    async def _flush_later(self, slot: tuple):
+        await asyncio.sleep(self.batch_window)
+        self._timers.pop(slot, None)
+        await self.flush(slot)
+
+    async def flush(self, slot: tuple):
+        timer = self._timers.pop(slot, None)
+        if timer is not None:
+            timer.cancel()
+        candidates = self.pending.pop(slot, None)
+        if not candidates:
+            return
+        call_id, sender_sid, target_sid = slot
+        await sio.emit("webrtc_ice_candidates", {
+            "call_id": call_id,
+            "candidates": candidates,
+            "from": sender_sid
+        }, room=target_sid)
+        self.stats["emitted"] += 1
+        self.stats["batches"] += 1
+
+    def encode_description(self, description: Any, target_sid: str) -> Any:
+        """Deflate a large SDP for a receiver that advertised support"""
+        if not isinstance(description, dict) or not self.supports(target_sid, "deflate"):
+            return description
+        sdp = description.get("sdp")
+        if not isinstance(sdp, str) or len(sdp) < self.sdp_compress_min_bytes:
+            return description
+        compressed = zlib.compress(sdp.encode(), 6)
+        self.stats["sdp_bytes_saved"] += len(sdp) - len(compressed)
+        encoded = {key: value for key, value in description.items() if key != "sdp"}
+        encoded["sdp_deflate"] = compressed
+        return encoded
+
+    def decode_description(self, description: Any) -> Any:
+        """Inflate an SDP a client sent deflated; None if it is invalid"""
+        if not isinstance(description, dict) or "sdp_deflate" not in description:
+            return description
+        inflater = zlib.decompressobj()
+        try:
+            sdp = inflater.decompress(description["sdp_deflate"], SDP_MAX_BYTES)
+        except (zlib.error, TypeError):
+            sdp = None
+        if sdp is None or inflater.unconsumed_tail:
+            self.stats["invalid"] += 1
+            return None
+        decoded = {key: value for key, value in description.items() if key != "sdp_deflate"}
+        decoded["sdp"] = sdp.decode(errors="replace")
+        return decoded
+
+    def forget_call(self, call_id: str):
+        self.seen.pop(call_id, None)
+        for slot in [slot for slot in self.pending if slot[0] == call_id]:
+            self.pending.pop(slot, None)
+            timer = self._timers.pop(slot, None)
+            if timer is not None:
+                timer.cancel()
+
+    def forget_sid(self, sid: str):
+        self.capabilities.pop(sid, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        received = self.stats["received"]
+        return {
+            **dict(self.stats),
+            "batch_window_ms": self.batch_window * 1000,
+            "messages_per_candidate": round(self.stats["emitted"] / received, 3) if received else None,
+            "pending_batches": len(self.pending),
+        }
+
+signaling_relay = SignalingRelay(
+    batch_window=float(os.environ.get("ICE_BATCH_WINDOW_MS", "20")) / 1000,
+    max_batch=int(os.environ.get("ICE_BATCH_MAX", "16")),
+    sdp_compress_min_bytes=int(os.environ.get("SDP_COMPRESS_MIN_BYTES", "1024")),
+)
+
+# Stale state expiry
+class TimerWheel:
+    """Hierarchical timing wheel with O(1) schedule and cancel
+
+    Level 0 has one slot per tick and each slot of a higher level spans a
+    full rotation of the level below. When a level's cursor reaches a slot,
+    the timers in it are cascaded into finer slots, so every timer moves at
+    most once per level before it fires.
+    """
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.timers: Dict[str, tuple] = {}  # key -> (expires tick, level, slot, payload)
+        self.origin = time.monotonic()
+        self.current = 0
+
+    def _place(self, key: str, expires: int, payload: Any):
+        delta = expires - self.current
+        level = 0
+        while level < self.levels - 1 and delta >= self.slots ** (level + 1):
+            level += 1
+        # Timers beyond the top level's range park in its furthest slot and
+        # are re-placed when that slot cascades
+        horizon = min(expires, self.current + self.slots ** self.levels - 1)
+        slot = (horizon // self.slots ** level) % self.slots
+        self.wheels[level][slot].add(key)
+        self.timers[key] = (expires, level, slot, payload)
+
+    def schedule(self, key: str, delay: float, payload: Any = None):
+        self.cancel(key)
+        expires = max(self.current + int(math.ceil(delay / self.tick)), self.current + 1)
+        self._place(key, expires, payload)
+
+    def cancel(self, key: str) -> bool:
+        timer = self.timers.pop(key, None)
+        if timer is None:
+            return False
+        _, level, slot, _ = timer
+        self.wheels[level][slot].discard(key)
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.timers
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def advance(self, now: Optional[float] = None) -> List[tuple]:
+        """Move to the tick for now and return the (key, payload) pairs that fired"""
+        target = int(((time.monotonic() if now is None else now) - self.origin) / self.tick)
+        fired = []
+        while self.current < target:
+            self.current += 1
+            for level in range(self.levels - 1, 0, -1):
+                span = self.slots ** level
+                if self.current % span == 0:
+                    bucket = self.wheels[level][(self.current // span) % self.slots]
+                    keys = list(bucket)
+                    bucket.clear()
+                    for key in keys:
+                        expires, _, _, payload = self.timers.pop(key)
+                        self._place(key, expires, payload)
+            bucket = self.wheels[0][self.current % self.slots]
+            keys = list(bucket)
+            bucket.clear()
+            for key in keys:
+                expires, _, _, payload = self.timers.pop(key)
+                if expires > self.current:
+                    self._place(key, expires, payload)
+                else:
+                    fired.append((key, payload))
+        return fired
+
+class StateReaper:
+    """Expire abandoned calls, waiting-room entries and consultations
+
+    Call setup that never reaches accept_call, waiting-room entries whose
+    patient has gone, auto-assignments the provider never accepts and
+    consultations left in progress past their deadline all get a timer. On expiry the peers are notified, in-memory state is
+    dropped and consultations are marked abandoned with one update per tick.
+    """
+    def __init__(self, call_setup_timeout: float = 60.0, waiting_timeout: float = 4 * 3600.0,
+                 waiting_grace: float = 120.0, assignment_timeout: float = 120.0,
+                 consultation_timeout: float = 3 * 3600.0, tick: float = 1.0):
+        self.call_setup_timeout = call_setup_timeout
+        self.waiting_timeout = waiting_timeout
+        self.waiting_grace = waiting_grace
+        self.assignment_timeout = assignment_timeout
+        self.consultation_timeout = consultation_timeout
+        self.wheel = TimerWheel(tick=tick)
+        self.abandoned: Dict[str, str] = {}  # consultation_id -> status it is abandoned from
+        self.expired: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def call_started(self, call_id: str):
+        self.wheel.schedule(f"call:{call_id}", self.call_setup_timeout, ("call_setup", call_id))
+
+    def call_accepted(self, call_id: str, consultation_id: Optional[str]):
+        self.wheel.cancel(f"call:{call_id}")
+        if consultation_id:
+            self.consultation_started(consultation_id)
+
+    def call_ended(self, call_id: str):
+        self.wheel.cancel(f"call:{call_id}")
+
+    def patient_waiting(self, consultation_id: str):
+        self.wheel.schedule(f"waiting:{consultation_id}", self.waiting_timeout, ("waiting", consultation_id))
+
+    def patient_disconnected(self, consultation_id: str):
+        # The waiting room rejoins on every socket reconnect, which re-arms
+        # the full timer through patient_waiting
+        self.wheel.schedule(f"waiting:{consultation_id}", self.waiting_grace, ("waiting", consultation_id))
+
+    def patient_left(self, consultation_id: str):
+        self.wheel.cancel(f"waiting:{consultation_id}")
+
+    def consultation_assigned(self, consultation_id: str):
+        self.wheel.schedule(f"assignment:{consultation_id}", self.assignment_timeout,
+                            ("assignment", consultation_id))
+
+    def consultation_started(self, consultation_id: str, elapsed: float = 0.0):
+        self.wheel.schedule(f"consultation:{consultation_id}", max(self.consultation_timeout - elapsed, 0.0),
+                            ("consultation", consultation_id))
+
+    def consultation_ended(self, consultation_id: str):
+        self.wheel.cancel(f"consultation:{consultation_id}")
+
+    async def load(self):
+        """Re-arm deadlines for consultations that were in progress before a restart"""
+        now = datetime.utcnow()
+        async for doc in db.consultations.find({"status": "in_progress"}, {"_id": 0, "id": 1, "started_at": 1}):
+            elapsed = (now - doc["started_at"]).total_seconds() if doc.get("started_at") else 0.0
+            self.consultation_started(doc["id"], elapsed)
+
+    async def expire(self, kind: str, target_id: str):
+        if kind == "call_setup":
+            call = active_calls.get(target_id)
+            if call is None or call.status != "connecting":
+                return
+            active_calls.remove(target_id)
+            await end_call_state(call, "setup_timeout")
+        elif kind == "waiting":
+            patient = waiting_room.remove(target_id)
+            consultation_scheduler.remove(target_id)
+            consultation = await db.consultations.find_one({"id": target_id}, {"_id": 0, "status": 1})
+            if consultation is not None and consultation.get("status") != "waiting":
+                # Started over REST (or finished) while the waiting socket was gone
+                return
+            provider_presence.release(target_id)
+            self.abandoned[target_id] = "waiting"
+            self.wheel.cancel(f"assignment:{target_id}")
+            if patient:
+                await sio.emit("waiting_room_expired", {"consultation_id": target_id}, room=patient.socket_id)
+            await sio.emit("queue_updated", {"action": "patient_left", "consultation_id": target_id},
+                           room=PROVIDERS_ROOM)
+        elif kind == "assignment":
+            if not await consultation_scheduler.assignment_expired(target_id):
+                return
+        elif kind == "consultation":
+            for call in active_calls.values():
+                if call.consultation_id == target_id:
+                    active_calls.remove(call.call_id)
+                    self.wheel.cancel(f"call:{call.call_id}")
+                    await end_call_state(call, "max_duration")
+            provider_presence.release(target_id)
+            self.abandoned[target_id] = "in_progress"
+        self.expired[kind] += 1
+        log_event("state_expired", "Expired stale state", level=logging.WARNING, kind=kind, target_id=target_id)
+
+    async def flush(self):
+        if not self.abandoned:
+            return
+        abandoned, self.abandoned = self.abandoned, {}
+        # Only from the status seen at expiry, so a consultation started in
+        # the meantime is left alone
+        modified = 0
+        try:
+            for status in ("waiting", "in_progress"):
+                consultation_ids = [key for key, value in abandoned.items() if value == status]
+                if consultation_ids:
+                    result = await db.consultations.update_many(
+                        {"id": {"$in": consultation_ids}, "status": status},
+                        {"$set": {"status": "abandoned", "ended_at": datetime.utcnow()}}
+                    )
+                    modified += result.modified_count
+                    for consultation_id in consultation_ids:
+                        del abandoned[consultation_id]
+        finally:
+            # Retried next tick (or at shutdown); the status filter makes that safe
+            for consultation_id, status in abandoned.items():
+                self.abandoned.setdefault(consultation_id, status)
+            if modified:
+                bump_version("consultations")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            try:
+                for _, (kind, target_id) in self.wheel.advance():
+                    await self.expire(kind, target_id)
+                await self.flush()
+            except Exception:
+                logger.exception("State expiry pass failed")
+
+    async def start(self):
+        await self.load()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "timers": len(self.wheel),
+            "active_calls": len(active_calls),
+            "waiting_room": len(waiting_room),
+            "expired": dict(self.expired),
+            "pending_abandoned": len(self.abandoned),
+        }
+
+state_reaper = StateReaper(
+    call_setup_timeout=float(os.environ.get("CALL_SETUP_TIMEOUT_S", "60")),
+    waiting_timeout=float(os.environ.get("WAITING_ROOM_TIMEOUT_S", "14400")),
+    waiting_grace=float(os.environ.get("WAITING_ROOM_GRACE_S", "120")),
+    assignment_timeout=float(os.environ.get("ASSIGNMENT_ACCEPT_TIMEOUT_S", "120")),
+    consultation_timeout=float(os.environ.get("CONSULTATION_TIMEOUT_S", "10800")),
+)
+
+async def end_call_state(call: CallRecord, reason: str):
+    """Notify both peers and release resources held by a call already removed from active_calls"""
+    for peer_sid in (call.patient_socket, call.provider_socket):
+        await sio.emit("call_ended", {"call_id": call.call_id, "reason": reason}, room=peer_sid)
+    if call.provider_id:
+        provider_presence.call_ended(call.provider_id)
+    signaling_relay.forget_call(call.call_id)
 
 # Socket.IO Events for WebRTC
 @sio.event
+@socket_captured
 async def connect(sid, environ):
-    print(f"Client {sid} connected")
+    socket_stats["connected"] += 1
+    socket_stats["peak"] = max(socket_stats["peak"], socket_stats["connected"])
+    log_event("connect", "Socket client connected", sid=sid)
 
 @sio.event
+@socket_captured
 async def disconnect(sid):
-    print(f"Client {sid} disconnected")
-    # Clean up any active calls
-    for call_id, call_data in list(active_calls.items()):
-        if call_data.get("patient_socket") == sid or call_data.get("provider_socket") == sid:
-            # Notify other party of disconnection
-            other_sid = call_data.get("provider_socket") if call_data.get("patient_socket") == sid else call_data.get("patient_socket")
-            if other_sid:
-                await sio.emit("call_ended", {"reason": "peer_disconnected"}, room=other_sid)
-            del active_calls[call_id]
+    socket_stats["connected"] -= 1
+    log_event("disconnect", "Socket client disconnected", sid=sid)
+    signaling_relay.forget_sid(sid)
+    offline_provider_id = provider_presence.disconnect(sid)
+    if offline_provider_id:
+        await sio.emit("provider_offline", {"provider_id": offline_provider_id})
+    # Clean up any active calls and notify the other party
+    for call in active_calls.for_socket(sid):
+        call_id_var.set(call.call_id)
+        active_calls.remove(call.call_id)
+        state_reaper.call_ended(call.call_id)
+        await end_call_state(call, "peer_disconnected")
+    # Waiting patients get a grace period to reconnect before they lose their place
+    for consultation_id in waiting_room.for_socket(sid):
+        state_reaper.patient_disconnected(consultation_id)
+
+@sio.event
+@socket_captured
+@socket_rate_limited
+async def signaling_capabilities(sid, data):
+    """Client opts in to batched ICE candidates and deflated SDP"""
+    signaling_relay.set_capabilities(sid, data or {})
 
 @sio.event
+@socket_captured
+@socket_rate_limited
 async def join_waiting_room(sid, data):
     """Patient joins waiting room"""
     consultation_id = data.get("consultation_id")
     triage_data = data.get("triage_data", {})
     
-    waiting_room[consultation_id] = {
-        "socket_id": sid,
-        "triage_data": triage_data,
-        "joined_at": datetime.utcnow()
-    }
-    
+    if consultation_id:
+        waiting_room.add(WaitingEntry(consultation_id, sid, triage_data))
+        state_reaper.patient_waiting(consultation_id)
+        consultation_scheduler.patient_arrived()
+        await sio.enter_room(sid, f"consultation:{consultation_id}")
     await sio.emit("waiting_room_joined", {"consultation_id": consultation_id}, room=sid)
     
     # Notify providers of new patient in queue
-    await sio.emit("queue_updated", {"action": "patient_joined", "consultation_id": consultation_id})
+    await sio.emit("queue_updated", {"action": "patient_joined", "consultation_id": consultation_id},
+                   room=PROVIDERS_ROOM)
 
 @sio.event
+@socket_captured
+@socket_rate_limited
 async def provider_ready(sid, data):
     """Provider indicates they're ready to take calls"""
     provider_id = data.get("provider_id")
+    if provider_id:
+        provider_presence.connect(provider_id, sid)
+        await sio.enter_room(sid, PROVIDERS_ROOM)
     await sio.emit("provider_online", {"provider_id": provider_id})
 
 @sio.event
+@socket_captured
+@socket_rate_limited
+async def provider_heartbeat(sid, data):
+    """Provider keep-alive; providers without one are marked offline"""
+    provider_presence.heartbeat(sid)
+
+@sio.event
+@socket_captured
+@socket_rate_limited
 async def start_call(sid, data):
     """Initiate video call between patient and provider"""
     consultation_id = data.get("consultation_id")
@@ -532,16 +4023,17 @@ async def start_call(sid, data):
     call_id = str(uuid.uuid4())
     
     if caller_type == "provider":
-        # Provider starting call with patient
+        # Provider starting call with patient. The call screen opens its own
+        # socket without provider_ready, so the consultation names the provider
+        consultation = await db.consultations.find_one({"id": consultation_id}, {"_id": 0, "provider_id": 1})
         patient_data = waiting_room.get(consultation_id)
         if patient_data:
-            patient_sid = patient_data["socket_id"]
-            active_calls[call_id] = {
-                "patient_socket": patient_sid,
-                "provider_socket": sid,
-                "consultation_id": consultation_id,
-                "status": "connecting"
-            }
+            patient_sid = patient_data.socket_id
+            provider_id = (consultation or {}).get("provider_id") or provider_presence.provider_for_sid(sid)
+            active_calls.add(CallRecord(call_id, consultation_id, patient_sid, sid, provider_id))
+            if provider_id:
+                provider_presence.assign(consultation_id, provider_id)
+            state_reaper.call_started(call_id)
             
             # Notify patient of incoming call
             await sio.emit("incoming_call", {
@@ -551,97 +4043,222 @@ async def start_call(sid, data):
             }, room=patient_sid)
             
             # Remove from waiting room
-            del waiting_room[consultation_id]
+            waiting_room.remove(consultation_id)
+            consultation_scheduler.remove(consultation_id)
+            state_reaper.patient_left(consultation_id)
+            call_id_var.set(call_id)
+            log_event("start_call", "Call initiated", consultation_id=consultation_id)
+            return {"call_id": call_id, "consultation_id": consultation_id}
 
 @sio.event
+@socket_captured
+@socket_rate_limited
 async def accept_call(sid, data):
     """Accept incoming video call"""
     call_id = data.get("call_id")
-    if call_id in active_calls:
-        active_calls[call_id]["status"] = "active"
+    call = active_calls.get(call_id)
+    if call is not None and active_calls.peer(call_id, sid):
+        call.status = "active"
+        state_reaper.call_accepted(call_id, call.consultation_id)
         
         # Notify both parties
-        await sio.emit("call_accepted", {"call_id": call_id}, room=active_calls[call_id]["patient_socket"])
-        await sio.emit("call_accepted", {"call_id": call_id}, room=active_calls[call_id]["provider_socket"])
+        await sio.emit("call_accepted", {"call_id": call_id}, room=call.patient_socket)
+        await sio.emit("call_accepted", {"call_id": call_id}, room=call.provider_socket)
 
 @sio.event
+@socket_captured
+@socket_rate_limited
 async def webrtc_offer(sid, data):
     """Forward WebRTC offer"""
     call_id = data.get("call_id")
-    offer = data.get("offer")
+    offer = signaling_relay.decode_description(data.get("offer"))
     
-    if call_id in active_calls:
-        call_data = active_calls[call_id]
-        target_sid = call_data["provider_socket"] if call_data["patient_socket"] == sid else call_data["patient_socket"]
-        
+    target_sid = active_calls.peer(call_id, sid)
+    if target_sid and offer is not None:
         await sio.emit("webrtc_offer", {
             "call_id": call_id,
-            "offer": offer,
+            "offer": signaling_relay.encode_description(offer, target_sid),
             "from": sid
         }, room=target_sid)
 
 @sio.event
+@socket_captured
+@socket_rate_limited
 async def webrtc_answer(sid, data):
     """Forward WebRTC answer"""
     call_id = data.get("call_id")
-    answer = data.get("answer")
+    answer = signaling_relay.decode_description(data.get("answer"))
     
-    if call_id in active_calls:
-        call_data = active_calls[call_id]
-        target_sid = call_data["provider_socket"] if call_data["patient_socket"] == sid else call_data["patient_socket"]
-        
+    target_sid = active_calls.peer(call_id, sid)
+    if target_sid and answer is not None:
         await sio.emit("webrtc_answer", {
             "call_id": call_id,
-            "answer": answer,
+            "answer": signaling_relay.encode_description(answer, target_sid),
             "from": sid
         }, room=target_sid)
 
 @sio.event
+@socket_captured
+@socket_rate_limited
 async def webrtc_ice_candidate(sid, data):
     """Forward ICE candidates"""
     call_id = data.get("call_id")
     candidate = data.get("candidate")
+    call_id_var.set(call_id)
+    log_event("webrtc_ice_candidate", "Relaying ICE candidate", sid=sid)
     
-    if call_id in active_calls:
-        call_data = active_calls[call_id]
-        target_sid = call_data["provider_socket"] if call_data["patient_socket"] == sid else call_data["patient_socket"]
-        
-        await sio.emit("webrtc_ice_candidate", {
-            "call_id": call_id,
-            "candidate": candidate,
-            "from": sid
-        }, room=target_sid)
+    target_sid = active_calls.peer(call_id, sid)
+    if target_sid:
+        await signaling_relay.relay_candidates(call_id, sid, target_sid, [candidate])
+
+@sio.event
+@socket_captured
+@socket_rate_limited
+async def webrtc_ice_candidates(sid, data):
+    """Forward a batch of ICE candidates"""
+    call_id = data.get("call_id")
+    candidates = data.get("candidates")
+    call_id_var.set(call_id)
+    
+    target_sid = active_calls.peer(call_id, sid)
+    if target_sid and isinstance(candidates, list):
+        await signaling_relay.relay_candidates(call_id, sid, target_sid, candidates[:signaling_relay.max_batch * 4])
 
 @sio.event
+@socket_captured
 async def end_call(sid, data):
     """End video call"""
     call_id = data.get("call_id")
     
-    if call_id in active_calls:
-        call_data = active_calls[call_id]
-        
-        # Notify both parties
-        await sio.emit("call_ended", {"call_id": call_id}, room=call_data["patient_socket"])
-        await sio.emit("call_ended", {"call_id": call_id}, room=call_data["provider_socket"])
-        
-        # Clean up
-        del active_calls[call_id]
+    if active_calls.peer(call_id, sid):
+        # Notify both parties and clean up
+        call = active_calls.remove(call_id)
+        state_reaper.call_ended(call_id)
+        await end_call_state(call, "ended")
+        call_id_var.set(call_id)
+        log_event("end_call", "Call ended", sid=sid)
+
+async def ensure_indexes():
+    """Create the indexes the write paths rely on for uniqueness"""
+    indexes = [
+        (db.patients, [("email", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"email": {"$type": "string"}}
+        }),
+        # Not unique: family members with their own emails may share a phone
+        (db.patients, [("phone", 1)], {"partialFilterExpression": {"phone": {"$type": "string"}}}),
+        (db.consultations, [("idempotency_key", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"idempotency_key": {"$type": "string"}}
+        }),
+        (db.consultations, [("status", 1), ("created_at", 1)], {}),
+        (db.triage_sessions, [("id", 1)], {"unique": True}),
+        (db.triage_sessions, [("updated_at", 1)], {}),
+        (db.chat_messages, [("session_id", 1), ("timestamp", -1)], {}),
+        (archive_of("triage_sessions"), [("id", 1)], {}),
+        (archive_of("consultations"), [("id", 1)], {}),
+        (archive_of("chat_messages"), [("session_id", 1), ("timestamp", -1)], {}),
+        (db[MongoTokenBuckets.collection_name], [("expires_at", 1)], {"expireAfterSeconds": 3600}),
+        (db.llm_usage_daily, [("day", 1), ("endpoint", 1), ("model", 1)], {"unique": True}),
+        (db.llm_usage_sessions, [("session_id", 1)], {"unique": True}),
+    ]
+    # Patients without an email are stored with email null, which the old
+    # full unique index on email would reject after the first one
+    try:
+        email_index = (await db.patients.index_information()).get("email_1")
+        if email_index and "partialFilterExpression" not in email_index:
+            await db.patients.drop_index("email_1")
+    except Exception:
+        logger.exception("Could not migrate the patients email index")
+    for collection, keys, options in indexes:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception:
+            # Pre-existing duplicates block a unique index; the upserts still
+            # dedupe new writes, so keep serving and leave cleanup to an operator
+            logger.exception("Could not create index %s on %s", keys, collection.name)
 
-# Include the router in the main app
-app.include_router(api_router)
+async def warm_mongo():
+    await mongo.warm()
+    await ensure_indexes()
 
-# Mount Socket.IO
-app.mount("/socket.io", socket_app)
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """Warm dependencies concurrently, run background tasks, then tear down"""
+    started = time.perf_counter()
+    log_listener.start()
+    if loop_profiler is not None:
+        loop_profiler.start()
+    if traffic_capture is not None:
+        traffic_capture.start()
+    # Mongo and the LLM connection warm up in parallel; the in-memory indexes
+    # only need Mongo, so they load alongside the LLM warm-up. Steps that fail
+    # are retried in the background rather than aborting startup
+    await startup_steps.run({
+        "mongo": warm_mongo,
+        "openai": warm_openai,
+        "provider_presence": provider_presence.start,
+        "consultation_scheduler": consultation_scheduler.start,
+        "wait_time_estimator": wait_time_estimator.load,
+        "triage_classifier": load_triage_classifier,
+        "state_reaper": state_reaper.start,
+    })
+    if archiver is not None:
+        archiver.start()
+    llm_usage.start()
+    if triage_cache is not None:
+        triage_cache.start()
+    if change_feed is not None:
+        change_feed.start()
+    log_event("startup", "Application started", startup_ms=round((time.perf_counter() - started) * 1000, 1))
+    try:
+        yield
+    finally:
+        await startup_steps.stop()
+        if loop_profiler is not None:
+            await loop_profiler.stop()
+        await consultation_scheduler.stop()
+        await state_reaper.stop()
+        if archiver is not None:
+            await archiver.stop()
+        await provider_presence.stop()
+        await llm_usage.stop()
+        if triage_cache is not None:
+            await triage_cache.stop()
+        if change_feed is not None:
+            await change_feed.stop()
+        mongo.close()
+        if traffic_capture is not None:
+            traffic_capture.stop()
+        log_listener.stop()
 
+def create_app() -> FastAPI:
+    """Build the ASGI app; resources are acquired in the lifespan, not here"""
+    # Create the main app without a prefix
+    application = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
+    # Innermost, so captured timings and bodies are the handler's, before compression
+    if traffic_capture is not None or LLM_MODE == "fake":
+        application.middleware("http")(traffic_capture_middleware)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=False,  # Must be False when using wildcard origins
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["ETag", "X-Request-ID"],
+    )
+
+    add_compression(application)
+
+    application.middleware("http")(correlation_id_middleware)
+
+    # Include the router in the main app
+    application.include_router(api_router)
+
+    # Mount Socket.IO
+    application.mount("/socket.io", socketio.ASGIApp(socketio_server=sio, other_asgi_app=application))
+    return application
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+app = create_app()
\ No newline at end of file
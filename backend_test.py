@@ -76,6 +76,29 @@ class TriageSystemTester:
             self.log_error("Basic Connectivity", f"Connection failed: {str(e)}")
         return False
 
+    def test_health_endpoints(self):
+        """Test liveness and readiness probes"""
+        print("\n🔍 Testing Health Endpoints...")
+        try:
+            response = requests.get(f"{API_BASE}/health/live", timeout=10)
+            if response.status_code != 200 or response.json().get("status") != "alive":
+                self.log_error("Liveness", f"HTTP {response.status_code}: {response.text}")
+                return False
+            self.log_success("Liveness", "Process reports alive")
+
+            response = requests.get(f"{API_BASE}/health/ready", timeout=10)
+            data = response.json()
+            if response.status_code in [200, 503] and "checks" in data:
+                if all(check in data["checks"] for check in ["mongo", "event_loop", "sockets", "llm"]):
+                    self.log_success("Readiness", f"Status {data['status']}, Mongo {data['checks']['mongo']}")
+                    return True
+                self.log_error("Readiness", f"Missing checks: {data['checks']}")
+            else:
+                self.log_error("Readiness", f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_error("Health Endpoints", f"Request failed: {str(e)}")
+        return False
+
     def test_triage_start_endpoint(self):
         """Test POST /api/triage/start endpoint"""
         print("\n🔍 Testing Triage Start Endpoint...")
@@ -196,6 +219,34 @@ class TriageSystemTester:
             self.log_error("Routine Scenario", f"Request failed: {str(e)}")
         return False
 
+    def test_batch_triage(self):
+        """Test POST /api/triage/batch streams one result per item"""
+        print("\n🔍 Testing Batch Triage Endpoint...")
+        items = [
+            {"location": "chest", "symptoms": ["Chest pain"], "severity": 9, "duration": "Less than 1 hour",
+             "associated_symptoms": ["Shortness of breath"], "medical_history": [], "age": 58},
+            {"location": "head", "symptoms": ["Dull ache"], "severity": 3, "duration": "1-3 days",
+             "associated_symptoms": ["Fatigue"], "medical_history": [], "age": 25},
+        ]
+        try:
+            response = requests.post(f"{API_BASE}/triage/batch", json={"items": items}, stream=True, timeout=60)
+            if response.status_code != 200:
+                self.log_error("Batch Triage", f"HTTP {response.status_code}: {response.text}")
+                return False
+            results = [json.loads(line) for line in response.iter_lines() if line]
+            if sorted(result["index"] for result in results) != [0, 1]:
+                self.log_error("Batch Triage", f"Expected one result per item, got {results}")
+                return False
+            emergency = next(result for result in results if result["index"] == 0)
+            if emergency.get("urgency_level") != "Emergency" or emergency.get("source") != "rules":
+                self.log_error("Batch Triage", f"Chest pain not fast-pathed as Emergency: {emergency}")
+                return False
+            self.log_success("Batch Triage", f"Sources: {[result.get('source') for result in results]}")
+            return True
+        except Exception as e:
+            self.log_error("Batch Triage", f"Request failed: {str(e)}")
+        return False
+
     def test_chat_endpoint(self):
         """Test POST /api/triage/chat/{session_id} endpoint"""
         print("\n🔍 Testing AI Chat Endpoint...")
@@ -245,6 +296,11 @@ class TriageSystemTester:
                     if session.get("id") == self.session_id:
                         self.log_success("Session Retrieval", "Session data retrieved correctly")
                         self.test_results["mongodb_operations"] = True
+                        history = requests.get(f"{API_BASE}/triage/session/{self.session_id}/messages", timeout=10)
+                        if history.status_code == 200 and "messages" in history.json():
+                            self.log_success("Chat History Paging", f"{len(history.json()['messages'])} messages in first page")
+                        else:
+                            self.log_error("Chat History Paging", f"HTTP {history.status_code}: {history.text}")
                         return True
                     else:
                         self.log_error("Session Retrieval", f"Session ID mismatch: {session.get('id')} vs {self.session_id}")
@@ -505,6 +561,9 @@ class TriageSystemTester:
             print("\n❌ CRITICAL: Basic connectivity failed. Cannot proceed with other tests.")
             return False
 
+        # Test health probes
+        self.test_health_endpoints()
+
         # Test triage start endpoint
         if not self.test_triage_start_endpoint():
             print("\n❌ CRITICAL: Cannot create triage sessions. Skipping dependent tests.")
@@ -513,6 +572,7 @@ class TriageSystemTester:
         # Test symptom analysis scenarios
         emergency_success = self.test_emergency_symptom_scenario()
         routine_success = self.test_routine_symptom_scenario()
+        self.test_batch_triage()
 
         # Test other triage endpoints
         chat_success = self.test_chat_endpoint()
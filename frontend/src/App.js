@@ -341,6 +341,18 @@ const LandingPage = ({ onLogin }) => {
   );
 };
 
+// Signaling helpers: the server sends large SDP deflated when we advertise support
+const SUPPORTS_DEFLATE = typeof DecompressionStream !== 'undefined';
+
+const inflateDescription = async (description) => {
+  if (!description || !description.sdp_deflate) {
+    return description;
+  }
+  const stream = new Blob([description.sdp_deflate]).stream().pipeThrough(new DecompressionStream('deflate'));
+  const { sdp_deflate, ...rest } = description;
+  return { ...rest, sdp: await new Response(stream).text() };
+};
+
 // Video Call Component
 const VideoCall = ({ consultationId, userType, onEndCall, user }) => {
   const [socket, setSocket] = useState(null);
@@ -380,6 +392,10 @@ const VideoCall = ({ consultationId, userType, onEndCall, user }) => {
     // Socket event listeners with enhanced logging
     socketConnection.on('connect', () => {
       console.log('Socket connected successfully');
+      socketConnection.emit('signaling_capabilities', {
+        ice_batch: true,
+        sdp_encodings: SUPPORTS_DEFLATE ? ['deflate'] : []
+      });
     });
 
     socketConnection.on('disconnect', () => {
@@ -401,17 +417,19 @@ const VideoCall = ({ consultationId, userType, onEndCall, user }) => {
       initializePeerConnection(data.call_id, userType === 'provider');
     });
 
-    socketConnection.on('webrtc_offer', (data) => {
+    socketConnection.on('webrtc_offer', async (data) => {
       console.log('WebRTC offer received:', data);
+      const offer = await inflateDescription(data.offer);
       if (peer) {
-        peer.signal(data.offer);
+        peer.signal(offer);
       }
     });
 
-    socketConnection.on('webrtc_answer', (data) => {
+    socketConnection.on('webrtc_answer', async (data) => {
       console.log('WebRTC answer received:', data);
+      const answer = await inflateDescription(data.answer);
       if (peer) {
-        peer.signal(data.answer);
+        peer.signal(answer);
       }
     });
 
@@ -422,6 +440,13 @@ const VideoCall = ({ consultationId, userType, onEndCall, user }) => {
       }
     });
 
+    socketConnection.on('webrtc_ice_candidates', (data) => {
+      console.log('ICE candidate batch received:', data.candidates.length);
+      if (peer) {
+        data.candidates.forEach(candidate => peer.signal(candidate));
+      }
+    });
+
     socketConnection.on('call_ended', () => {
       console.log('Call ended');
       setCallStatus('ended');
@@ -663,27 +688,95 @@ const VideoCall = ({ consultationId, userType, onEndCall, user }) => {
   );
 };
 
+// Well inside the server's 60s presence timeout
+const PROVIDER_HEARTBEAT_MS = 20000;
+// Consultation statuses shown in the queue
+const QUEUED_STATUSES = ['waiting', 'in_progress'];
+
 // Provider Dashboard Component
 const ProviderDashboard = ({ user }) => {
   const [queue, setQueue] = useState([]);
   const [activeConsultation, setActiveConsultation] = useState(null);
+  const [assignment, setAssignment] = useState(null);
+  const [availableProviders, setAvailableProviders] = useState({});
   const [socket, setSocket] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
 
   useEffect(() => {
     fetchQueue();
+    fetchAvailableProviders();
     
     const socketConnection = io(BACKEND_URL);
     setSocket(socketConnection);
     
-    socketConnection.emit('provider_ready', { provider_id: user.id });
-    
+    // Announce on every (re)connect; the server forgets the socket on disconnect
+    socketConnection.on('connect', () => {
+      socketConnection.emit('provider_ready', { provider_id: user.id });
+    });
+
+    // The server marks providers offline after PRESENCE_HEARTBEAT_TIMEOUT_S
+    // (60s by default) without a heartbeat
+    const heartbeat = setInterval(() => {
+      if (socketConnection.connected) {
+        socketConnection.emit('provider_heartbeat', {});
+      }
+    }, PROVIDER_HEARTBEAT_MS);
+
     socketConnection.on('queue_updated', () => {
       console.log('Queue updated, refetching...');
       fetchQueue();
     });
 
-    return () => socketConnection.disconnect();
+    // Change-feed events patch the queue in place; only new consultations
+    // need a refetch for the patient and triage details
+    socketConnection.on('consultation_changed', (change) => {
+      if (change.operation === 'insert') {
+        fetchQueue();
+        return;
+      }
+      setQueue((current) => current
+        .filter((item) => item.consultation_id !== change.id || QUEUED_STATUSES.includes(change.status))
+        .map((item) => item.consultation_id === change.id
+          ? { ...item, status: change.status, urgency_level: change.urgency_level || item.urgency_level }
+          : item));
+    });
+
+    socketConnection.on('triage_changed', (change) => {
+      setQueue((current) => current.map((item) => item.triage_session_id === change.id
+        ? { ...item, urgency_level: change.urgency_level }
+        : item));
+    });
+
+    socketConnection.on('provider_changed', (change) => {
+      setAvailableProviders((current) => {
+        const next = { ...current };
+        if (change.status === 'available') {
+          next[change.id] = change.name;
+        } else {
+          delete next[change.id];
+        }
+        return next;
+      });
+    });
+
+    // The scheduler holds an auto-assigned patient for us until we accept
+    // or the server's acceptance timeout hands them to someone else
+    socketConnection.on('consultation_assigned', (data) => {
+      console.log('Consultation assigned:', data);
+      setAssignment(data);
+    });
+
+    socketConnection.on('assignment_expired', (data) => {
+      setAssignment((current) =>
+        current && current.consultation_id === data.consultation_id ? null : current
+      );
+      fetchQueue();
+    });
+
+    return () => {
+      clearInterval(heartbeat);
+      socketConnection.disconnect();
+    };
   }, [user.id]);
 
   const fetchQueue = async () => {
@@ -699,6 +792,15 @@ const ProviderDashboard = ({ user }) => {
     }
   };
 
+  const fetchAvailableProviders = async () => {
+    try {
+      const response = await axios.get(`${API}/providers/available`);
+      setAvailableProviders(Object.fromEntries(response.data.map((provider) => [provider.id, provider.name])));
+    } catch (error) {
+      console.error('Error fetching available providers:', error);
+    }
+  };
+
   const startConsultation = async (consultationId) => {
     try {
       console.log('Starting consultation:', consultationId);
@@ -706,6 +808,7 @@ const ProviderDashboard = ({ user }) => {
         params: { provider_id: user.id }
       });
       console.log('Consultation started:', response.data);
+      setAssignment(null);
       setActiveConsultation(consultationId);
     } catch (error) {
       console.error('Error starting consultation:', error);
@@ -745,10 +848,32 @@ const ProviderDashboard = ({ user }) => {
           <h1 className="text-3xl font-bold text-gray-900 mb-2">Provider Dashboard</h1>
           <p className="text-gray-600">Dr. {user.name} - {user.specialization}</p>
         </div>
+
+        {assignment && (
+          <div className="bg-blue-50 border border-blue-200 rounded-2xl p-6 mb-6 flex justify-between items-center">
+            <div>
+              <h2 className="text-lg font-semibold text-gray-900">A patient has been assigned to you</h2>
+              <p className="text-gray-600">
+                Urgency: {assignment.urgency_level} · ID: {assignment.consultation_id.slice(-8)}
+              </p>
+            </div>
+            <button
+              onClick={() => startConsultation(assignment.consultation_id)}
+              className="bg-green-600 hover:bg-green-700 text-white px-4 py-2 rounded-lg"
+            >
+              Accept
+            </button>
+          </div>
+        )}
         
         <div className="bg-white rounded-2xl shadow-xl p-6">
           <div className="flex justify-between items-center mb-6">
-            <h2 className="text-xl font-semibold">Patient Queue</h2>
+            <div>
+              <h2 className="text-xl font-semibold">Patient Queue</h2>
+              <p className="text-sm text-gray-500">
+                {Object.keys(availableProviders).length} provider(s) available
+              </p>
+            </div>
             <button
               onClick={fetchQueue}
               className="bg-blue-600 hover:bg-blue-700 text-white px-4 py-2 rounded-lg flex items-center space-x-2"
@@ -845,14 +970,35 @@ const WaitingRoom = ({ consultationId, triageData, user }) => {
   const [estimatedWait, setEstimatedWait] = useState('5-10 minutes');
   const [socket, setSocket] = useState(null);
   const [callStarted, setCallStarted] = useState(false);
+  const [assignedProvider, setAssignedProvider] = useState(null);
+  const [closedStatus, setClosedStatus] = useState(null);
 
   useEffect(() => {
     const socketConnection = io(BACKEND_URL);
     setSocket(socketConnection);
     
-    socketConnection.emit('join_waiting_room', {
-      consultation_id: consultationId,
-      triage_data: triageData
+    // Rejoin on every (re)connect; after a network blip the server only
+    // holds our place for a short grace period
+    socketConnection.on('connect', () => {
+      socketConnection.emit('join_waiting_room', {
+        consultation_id: consultationId,
+        triage_data: triageData
+      });
+    });
+
+    socketConnection.on('consultation_assigned', (data) => {
+      setAssignedProvider(data.provider_name);
+    });
+
+    socketConnection.on('assignment_expired', () => {
+      setAssignedProvider(null);
+    });
+
+    // Pushed from the change feed for this consultation's room
+    socketConnection.on('consultation_status', (change) => {
+      if (['completed', 'cancelled', 'abandoned'].includes(change.status)) {
+        setClosedStatus(change.status);
+      }
     });
 
     socketConnection.on('incoming_call', () => {
@@ -887,7 +1033,14 @@ const WaitingRoom = ({ consultationId, triageData, user }) => {
             
             <h1 className="text-3xl font-bold text-gray-900 mb-4">You're in the Waiting Room</h1>
             <p className="text-xl text-gray-600 mb-2">Hello {user.name},</p>
-            <p className="text-lg text-gray-600 mb-8">A healthcare provider will be with you shortly</p>
+            {closedStatus && (
+              <div className="bg-yellow-50 border border-yellow-200 rounded-lg p-4 mb-6 text-yellow-800">
+                This consultation was {closedStatus}. Please start a new assessment if you still need care.
+              </div>
+            )}
+            <p className="text-lg text-gray-600 mb-8">
+              {assignedProvider ? `Dr. ${assignedProvider} will be with you shortly` : 'A healthcare provider will be with you shortly'}
+            </p>
             
             <div className="bg-blue-50 rounded-lg p-6 mb-8">
               <h3 className="font-semibold text-gray-900 mb-2">Estimated Wait Time</h3>
@@ -0,0 +1,52 @@
+"""Shared helpers for the backend tests
+
+Tests import the backend modules in-process: importing server has no side
+effects beyond building module-level objects. Benchmarks that need a fresh
+interpreter (import time, memory) run a probe script through the probe
+fixture.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+SERVER_DEPENDENCIES = ("fastapi", "motor", "socketio", "dotenv", "numpy")
+# Configuration the tests must not depend on or leak into a fresh interpreter
+STRIPPED_ENV = ("MONGO_URL", "DB_NAME", "OPENAI_API_KEY")
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def require_server_dependencies():
+    for module in SERVER_DEPENDENCIES:
+        pytest.importorskip(module)
+
+
+@pytest.fixture(scope="session")
+def server():
+    require_server_dependencies()
+    import server as server_module
+    return server_module
+
+
+def run_probe(source: str, *args: str, timeout: float = 60) -> dict:
+    """Run a probe in a fresh interpreter in backend/; returns the JSON it prints last"""
+    env = {key: value for key, value in os.environ.items() if key not in STRIPPED_ENV}
+    result = subprocess.run(
+        [sys.executable, "-c", source, *args],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=timeout
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.fixture
+def probe():
+    require_server_dependencies()
+    return run_probe
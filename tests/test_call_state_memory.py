@@ -0,0 +1,64 @@
+"""Memory benchmark for live call state
+
+Builds CALL_STATE_BENCH_CALLS concurrent calls (10k by default) in the
+server's CallRegistry and reports bytes per call, next to the free-form dict
+records the registry replaced. The registry figure includes its peer and
+per-socket indexes and must stay within CALL_STATE_BYTES_BUDGET.
+"""
+
+import os
+
+CALLS = int(os.environ.get("CALL_STATE_BENCH_CALLS", "10000"))
+CALL_STATE_BYTES_BUDGET = int(os.environ.get("CALL_STATE_BYTES_BUDGET", "640"))
+
+PROBE = """
+import json, sys, tracemalloc, uuid
+from server import CallRecord, CallRegistry
+
+calls = int(sys.argv[1])
+ids = [(str(uuid.uuid4()), str(uuid.uuid4()), uuid.uuid4().hex[:20], uuid.uuid4().hex[:20], str(uuid.uuid4()))
+       for _ in range(calls)]
+
+def measure(build):
+    tracemalloc.start()
+    state = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return state, size / calls
+
+def slotted_records():
+    return [CallRecord(call_id, consultation_id, patient, provider, provider_id)
+            for call_id, consultation_id, patient, provider, provider_id in ids]
+
+def dict_records():
+    return [{"patient_socket": patient, "provider_socket": provider, "provider_id": provider_id,
+             "consultation_id": consultation_id, "status": "connecting"}
+            for call_id, consultation_id, patient, provider, provider_id in ids]
+
+def registry():
+    registry = CallRegistry()
+    for call_id, consultation_id, patient, provider, provider_id in ids:
+        registry.add(CallRecord(call_id, consultation_id, patient, provider, provider_id))
+    return registry
+
+_, slotted = measure(slotted_records)
+_, legacy = measure(dict_records)
+state, indexed = measure(registry)
+call_id, _, patient, provider, _ = ids[-1]
+print(json.dumps({
+    "slotted_record_bytes": slotted,
+    "dict_record_bytes": legacy,
+    "registry_bytes": indexed,
+    "peer_ok": state.peer(call_id, patient) == provider and state.peer(call_id, "stranger") is None,
+}))
+"""
+
+
+def test_bytes_per_call_at_10k_calls(probe):
+    report = probe(PROBE, str(CALLS), timeout=120)
+    print(f"\n{CALLS} calls: record {report['slotted_record_bytes']:.0f} B slotted vs "
+          f"{report['dict_record_bytes']:.0f} B dict; registry with indexes {report['registry_bytes']:.0f} B/call")
+
+    assert report["peer_ok"]
+    assert report["slotted_record_bytes"] < report["dict_record_bytes"]
+    assert report["registry_bytes"] < CALL_STATE_BYTES_BUDGET
@@ -0,0 +1,40 @@
+"""Parquet support in the bulk export/import CLI is optional
+
+Without pyarrow, `export --format parquet` and an import of Parquet files
+must exit with status 1 and an install hint, before touching Mongo,
+rather than fail with an ImportError traceback.
+"""
+
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def run_cli(monkeypatch):
+    for module in ("typer", "motor", "dotenv", "bson"):
+        pytest.importorskip(module)
+    from typer.testing import CliRunner
+    import cli
+
+    # A None entry in sys.modules makes `import pyarrow` raise ImportError
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    for key in ("MONGO_URL", "DB_NAME"):
+        monkeypatch.delenv(key, raising=False)
+    runner = CliRunner()
+    return lambda *args: runner.invoke(cli.app, list(args))
+
+
+def test_export_parquet_without_pyarrow(run_cli, tmp_path):
+    result = run_cli("export", str(tmp_path), "--format", "parquet")
+    assert result.exit_code == 1
+    assert "pip install pyarrow" in result.output
+    assert not isinstance(result.exception, ImportError)
+
+
+def test_import_parquet_without_pyarrow(run_cli, tmp_path):
+    (tmp_path / "consultations.part-00001.parquet").write_bytes(b"")
+    result = run_cli("import", str(tmp_path), "--collection", "consultations")
+    assert result.exit_code == 1
+    assert "pip install pyarrow" in result.output
+    assert not isinstance(result.exception, ImportError)
@@ -0,0 +1,33 @@
+"""Import-time budget for the backend server module
+
+Importing backend/server.py must not need Mongo or OpenAI configuration,
+must not create the Mongo client or import the OpenAI SDK, and must stay
+within IMPORT_TIME_BUDGET_S seconds.
+"""
+
+import os
+
+IMPORT_TIME_BUDGET_S = float(os.environ.get("IMPORT_TIME_BUDGET_S", "2.0"))
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import server
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "openai_imported": "openai" in sys.modules,
+    "mongo_client_created": server.mongo._client is not None,
+}))
+"""
+
+
+def test_import_is_side_effect_free(probe):
+    report = probe(PROBE)
+    assert not report["openai_imported"]
+    assert not report["mongo_client_created"]
+
+
+def test_import_within_budget(probe):
+    # Best of three so a cold filesystem cache does not fail the build
+    seconds = min(probe(PROBE)["seconds"] for _ in range(3))
+    assert seconds < IMPORT_TIME_BUDGET_S, f"import took {seconds:.2f}s (budget {IMPORT_TIME_BUDGET_S}s)"
@@ -0,0 +1,41 @@
+"""Escalation in the model router under budget downgrades
+
+A low-confidence fast-tier answer normally escalates to the strong model.
+Once a session is over its soft token budget, both tiers resolve to the
+downgrade model, and the router must not pay for the same model twice.
+The LLM call is replaced with a recorder that applies the same budget
+routing as call_openai_chat.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture
+def calls(server, monkeypatch):
+    calls = []
+
+    async def recording_call(session_id, user_message, system_message=None, endpoint="chat", model=None):
+        calls.append(server.llm_usage.choose_model(session_id, model))
+        return json.dumps({"analysis": "", "urgency_level": "Routine", "confidence_score": 0.4,
+                           "recommended_actions": [], "follow_up_questions": []})
+
+    monkeypatch.setattr(server, "call_openai_chat", recording_call)
+    monkeypatch.setattr(server.llm_usage, "session_token_budget", 1000)
+    monkeypatch.setattr(server.llm_usage, "downgrade_model", "fast-model")
+    return calls
+
+
+def test_no_escalation_to_the_same_model_when_downgraded(server, calls, monkeypatch):
+    router = server.ModelRouter(fast_model="fast-model", strong_model="strong-model", min_confidence=0.75)
+
+    asyncio.run(router.complete("within-budget", "symptoms", "system", endpoint="triage"))
+    assert calls == ["fast-model", "strong-model"]
+
+    calls.clear()
+    monkeypatch.setitem(server.llm_usage.session_tokens, "over-budget", 1500)
+    asyncio.run(router.complete("over-budget", "symptoms", "system", endpoint="triage"))
+    assert calls == ["fast-model"]
+    assert router.decisions.get("escalation_skipped_low_confidence") == 1
@@ -0,0 +1,59 @@
+"""Streamed NDJSON responses must not be buffered by compression
+
+Builds a small app with the server's compression middleware and a route
+at the batch triage path that streams lines with a delay between them. It
+requests the route with Accept-Encoding: gzip and checks that the lines
+arrive uncompressed, spread out over time, rather than in a single chunk
+at the end.
+"""
+
+import asyncio
+import json
+import time
+
+
+def test_ndjson_streams_with_gzip_accepted(server):
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+    server.add_compression(app)
+
+    @app.post("/api/triage/batch")
+    async def batch():
+        async def lines():
+            for index in range(4):
+                await asyncio.sleep(0.1)
+                yield json.dumps({"index": index, "padding": "x" * 2048}) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    scope = {"type": "http", "method": "POST", "path": "/api/triage/batch", "raw_path": b"/api/triage/batch",
+             "query_string": b"", "headers": [(b"accept-encoding", b"gzip")], "http_version": "1.1",
+             "scheme": "http", "server": ("test", 80), "client": ("test", 1234), "root_path": ""}
+    arrivals, headers = [], {}
+
+    async def request():
+        started = time.perf_counter()
+        requested = asyncio.Event()
+
+        async def receive():
+            # One request message, then stay connected until the response ends
+            if requested.is_set():
+                await asyncio.Event().wait()
+            requested.set()
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                headers.update({k.decode(): v.decode() for k, v in message["headers"]})
+            elif message.get("body"):
+                arrivals.append(time.perf_counter() - started)
+
+        await app(scope, receive, send)
+
+    asyncio.run(request())
+
+    assert headers.get("content-encoding") is None
+    assert len(arrivals) == 4
+    # The first line must not wait for the last one
+    assert arrivals[-1] - arrivals[0] > 0.2
@@ -0,0 +1,99 @@
+"""Token-bucket rate limiting
+
+MemoryTokenBuckets must allow a burst of capacity requests, refill at the
+configured rate up to capacity, and hint how long until the next token.
+RateLimiter must count rejections and fail open when its store breaks,
+and rejected requests must get a 429 with a whole-second Retry-After.
+The server module's clock is replaced so refill does not depend on timing.
+"""
+
+import asyncio
+
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(server, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server, "time", clock)
+    return clock
+
+
+def acquire(buckets, key="ip:1.2.3.4", capacity=3, rate=0.5):
+    return asyncio.run(buckets.acquire(key, capacity, rate))
+
+
+def test_parse_rate(server):
+    assert server.parse_rate("30/60") == (30.0, 0.5)
+    assert server.parse_rate("100/2") == (100.0, 50.0)
+
+
+def test_burst_then_retry_hint(server, clock):
+    buckets = server.MemoryTokenBuckets()
+    assert [acquire(buckets) for _ in range(3)] == [(True, 0.0)] * 3
+    assert acquire(buckets) == (False, 2.0)
+    clock.now += 1.5
+    allowed, retry_after = acquire(buckets)
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_capacity(server, clock):
+    buckets = server.MemoryTokenBuckets()
+    for _ in range(3):
+        acquire(buckets)
+    clock.now += 2
+    assert acquire(buckets) == (True, 0.0)
+    assert acquire(buckets)[0] is False
+    clock.now += 3600
+    assert [acquire(buckets)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_keys_are_independent_and_oldest_are_evicted(server, clock):
+    buckets = server.MemoryTokenBuckets(max_keys=2)
+    acquire(buckets, capacity=1, key="a")
+    assert acquire(buckets, capacity=1, key="a")[0] is False
+    assert acquire(buckets, capacity=1, key="b")[0] is True
+    acquire(buckets, capacity=1, key="c")
+    # "a" was the least recently used; dropping it is the same as a full refill
+    assert list(buckets.buckets) == ["b", "c"]
+    assert acquire(buckets, capacity=1, key="a")[0] is True
+
+
+class BrokenStore:
+    async def acquire(self, key, capacity, rate):
+        raise ConnectionError("mongo unavailable")
+
+
+def test_limiter_counts_rejections_and_fails_open(server, clock):
+    limiter = server.RateLimiter(server.MemoryTokenBuckets(), {"ip": (1, 0.1)})
+    assert asyncio.run(limiter.check("ip", "1.2.3.4")) == (True, 0.0)
+    assert asyncio.run(limiter.check("ip", "1.2.3.4")) == (False, 10.0)
+    assert asyncio.run(limiter.check("unlimited", "1.2.3.4")) == (True, 0.0)
+    assert limiter.rejections == {"ip": 1}
+
+    broken = server.RateLimiter(BrokenStore(), {"ip": (1, 0.1)})
+    assert asyncio.run(broken.check("ip", "1.2.3.4")) == (True, 0.0)
+    assert broken.store_errors == 1
+
+
+@pytest.mark.parametrize("rate,retry_after", [(0.1, "10"), (0.4, "3"), (50, "1")])
+def test_rejection_is_a_429_with_whole_seconds(server, clock, monkeypatch, rate, retry_after):
+    limiter = server.RateLimiter(server.MemoryTokenBuckets(), {"session": (1, rate)})
+    monkeypatch.setattr(server, "rate_limiter", limiter)
+    asyncio.run(server.enforce_rate_limit("session", "s1"))
+    with pytest.raises(server.HTTPException) as rejected:
+        asyncio.run(server.enforce_rate_limit("session", "s1"))
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == retry_after
@@ -0,0 +1,141 @@
+"""Expiry timers behind the state reaper
+
+TimerWheel timers must fire on exactly the tick they were scheduled for,
+whether they sit in level 0, cascade down from higher levels or lie beyond
+the top level's range. Small wheels keep those cases a few ticks apart.
+StateReaper must arm the right deadlines and keep abandoned consultations
+whose status update failed for the next flush.
+"""
+
+import asyncio
+import random
+
+import pytest
+
+
+def advance_to(wheel, tick):
+    """Advance to the middle of a tick, clear of float rounding at its edges"""
+    return wheel.advance(wheel.origin + (tick + 0.5) * wheel.tick)
+
+
+def fire_ticks(wheel, until):
+    fired = {}
+    for tick in range(wheel.current + 1, until + 1):
+        for key, _ in advance_to(wheel, tick):
+            fired[key] = tick
+    return fired
+
+
+def test_fires_on_its_tick(server):
+    wheel = server.TimerWheel(tick=1.0)
+    wheel.schedule("call:a", 3, ("call_setup", "a"))
+    assert advance_to(wheel, 2) == []
+    assert advance_to(wheel, 3) == [("call:a", ("call_setup", "a"))]
+    assert len(wheel) == 0
+
+
+def test_delays_round_up_to_whole_ticks(server):
+    wheel = server.TimerWheel(tick=0.5)
+    wheel.schedule("soon", 0)
+    wheel.schedule("partial", 1.2)
+    assert fire_ticks(wheel, 5) == {"soon": 1, "partial": 3}
+
+
+def test_cascades_from_higher_levels(server):
+    # Level spans are 1, 4 and 16 ticks, so these delays start in every level
+    wheel = server.TimerWheel(tick=1.0, slots=4, levels=3)
+    delays = {f"timer:{delay}": delay for delay in (1, 3, 4, 5, 15, 16, 17, 33, 47, 63)}
+    for key, delay in delays.items():
+        wheel.schedule(key, delay)
+    assert fire_ticks(wheel, 70) == delays
+
+
+def test_far_future_timers_fire_on_time(server):
+    # The wheel spans 16 ticks; later timers park and are re-placed on cascade
+    wheel = server.TimerWheel(tick=1.0, slots=4, levels=2)
+    wheel.schedule("far", 100)
+    wheel.schedule("farther", 1000)
+    assert fire_ticks(wheel, 1001) == {"far": 100, "farther": 1000}
+
+
+def test_matches_a_sorted_schedule(server):
+    rng = random.Random(7)
+    wheel = server.TimerWheel(tick=1.0, slots=4, levels=3)
+    expected, fired = {}, {}
+    # Schedule in rounds so timers are placed from many cursor positions
+    for round_start in range(0, 200, 20):
+        fired.update(fire_ticks(wheel, round_start))
+        for index in range(10):
+            key = f"t{round_start}-{index}"
+            delay = rng.randint(1, 300)
+            wheel.schedule(key, delay)
+            expected[key] = round_start + delay
+    fired.update(fire_ticks(wheel, 600))
+    assert fired == expected
+    assert len(wheel) == 0
+
+
+def test_cancel_and_reschedule(server):
+    wheel = server.TimerWheel(tick=1.0, slots=4, levels=2)
+    wheel.schedule("cancelled", 10)
+    wheel.schedule("moved", 10)
+    assert wheel.cancel("cancelled")
+    assert not wheel.cancel("cancelled")
+    wheel.schedule("moved", 3)
+    assert "moved" in wheel
+    assert fire_ticks(wheel, 20) == {"moved": 3}
+
+
+def remaining(reaper, key):
+    return reaper.wheel.timers[key][0] - reaper.wheel.current
+
+
+def test_reaper_deadlines(server):
+    reaper = server.StateReaper(call_setup_timeout=60, waiting_timeout=3600, waiting_grace=120,
+                                assignment_timeout=90, consultation_timeout=600)
+    reaper.patient_waiting("c1")
+    assert remaining(reaper, "waiting:c1") == 3600
+    reaper.patient_disconnected("c1")
+    assert remaining(reaper, "waiting:c1") == 120
+    # Rejoining after a reconnect restores the full timeout
+    reaper.patient_waiting("c1")
+    assert remaining(reaper, "waiting:c1") == 3600
+    reaper.patient_left("c1")
+    assert "waiting:c1" not in reaper.wheel
+
+    reaper.consultation_assigned("c2")
+    assert remaining(reaper, "assignment:c2") == 90
+    reaper.consultation_started("c3", elapsed=500)
+    assert remaining(reaper, "consultation:c3") == 100
+    reaper.call_started("call1")
+    reaper.call_accepted("call1", "c4")
+    assert "call:call1" not in reaper.wheel
+    assert remaining(reaper, "consultation:c4") == 600
+
+
+class FlakyConsultations:
+    def __init__(self, failures):
+        self.failures = failures
+        self.updates = []
+
+    async def update_many(self, query, update):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mongo unavailable")
+        self.updates.append(query)
+        return type("Result", (), {"modified_count": len(query["id"]["$in"])})()
+
+
+def test_reaper_keeps_abandoned_consultations_when_the_update_fails(server, monkeypatch):
+    consultations = FlakyConsultations(failures=1)
+    monkeypatch.setattr(server.mongo, "_db", type("FakeDb", (), {"consultations": consultations})())
+    reaper = server.StateReaper()
+    reaper.abandoned = {"c1": "waiting", "c2": "in_progress"}
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(reaper.flush())
+    assert reaper.abandoned == {"c1": "waiting", "c2": "in_progress"}
+
+    asyncio.run(reaper.flush())
+    assert reaper.abandoned == {}
+    assert [query["status"] for query in consultations.updates] == ["waiting", "in_progress"]
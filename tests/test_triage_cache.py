@@ -0,0 +1,54 @@
+"""Similarity tier of the triage cache
+
+Seeds a TriageCache with assessments and checks what it serves at the
+default threshold. Paraphrased presentations must hit, from either tier.
+Presentations that differ clinically, by one symptom, by medical
+history or by gender, must miss. Low-confidence assessments must never be cached.
+"""
+
+import pytest
+
+
+def record(symptoms, location="head", history=(), duration="2 days", gender=None):
+    return {"location": location, "symptoms": symptoms, "associated_symptoms": [], "severity": 5,
+            "duration": duration, "medical_history": list(history), "age": 40, "gender": gender}
+
+
+def assessment(urgency="Routine", confidence=0.85):
+    return {"analysis": "", "urgency_level": urgency, "confidence_score": confidence,
+            "recommended_actions": [], "follow_up_questions": []}
+
+
+@pytest.fixture
+def cache(server):
+    cache = server.TriageCache()
+    cache.add(record(["headache", "nausea"]), assessment())
+    cache.add(record(["sore throat", "fever"], location="throat"), assessment("Self-Care"))
+    cache.add(record(["cough"], location="chest"), assessment(confidence=0.3))
+    return cache
+
+
+@pytest.mark.parametrize("symptoms", [
+    record(["nausea and head pain"]),
+    record(["nausea", "headache"], duration="two days"),
+    record(["fever", "throat pain"], location="throat"),
+], ids=["paraphrase", "reworded_duration", "reworded_throat"])
+def test_paraphrases_hit(cache, symptoms):
+    assert cache.lookup(symptoms) is not None
+
+
+def test_regrouped_symptoms_hit_the_similarity_tier(cache):
+    regrouped = dict(record(["head pain"]), associated_symptoms=["nauseous"])
+    assert cache.lookup(regrouped) is not None
+    assert cache.stats["similar_hits"] == 1
+
+
+@pytest.mark.parametrize("symptoms", [
+    record(["headache", "nausea", "blurred vision"]),
+    record(["head injury", "nausea"]),
+    record(["headache", "nausea"], history=["hypertension"]),
+    record(["headache", "nausea"], gender="female"),
+    record(["cough"], location="chest"),
+], ids=["extra_symptom", "different_symptom", "risky_history", "other_gender", "low_confidence"])
+def test_different_presentations_miss(cache, symptoms):
+    assert cache.lookup(symptoms) is None
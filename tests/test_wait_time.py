@@ -0,0 +1,105 @@
+"""Queue wait estimates
+
+RunningStat must follow the exponentially weighted mean and variance.
+WaitTimeEstimator must fall back to its prior with no history, blend the
+prior out over the first PRIOR_WEIGHT consultations, use an urgency level's
+own durations only once it has enough of them, and scale the estimate and
+its band by queue position and the number of providers on shift.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+STARTED = datetime(2026, 1, 5, 9, 0)
+
+
+def record(estimator, minutes, urgency="Routine", count=1):
+    for _ in range(count):
+        estimator.record(STARTED, STARTED + timedelta(minutes=minutes), urgency)
+
+
+@pytest.fixture
+def presence(server):
+    return server.ProviderPresence()
+
+
+@pytest.fixture
+def estimator(server, presence):
+    return server.WaitTimeEstimator(presence)
+
+
+def test_running_stat_is_exponentially_weighted(server):
+    stat = server.RunningStat(alpha=0.05)
+    stat.add(10)
+    assert (stat.mean, stat.var) == (10, 0)
+    stat.add(20)
+    assert stat.mean == pytest.approx(10.5)
+    assert stat.var == pytest.approx(0.95 * 10 * 0.5)
+    stat.add(10.5)
+    assert stat.mean == pytest.approx(10.5)
+    assert stat.var == pytest.approx(0.95 * 0.95 * 5)
+
+
+def test_running_stat_tracks_recent_values(server):
+    stat = server.RunningStat(alpha=0.05)
+    for _ in range(200):
+        stat.add(10)
+    for _ in range(200):
+        stat.add(30)
+    assert stat.mean == pytest.approx(30, abs=0.01)
+    assert stat.var < 0.1
+
+
+def test_prior_without_history(server, estimator):
+    assert estimator.service_time("Urgent") == (server.WaitTimeEstimator.PRIOR_MEAN_MIN,
+                                                server.WaitTimeEstimator.PRIOR_STD_MIN)
+
+
+def test_invalid_durations_are_ignored(estimator):
+    estimator.record(STARTED, STARTED, "Routine")
+    estimator.record(None, STARTED, "Routine")
+    assert estimator.durations == {}
+
+
+def test_prior_is_blended_out_over_the_first_consultations(estimator):
+    record(estimator, 20, count=2)
+    # Two of five samples: 40% observed, 60% prior
+    mean, std = estimator.service_time("Routine")
+    assert mean == pytest.approx(0.4 * 20 + 0.6 * 12)
+    assert std == pytest.approx(0.6 * 6)
+    record(estimator, 20, count=3)
+    assert estimator.service_time("Routine") == (20, 0)
+
+
+def test_urgency_level_needs_enough_samples_of_its_own(estimator):
+    record(estimator, 20, count=5)
+    record(estimator, 40, urgency="Urgent", count=2)
+    overall = estimator.durations["all"]
+    assert estimator.service_time("Urgent") == pytest.approx((overall.mean, math.sqrt(overall.var)))
+    record(estimator, 40, urgency="Urgent", count=3)
+    assert estimator.service_time("Urgent") == (40, 0)
+    # Consultations without an urgency level count as Routine
+    assert estimator.service_time(None) == estimator.service_time("Routine")
+
+
+def test_capacity_counts_online_providers(presence, estimator):
+    assert estimator.capacity() == 1
+    presence.profiles = {"p1": {"status": "available"}, "p2": {"status": "available"}, "p3": {"status": "busy"}}
+    assert estimator.capacity() == 2
+    presence.sockets = {"p1": {"s1"}, "p2": {"s2"}, "p3": {"s3", "s4"}, "p4": set()}
+    assert estimator.capacity() == 3
+
+
+def test_estimate_scales_with_position_and_providers(presence, estimator):
+    # Prior: 12 min +/- 1.28 * 6 for the first patient with one provider
+    assert estimator.estimate(0, "Routine") == {"low": 4, "expected": 12, "high": 20}
+    # Four service times shared by two providers; the spread grows with sqrt(4)
+    presence.sockets = {"p1": {"s1"}, "p2": {"s2"}}
+    assert estimator.estimate(3, "Routine") == {"low": 16, "expected": 24, "high": 32}
+
+
+def test_format_wait(server):
+    assert server.format_wait({"low": 0, "expected": 0, "high": 1}) == "less than a minute"
+    assert server.format_wait({"low": 4, "expected": 12, "high": 20}) == "4-20 minutes"